@@ -15,16 +15,17 @@ class BrandAdmin(admin.ModelAdmin):
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'price', 'stock_quantity', 'category', 'created_at', 'updated_at')
-    search_fields = ('name',)
+    list_display = ('name', 'sku', 'price', 'stock_quantity', 'category', 'created_at', 'updated_at')
+    search_fields = ('name', 'sku')
     list_filter = ('category',)
 
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ('user', 'order_date', 'status', 'created_at')
+    list_display = ('user', 'order_date', 'status', 'grand_total', 'created_at')
     search_fields = ('user__username', 'status')
     list_filter = ('status',)
+    readonly_fields = ('status',)
 
 
 @admin.register(OrderItem)
@@ -52,6 +53,35 @@ class CartItemAdmin(admin.ModelAdmin):
     search_fields = ('cart__id', 'product__name')
 
 
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ('user', 'product', 'quantity', 'expires_at')
+    search_fields = ('user__username', 'product__name')
+
+
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    list_display = ('scope', 'key', 'user', 'status_code', 'created_at', 'expires_at')
+    list_filter = ('scope',)
+    search_fields = ('key', 'user__username')
+
+
+@admin.register(OrderStatusTransition)
+class OrderStatusTransitionAdmin(admin.ModelAdmin):
+    list_display = ('order', 'from_status', 'to_status', 'changed_by', 'source', 'created_at')
+    list_filter = ('to_status', 'source')
+    search_fields = ('order__id',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(ShippingMethod)
 class ShippingMethodAdmin(admin.ModelAdmin):
     list_display = ('name', 'rate')
@@ -0,0 +1,146 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Sum, Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework import serializers
+
+from .models import (
+  Order, OrderItem, AMOUNT_FIELD, RollupWatermark,
+  DailyProductSales, DailyCategorySales, DailyBrandSales,
+)
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+WATERMARK = 'daily-sales'
+BATCH_SIZE = 5000
+
+# Orders younger than this are left for the next run, so transactions that
+# commit slightly out of id order are not skipped by the watermark.
+COMMIT_LAG = timedelta(minutes=2)
+
+# (rollup model, rollup field, order item lookup)
+ROLLUPS = [
+  (DailyProductSales, 'product', 'product_id'),
+  (DailyCategorySales, 'category', 'product__category_id'),
+  (DailyBrandSales, 'brand', 'product__brand_id'),
+]
+
+
+def _aggregate(first_id, last_id, lookup):
+  """Per-day units, revenue and distinct orders for the order id range, grouped in the database."""
+  return (
+    OrderItem.objects.filter(order_id__gt=first_id, order_id__lte=last_id)
+    .annotate(day=TruncDate('order__order_date'))
+    .values('day', lookup)
+    .annotate(
+      units=Sum('quantity'),
+      revenue=Sum(F('price') * F('quantity'), output_field=AMOUNT_FIELD),
+      order_count=Count('order_id', distinct=True),
+    )
+    .order_by()
+  )
+
+
+def _merge(model, field, lookup, rows):
+  """Add aggregated rows onto the stored rollups with one read and one upsert."""
+  totals = {(row[lookup], row['day']): row for row in rows}
+  if not totals:
+    return 0
+
+  existing = {
+    (getattr(rollup, f'{field}_id'), rollup.day): rollup
+    for rollup in model.objects.filter(**{
+      f'{field}_id__in': {key for key, _ in totals},
+      'day__in': {day for _, day in totals},
+    })
+  }
+
+  rollups = []
+  for (key, day), row in totals.items():
+    current = existing.get((key, day))
+    rollups.append(model(**{
+      f'{field}_id': key,
+      'day': day,
+      'units': row['units'] + (current.units if current else 0),
+      'revenue': row['revenue'] + (current.revenue if current else 0),
+      'orders': row['order_count'] + (current.orders if current else 0),
+    }))
+  model.objects.bulk_create(
+    rollups,
+    update_conflicts=True,
+    unique_fields=[field, 'day'],
+    update_fields=['units', 'revenue', 'orders'],
+  )
+  return len(rollups)
+
+
+def update_rollups(batch_size=BATCH_SIZE, lag=COMMIT_LAG):
+  """
+  Fold orders placed since the watermark into the daily product, category
+  and brand rollups; returns the number of orders processed.
+
+  Each batch covers a contiguous order id range, is grouped in three
+  aggregate queries over that range only, and advances the watermark in
+  the same transaction as the rollup writes, so every order is counted
+  exactly once. Orders are counted as placed; later cancellations are not
+  subtracted (use ``rebuild_rollups`` to recount history).
+  """
+  RollupWatermark.objects.get_or_create(name=WATERMARK)
+  cutoff = timezone.now() - lag
+  processed = 0
+
+  while True:
+    with transaction.atomic():
+      watermark = RollupWatermark.objects.select_for_update().get(name=WATERMARK)
+      first_id = watermark.last_order_id
+      candidates = Order.objects.filter(id__gt=first_id).order_by('id').values_list('id', 'created_at')[:batch_size]
+
+      last_id = None
+      count = 0
+      for order_id, created_at in candidates:
+        if created_at > cutoff:
+          break
+        last_id = order_id
+        count += 1
+      if last_id is None:
+        break
+
+      for model, field, lookup in ROLLUPS:
+        _merge(model, field, lookup, _aggregate(first_id, last_id, lookup))
+      watermark.last_order_id = last_id
+      watermark.save(update_fields=['last_order_id', 'updated_at'])
+
+    processed += count
+    logger.info(f"Rolled up orders {first_id + 1}..{last_id} ({count} orders).")
+
+  return processed
+
+
+def rebuild_rollups(batch_size=BATCH_SIZE, lag=COMMIT_LAG):
+  """Drop every rollup and recount all orders from the start."""
+  with transaction.atomic():
+    for model, _, _ in ROLLUPS:
+      model.objects.all().delete()
+    RollupWatermark.objects.update_or_create(name=WATERMARK, defaults={'last_order_id': 0})
+  return update_rollups(batch_size=batch_size, lag=lag)
+
+
+def filter_days(queryset, params):
+  """Apply the ``from``/``to`` (YYYY-MM-DD, inclusive) query parameters."""
+  for param, lookup in (('from', 'day__gte'), ('to', 'day__lte')):
+    value = params.get(param)
+    if not value:
+      continue
+    try:
+      day = parse_date(value)
+    except ValueError:
+      day = None
+    if day is None:
+      raise serializers.ValidationError({param: "Must be a date (YYYY-MM-DD)."})
+    queryset = queryset.filter(**{lookup: day})
+  return queryset
@@ -0,0 +1,302 @@
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import APIException
+
+from .models import Cart, CartItem, Product
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Dirty cart ids are spread over several sets so markers for different carts rarely share a lock.
+DIRTY_SHARDS = 16
+DEFAULT_TIMEOUT = timedelta(days=7)
+LOCK_TIMEOUT = 5
+LOCK_WAIT = 2.0
+
+
+class CartBusy(APIException):
+  status_code = 409
+  default_detail = "The cart is being updated; please retry."
+
+
+def is_shared():
+  """Whether every web and Celery process sees the same cache, i.e. it is not LocMem or dummy."""
+  return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def store_timeout():
+  return int(getattr(settings, 'CART_STORE_TIMEOUT', DEFAULT_TIMEOUT).total_seconds())
+
+
+def cart_key(cart_id):
+  return f'cart-store:cart:{cart_id}'
+
+
+def user_carts_key(user_id):
+  return f'cart-store:user:{user_id}'
+
+
+@contextmanager
+def _locked(name):
+  """Short cache lock (``add`` is atomic on every backend) around a read-modify-write."""
+  key = f'cart-store:lock:{name}'
+  deadline = time.monotonic() + LOCK_WAIT
+  while not cache.add(key, 1, LOCK_TIMEOUT):
+    if time.monotonic() > deadline:
+      raise CartBusy(f"Timed out waiting for {key}.")
+    time.sleep(0.005)
+  try:
+    yield
+  finally:
+    cache.delete(key)
+
+
+def _hydrate(cart_id):
+  user_id = Cart.objects.filter(id=cart_id).values_list('user_id', flat=True).first()
+  if user_id is None:
+    return None
+  items = {}
+  for product_id, quantity in CartItem.objects.filter(cart_id=cart_id).values_list('product_id', 'quantity'):
+    items[product_id] = items.get(product_id, 0) + quantity
+  return {'user': user_id, 'items': items, 'version': 0, 'dirty': False}
+
+
+def _load(cart_id):
+  entry = cache.get(cart_key(cart_id))
+  if entry is None:
+    entry = _hydrate(cart_id)
+    if entry is not None:
+      cache.add(cart_key(cart_id), entry, store_timeout())
+  return entry
+
+
+def dirty_key(shard):
+  return f'cart-store:dirty:{shard}'
+
+
+def _mark_dirty(cart_id):
+  shard = cart_id % DIRTY_SHARDS
+  with _locked(f'dirty:{shard}'):
+    dirty = cache.get(dirty_key(shard)) or set()
+    if cart_id not in dirty:
+      dirty.add(cart_id)
+      cache.set(dirty_key(shard), dirty, None)
+
+
+def get(cart_id):
+  """
+  Return ``{'user': user_id, 'items': {product_id: quantity}, ...}`` for a
+  cart, loading it from the database only on a cache miss, or ``None`` if
+  the cart does not exist.
+  """
+  return _load(cart_id)
+
+
+def _persist(cart_id, entry, was_dirty):
+  if not is_shared():
+    # The flush task runs in another process and cannot see this cache; write through now.
+    flush(cart_id, entry)
+  elif not was_dirty:
+    # A cart already dirty is listed until the next flush; only its first edit touches the set.
+    _mark_dirty(cart_id)
+
+
+def _set_line(cart_id, product_id, quantity_of, hold=None):
+  """
+  Set one line to ``quantity_of(current_quantity)`` (0 removes it). ``hold``,
+  if given, is called with the cached entry and the new quantity under the
+  same lock, so it sees exactly the quantity being written; if it raises,
+  the cart is left unchanged.
+  """
+  with _locked(cart_id):
+    entry = _load(cart_id)
+    if entry is None:
+      return None
+    quantity = quantity_of(entry['items'].get(product_id, 0))
+    if hold is not None:
+      hold(entry, quantity)
+    was_dirty = entry['dirty']
+    if quantity > 0:
+      entry['items'][product_id] = quantity
+    else:
+      entry['items'].pop(product_id, None)
+    entry['version'] += 1
+    entry['dirty'] = True
+    cache.set(cart_key(cart_id), entry, store_timeout())
+  _persist(cart_id, entry, was_dirty)
+  return entry
+
+
+def add(cart_id, product_id, quantity, hold=None):
+  return _set_line(cart_id, product_id, lambda current: current + quantity, hold)
+
+
+def update(cart_id, product_id, quantity, hold=None):
+  return _set_line(cart_id, product_id, lambda current: quantity, hold)
+
+
+def remove(cart_id, product_id, hold=None):
+  return update(cart_id, product_id, 0, hold)
+
+
+def invalidate(cart_id):
+  """Drop a clean cached cart so the next read reloads it from the database."""
+  with _locked(cart_id):
+    entry = cache.get(cart_key(cart_id))
+    if entry is not None and not entry['dirty']:
+      cache.delete(cart_key(cart_id))
+
+
+def forget(cart_ids):
+  """Drop deleted carts from the cache in one call."""
+  cache.delete_many([cart_key(cart_id) for cart_id in cart_ids])
+
+
+def user_cart_ids(user_id):
+  """The user's cart ids, cached until one of their carts is created or deleted."""
+  return cache.get_or_set(
+    user_carts_key(user_id),
+    lambda: list(Cart.objects.filter(user_id=user_id).order_by('id').values_list('id', flat=True)),
+    store_timeout(),
+  )
+
+
+def user_carts_changed(user_id):
+  cache.delete(user_carts_key(user_id))
+
+
+def user_quantities(user_id, product_ids, exclude_cart=None):
+  """
+  ``{product_id: quantity}`` across the user's carts as the store sees them;
+  with every cart cached this reads nothing from the database.
+  """
+  totals = dict.fromkeys(product_ids, 0)
+  cart_ids = [cart_id for cart_id in user_cart_ids(user_id) if cart_id != exclude_cart]
+  cached = cache.get_many([cart_key(cart_id) for cart_id in cart_ids])
+  for cart_id in cart_ids:
+    entry = cached.get(cart_key(cart_id)) or _load(cart_id)
+    if entry is None:
+      continue
+    for product_id in totals:
+      totals[product_id] += entry['items'].get(product_id, 0)
+  return totals
+
+
+def discard_products(user_id, product_ids):
+  """
+  Remove purchased products from the user's cached carts. This is an edit
+  like any other: the version moves on, so a flush still writing an older
+  snapshot cannot leave the purchased lines behind in the database.
+  """
+  product_ids = set(product_ids)
+  for cart_id in Cart.objects.filter(user_id=user_id).values_list('id', flat=True):
+    with _locked(cart_id):
+      entry = cache.get(cart_key(cart_id))
+      if entry is None or not product_ids & entry['items'].keys():
+        continue
+      was_dirty = entry['dirty']
+      for product_id in product_ids:
+        entry['items'].pop(product_id, None)
+      entry['version'] += 1
+      entry['dirty'] = True
+      cache.set(cart_key(cart_id), entry, store_timeout())
+    _persist(cart_id, entry, was_dirty)
+
+
+def flush(cart_id, entry=None):
+  """
+  Write a cached cart (or the given ``entry``) back to ``CartItem`` with at
+  most one bulk delete, update and insert. Lines for products that no longer
+  exist are dropped. Returns ``False`` if there was nothing to write.
+  """
+  if entry is None:
+    entry = cache.get(cart_key(cart_id))
+  if entry is None or not entry['dirty']:
+    return False
+
+  items = dict(entry['items'])
+  existing_products = set(Product.objects.filter(id__in=list(items)).values_list('id', flat=True))
+  items = {product_id: quantity for product_id, quantity in items.items() if product_id in existing_products}
+
+  with transaction.atomic():
+    if not Cart.objects.select_for_update().filter(id=cart_id).exists():
+      cache.delete(cart_key(cart_id))
+      return False
+
+    lines = {}
+    stale = []
+    for line in CartItem.objects.filter(cart_id=cart_id).order_by('id'):
+      if line.product_id in items and line.product_id not in lines:
+        lines[line.product_id] = line
+      else:
+        stale.append(line.id)
+
+    changed = []
+    for product_id, line in lines.items():
+      if line.quantity != items[product_id]:
+        line.quantity = items[product_id]
+        changed.append(line)
+
+    if stale:
+      CartItem.objects.filter(id__in=stale).delete()
+    if changed:
+      CartItem.objects.bulk_update(changed, ['quantity'])
+    CartItem.objects.bulk_create([
+      CartItem(cart_id=cart_id, product_id=product_id, quantity=quantity)
+      for product_id, quantity in items.items() if product_id not in lines
+    ])
+    Cart.objects.filter(id=cart_id).update(updated_at=timezone.now())
+
+  with _locked(cart_id):
+    current = cache.get(cart_key(cart_id))
+    if current is None:
+      return True
+    if current['version'] == entry['version']:
+      current['dirty'] = False
+      cache.set(cart_key(cart_id), current, store_timeout())
+      return True
+    # The cart changed while we were writing, so the database may now hold an
+    # older snapshot than a flush that already finished: write it again.
+    if not current['dirty']:
+      current['dirty'] = True
+      cache.set(cart_key(cart_id), current, store_timeout())
+  if is_shared():
+    _mark_dirty(cart_id)
+  else:
+    flush(cart_id)
+  return True
+
+
+def flush_user(user_id):
+  """Persist all of a user's carts now, e.g. before checkout reads them from the database."""
+  for cart_id in Cart.objects.filter(user_id=user_id).values_list('id', flat=True):
+    flush(cart_id)
+
+
+def flush_dirty():
+  """Persist every cart changed since the last run; returns the number written."""
+  dirty = set()
+  for shard in range(DIRTY_SHARDS):
+    with _locked(f'dirty:{shard}'):
+      dirty |= cache.get(dirty_key(shard)) or set()
+      cache.delete(dirty_key(shard))
+
+  flushed = 0
+  for cart_id in sorted(dirty):
+    try:
+      flushed += flush(cart_id)
+    except Exception as e:
+      logger.error(f"Error flushing cart {cart_id}: {e}")
+      _mark_dirty(cart_id)
+  if flushed:
+    logger.info(f"Flushed {flushed} carts to the database.")
+  return flushed
@@ -0,0 +1,108 @@
+import hashlib
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import F
+
+from .models import Product, ShippingMethod
+from . import cart_store, snapshots
+from .reservations import held_quantity
+from .stock_shards import current_stock
+from .versions import bump_version, get_version
+
+SHIPPING_VERSION_KEY = 'cart-summary:shipping'
+CENT = Decimal('0.01')
+# Stock-only writes and other users' holds do not retire summaries (as with the
+# listing snapshots), so the availability shown is at most this old.
+SUMMARY_TIMEOUT = 60
+
+
+def _money(amount):
+  return str(Decimal(amount).quantize(CENT))
+
+
+def shipping_changed():
+  """Retire the cached shipping methods after one is added, changed or removed."""
+  bump_version(SHIPPING_VERSION_KEY)
+
+
+def shipping_methods():
+  """``[(id, name, rate), ...]`` cheapest first, cached until a shipping method changes."""
+  return cache.get_or_set(
+    f"cart-summary:shipping-methods:{get_version(SHIPPING_VERSION_KEY)}",
+    lambda: list(ShippingMethod.objects.order_by('rate', 'id').values_list('id', 'name', 'rate')),
+    None,
+  )
+
+
+def build_summary(cart_id, user_id, items):
+  """
+  Price a cart from one query over its ``CartItem`` rows joined to their
+  products (price, live stock and other users' holds) plus the cached
+  shipping method list. ``items`` is the cart as the store sees it; products
+  in it without a row are reported as unavailable.
+  """
+  rows = (
+    Product.objects.filter(cartitem__cart_id=cart_id)
+    .annotate(quantity=F('cartitem__quantity'), stock=current_stock(), held=held_quantity(exclude_user=user_id))
+    .values_list('id', 'sku', 'name', 'price', 'quantity', 'stock', 'held')
+  )
+
+  lines = []
+  subtotal = Decimal('0')
+  found = set()
+  for product_id, sku, name, price, quantity, stock, held in rows:
+    found.add(product_id)
+    available = max(stock - held, 0)
+    line_total = price * quantity
+    subtotal += line_total
+    lines.append({
+      'product_id': product_id,
+      'sku': sku,
+      'name': name,
+      'quantity': quantity,
+      'unit_price': _money(price),
+      'line_total': _money(line_total),
+      'available': available,
+      'in_stock': quantity <= available,
+    })
+  lines.sort(key=lambda line: line['product_id'])
+
+  quotes = [
+    {'shipping_method': method_id, 'name': name, 'rate': _money(rate), 'total': _money(subtotal + rate)}
+    for method_id, name, rate in shipping_methods()
+  ]
+
+  return {
+    'cart': cart_id,
+    'lines': lines,
+    'unavailable_products': sorted(set(items) - found),
+    'item_count': sum(line['quantity'] for line in lines),
+    'subtotal': _money(subtotal),
+    'shipping_quotes': quotes,
+  }
+
+
+def summary_key(cart_id, items):
+  """
+  Key for a cart's summary: its lines as the store holds them plus the
+  catalog and shipping versions, all read from the cache, so checking it
+  needs no query. Any edit, product change or shipping change moves it.
+  """
+  lines = hashlib.md5(repr(sorted(items.items())).encode('utf-8')).hexdigest()
+  return f"cart-summary:{cart_id}:{snapshots.generation()}:{get_version(SHIPPING_VERSION_KEY)}:{lines}"
+
+
+def get_summary(cart_id, entry):
+  """
+  The summary for a cart-store entry, cached until the cart, a product or a
+  shipping method changes. Pending store edits are written first so the
+  ``CartItem`` rows match the entry.
+  """
+  key = summary_key(cart_id, entry['items'])
+  summary = cache.get(key)
+  if summary is None:
+    cart_store.flush(cart_id, entry)
+    summary = build_summary(cart_id, entry['user'], entry['items'])
+    cache.set(key, summary, SUMMARY_TIMEOUT)
+  return summary
@@ -0,0 +1,218 @@
+import gzip
+import json
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Min, Max
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.exceptions import NotFound
+
+from .models import Cart, CartItem, CustomUser, Product
+from . import cart_store, reservations
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+MODES = ('add', 'set')
+DEFAULT_MAX_AGE = timedelta(days=30)
+PURGE_CHUNK_SIZE = 1000
+
+
+def sync_store(*cart_ids):
+  # Write pending cart store edits before the SQL upsert and reload the cache once it commits.
+  for cart_id in cart_ids:
+    cart_store.flush(cart_id)
+    transaction.on_commit(lambda cart_id=cart_id: cart_store.invalidate(cart_id))
+
+
+def touch(*cart_ids):
+  """Record activity on carts whose lines were changed without saving the cart itself."""
+  Cart.objects.filter(id__in=cart_ids).update(updated_at=timezone.now())
+
+
+def _upsert(cart_id, quantities):
+  CartItem.objects.bulk_create(
+    [CartItem(cart_id=cart_id, product_id=product_id, quantity=quantity) for product_id, quantity in quantities.items()],
+    update_conflicts=True,
+    unique_fields=['cart', 'product'],
+    update_fields=['quantity'],
+  )
+
+
+def _add(cart_id, quantities):
+  """
+  Add ``quantities`` onto the cart's lines in the same statement that writes
+  them, ``INSERT ... ON CONFLICT DO UPDATE SET quantity = quantity + excluded``,
+  so no write in between can be lost.
+  """
+  if not quantities:
+    return
+  table = CartItem._meta.db_table
+  rows = ', '.join(['(%s, %s, %s)'] * len(quantities))
+  params = [value for product_id, quantity in quantities.items() for value in (cart_id, product_id, quantity)]
+  with connection.cursor() as cursor:
+    cursor.execute(
+      f"INSERT INTO {table} (cart_id, product_id, quantity) VALUES {rows} "
+      f"ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = {table}.quantity + excluded.quantity",
+      params,
+    )
+
+
+def _user_quantities(user_id, cart_id, product_ids):
+  """
+  The user's whole quantity of each product: the locked cart from the
+  database, their other carts as the cart store sees them.
+  """
+  quantities = cart_store.user_quantities(user_id, product_ids, exclude_cart=cart_id)
+  for product_id, quantity in CartItem.objects.filter(cart_id=cart_id, product_id__in=product_ids).values_list('product_id', 'quantity'):
+    quantities[product_id] += quantity
+  return quantities
+
+
+def _hold(user_id, cart_id, product_ids):
+  # Same holds as CartItemViewSet: the owner's whole quantity of each product across their carts.
+  reservations.reserve_many(CustomUser.objects.get(pk=user_id), _user_quantities(user_id, cart_id, product_ids))
+
+
+def upsert_lines(cart_id, lines, mode='add'):
+  """
+  Apply many ``(product_id, quantity)`` lines to a cart with one
+  ``INSERT ... ON CONFLICT (cart, product) DO UPDATE``. In ``add`` mode the
+  quantities are added to what is in the cart; in ``set`` mode they replace
+  it and a quantity of 0 removes the line. Returns the number of lines written.
+  """
+  if mode not in MODES:
+    raise ValueError(f"Unknown mode: {mode}")
+
+  quantities = {}
+  for product_id, quantity in lines:
+    quantities[product_id] = (quantities.get(product_id, 0) + quantity) if mode == 'add' else quantity
+
+  found = set(Product.objects.filter(id__in=list(quantities)).values_list('id', flat=True))
+  missing = sorted(set(quantities) - found)
+  if missing:
+    raise serializers.ValidationError({'items': f"Unknown products: {', '.join(map(str, missing))}."})
+
+  with transaction.atomic():
+    # Lock the cart so concurrent batches on it apply one after the other.
+    user_id = Cart.objects.select_for_update().filter(id=cart_id).values_list('user_id', flat=True).first()
+    if user_id is None:
+      raise NotFound("Cart does not exist.")
+    sync_store(cart_id)
+    product_ids = list(quantities)
+
+    if mode == 'add':
+      _add(cart_id, quantities)
+    else:
+      removed = [product_id for product_id, quantity in quantities.items() if quantity == 0]
+      if removed:
+        CartItem.objects.filter(cart_id=cart_id, product_id__in=removed).delete()
+        quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity}
+      _upsert(cart_id, quantities)
+    touch(cart_id)
+    _hold(user_id, cart_id, product_ids)
+
+  return len(quantities)
+
+
+def merge_carts(target_id, source_id):
+  """
+  Move every line of the source cart into the target, adding quantities for
+  products in both, and delete the source cart. Returns the number of lines
+  merged.
+  """
+  if target_id == source_id:
+    raise serializers.ValidationError({'source_cart': "Cannot merge a cart into itself."})
+
+  with transaction.atomic():
+    owners = dict(Cart.objects.select_for_update().filter(id__in=[target_id, source_id]).order_by('id').values_list('id', 'user_id'))
+    if len(owners) != 2:
+      raise NotFound("Cart does not exist.")
+    sync_store(source_id, target_id)
+
+    quantities = {}
+    for product_id, quantity in CartItem.objects.filter(cart_id=source_id).values_list('product_id', 'quantity'):
+      quantities[product_id] = quantities.get(product_id, 0) + quantity
+    _add(target_id, quantities)
+    Cart.objects.filter(id=source_id).delete()
+    touch(target_id)
+
+    if quantities:
+      # Move the holds with the lines: the source owner keeps only what their other carts still need.
+      if owners[source_id] != owners[target_id]:
+        remaining = cart_store.user_quantities(owners[source_id], list(quantities))
+        reservations.release(owners[source_id], [product_id for product_id, quantity in remaining.items() if not quantity])
+      _hold(owners[target_id], target_id, list(quantities))
+
+  logger.info(f"Merged {len(quantities)} lines from cart {source_id} into cart {target_id}.")
+  return len(quantities)
+
+
+def _archive_rows(cart_rows, items):
+  for cart_id, user_id, created_at, updated_at in cart_rows:
+    yield json.dumps({
+      'cart': cart_id,
+      'user': user_id,
+      'created_at': created_at,
+      'updated_at': updated_at,
+      'items': items.get(cart_id, []),
+    }, cls=DjangoJSONEncoder, separators=(',', ':')) + '\n'
+
+
+def purge_abandoned(max_age=None, chunk_size=PURGE_CHUNK_SIZE, archive_dir=None):
+  """
+  Delete carts (and their lines) not edited for ``max_age``, walking the
+  primary key range in chunks of ``chunk_size`` ids. Each chunk is one short
+  transaction that skips carts locked by a concurrent edit, so no lock is
+  held for long. With ``archive_dir`` the removed carts are first appended
+  to a gzipped NDJSON file there. Returns a report dict.
+  """
+  max_age = max_age or getattr(settings, 'ABANDONED_CART_MAX_AGE', DEFAULT_MAX_AGE)
+  cutoff = timezone.now() - max_age
+  bounds = Cart.objects.filter(updated_at__lt=cutoff).aggregate(first=Min('id'), last=Max('id'))
+
+  report = {'carts': 0, 'items': 0, 'chunks': 0, 'archive': None}
+  started = time.monotonic()
+  archive = None
+  if archive_dir and bounds['first'] is not None:
+    os.makedirs(archive_dir, exist_ok=True)
+    report['archive'] = os.path.join(archive_dir, f"abandoned-carts-{timezone.now():%Y%m%d-%H%M%S}.ndjson.gz")
+    archive = gzip.open(report['archive'], 'wt', encoding='utf-8')
+
+  try:
+    start = bounds['first']
+    while start is not None and start <= bounds['last']:
+      end = start + chunk_size
+      with transaction.atomic():
+        cart_rows = list(
+          Cart.objects.select_for_update(skip_locked=True)
+          .filter(id__gte=start, id__lt=end, updated_at__lt=cutoff)
+          .values_list('id', 'user_id', 'created_at', 'updated_at')
+        )
+        cart_ids = [row[0] for row in cart_rows]
+        if cart_ids:
+          if archive is not None:
+            items = {}
+            for cart_id, product_id, quantity in CartItem.objects.filter(cart_id__in=cart_ids).values_list('cart_id', 'product_id', 'quantity'):
+              items.setdefault(cart_id, []).append([product_id, quantity])
+            archive.writelines(_archive_rows(cart_rows, items))
+          report['items'] += CartItem.objects.filter(cart_id__in=cart_ids).delete()[0]
+          report['carts'] += Cart.objects.filter(id__in=cart_ids).delete()[0]
+          transaction.on_commit(lambda cart_ids=cart_ids: cart_store.forget(cart_ids))
+      report['chunks'] += 1
+      start = end
+  finally:
+    if archive is not None:
+      archive.close()
+
+  elapsed = time.monotonic() - started
+  report['seconds'] = round(elapsed, 3)
+  report['rows_per_second'] = round((report['carts'] + report['items']) / elapsed, 1) if elapsed else None
+  logger.info(f"Purged abandoned carts: {report}")
+  return report
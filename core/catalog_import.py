@@ -0,0 +1,270 @@
+import csv
+import json
+import time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .models import Product, Brand, Category
+from . import search
+from . import facets
+from . import stock_shards
+from .tasks import generate_image_variants
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'jsonl')
+
+UPDATE_FIELDS = ['name', 'brand', 'category', 'price', 'stock_quantity', 'updated_at']
+# Only overwritten on existing products when the feed carries the column.
+OPTIONAL_FIELDS = ['description', 'image']
+
+
+def detect_format(filename):
+  extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+  if extension in ('jsonl', 'ndjson'):
+    return 'jsonl'
+  if extension == 'csv':
+    return 'csv'
+  return None
+
+
+def iter_rows(stream, file_format):
+  """
+  Yield one record per feed line from a text stream without reading the whole
+  file. Unparseable JSON lines are yielded as ``None`` and reported as errors.
+  """
+  if file_format == 'csv':
+    yield from csv.DictReader(stream)
+  elif file_format == 'jsonl':
+    for line in stream:
+      line = line.strip()
+      if not line:
+        continue
+      try:
+        yield json.loads(line)
+      except ValueError:
+        yield None
+  else:
+    raise ValueError(f"Unsupported feed format: {file_format}")
+
+
+def iter_batches(rows, batch_size):
+  rows = iter(rows)
+  while True:
+    batch = list(islice(rows, batch_size))
+    if not batch:
+      return
+    yield batch
+
+
+class NameLookup:
+  """Case-insensitive name -> id map for brands or categories, built once per import."""
+
+  def __init__(self, model, name_field, create_missing=True):
+    self.model = model
+    self.name_field = name_field
+    self.create_missing = create_missing
+    self.ids = {
+      name.strip().lower(): pk
+      for pk, name in model.objects.values_list('id', name_field)
+    }
+
+  def resolve(self, name):
+    name = str(name or '').strip()
+    key = name.lower()
+    if not key:
+      return None
+    if key not in self.ids and self.create_missing:
+      self.ids[key] = self.model.objects.create(**{self.name_field: name}).id
+    return self.ids.get(key)
+
+
+def _clean(field_name, value, errors):
+  """Run the model field's own checks (length, digits) so bad rows fail here, not in bulk_create."""
+  try:
+    return Product._meta.get_field(field_name).clean(value, None)
+  except ValidationError as e:
+    errors[field_name] = ' '.join(e.messages)
+    return None
+
+
+def _parse_quantity(value):
+  """
+  A whole number from a CSV string or a JSON number, or ``None``. Booleans and
+  fractional values such as ``3.5`` are rejected rather than truncated.
+  """
+  if isinstance(value, bool):
+    return None
+  if isinstance(value, int):
+    return value
+  try:
+    quantity = Decimal(str(value).strip())
+  except (InvalidOperation, ValueError):
+    return None
+  if not quantity.is_finite() or quantity != quantity.to_integral_value():
+    return None
+  return int(quantity)
+
+
+def _build_product(row, brands, categories):
+  errors = {}
+
+  sku = str(row.get('sku') or '').strip()
+  if not sku:
+    errors['sku'] = "This field is required."
+  else:
+    _clean('sku', sku, errors)
+
+  name = str(row.get('name') or '').strip()
+  if not name:
+    errors['name'] = "This field is required."
+  else:
+    _clean('name', name, errors)
+
+  try:
+    price = Decimal(str(row.get('price')))
+    if price < 0:
+      errors['price'] = "Price cannot be negative."
+    else:
+      price = _clean('price', price, errors)
+  except (InvalidOperation, ValueError):
+    errors['price'] = "A valid price is required."
+
+  stock_quantity = _parse_quantity(row.get('stock_quantity'))
+  if stock_quantity is None:
+    errors['stock_quantity'] = "A valid stock quantity is required."
+  elif stock_quantity < 0:
+    errors['stock_quantity'] = "Stock quantity cannot be negative."
+  else:
+    _clean('stock_quantity', stock_quantity, errors)
+
+  brand_id = brands.resolve(row.get('brand'))
+  if brand_id is None:
+    errors['brand'] = "Unknown brand."
+
+  category_id = categories.resolve(row.get('category'))
+  if category_id is None:
+    errors['category'] = "Unknown category."
+
+  if errors:
+    return None, None, {'sku': sku, 'errors': errors}
+
+  update_fields = UPDATE_FIELDS + [field for field in OPTIONAL_FIELDS if field in row]
+  return Product(
+    sku=sku,
+    name=name,
+    brand_id=brand_id,
+    category_id=category_id,
+    description=str(row.get('description') or ''),
+    price=price,
+    stock_quantity=stock_quantity,
+    image=str(row.get('image') or ''),
+  ), update_fields, None
+
+
+def _queue_image_variants(product_ids):
+  for product_id in product_ids:
+    try:
+      generate_image_variants.delay(product_id)
+    except Exception as e:
+      logger.error(f"Error queueing image variants for product {product_id}: {e}")
+
+
+def import_batch(rows, brands, categories):
+  products = {}
+  update_fields = {}
+  errors = []
+  for row in rows:
+    if not isinstance(row, dict):
+      errors.append({'sku': '', 'errors': {'row': "Invalid record."}})
+      continue
+    product, fields, error = _build_product(row, brands, categories)
+    if error:
+      errors.append(error)
+    else:
+      # The last occurrence of a SKU within a batch wins.
+      products[product.sku] = product
+      update_fields[product.sku] = fields
+
+  if products:
+    # Rows are upserted in groups by the columns they carry, so a feed without
+    # e.g. an image column leaves existing images alone.
+    groups = {}
+    for sku, product in products.items():
+      groups.setdefault(tuple(update_fields[sku]), []).append(product)
+
+    with transaction.atomic():
+      previous_images = dict(Product.objects.filter(sku__in=list(products)).values_list('sku', 'image'))
+      for fields, group in groups.items():
+        Product.objects.bulk_create(
+          group,
+          update_conflicts=True,
+          unique_fields=['sku'],
+          update_fields=list(fields),
+        )
+      imported = Product.objects.filter(sku__in=list(products)).values_list('id', 'sku', 'image', 'image_variants', 'stock_shards')
+      product_ids = []
+      needs_variants = []
+      for product_id, sku, image, variants, sharded in imported:
+        product_ids.append(product_id)
+        if sharded:
+          # Sharded stock lives in the shard rows; the next rebalance would revert the upserted column.
+          stock_shards.set_total(product_id, products[sku].stock_quantity)
+        # bulk_create skips the post_save hook that queues variants for new or replaced images.
+        if image and (not variants or previous_images.get(sku) != image):
+          needs_variants.append(product_id)
+      search.index_products(product_ids)
+      if needs_variants:
+        transaction.on_commit(lambda: _queue_image_variants(needs_variants))
+
+  return len(products), errors
+
+
+def import_catalog(rows, batch_size=500, create_missing=True, on_batch=None):
+  """
+  Upsert products from an iterable of feed records, keyed on ``sku``.
+
+  Records are consumed lazily in batches of ``batch_size`` so memory stays
+  flat regardless of feed size. Brands and categories are resolved by name
+  through lookups built once per import. ``on_batch`` is called with a
+  report dict after every batch; the totals are returned.
+  """
+  brands = NameLookup(Brand, 'name', create_missing)
+  categories = NameLookup(Category, 'category_name', create_missing)
+
+  totals = {'batches': 0, 'rows': 0, 'imported': 0, 'failed': 0}
+  started = time.monotonic()
+
+  for number, batch in enumerate(iter_batches(rows, batch_size), start=1):
+    batch_started = time.monotonic()
+    imported, errors = import_batch(batch, brands, categories)
+    elapsed = time.monotonic() - batch_started
+
+    totals['batches'] = number
+    totals['rows'] += len(batch)
+    totals['imported'] += imported
+    totals['failed'] += len(errors)
+
+    report = {
+      'batch': number,
+      'rows': len(batch),
+      'imported': imported,
+      'failed': len(errors),
+      'rows_per_second': round(len(batch) / elapsed, 1) if elapsed else None,
+      'errors': errors,
+    }
+    if on_batch is not None:
+      on_batch(report)
+
+  facets.invalidate()
+
+  elapsed = time.monotonic() - started
+  totals['seconds'] = round(elapsed, 3)
+  totals['rows_per_second'] = round(totals['rows'] / elapsed, 1) if elapsed else None
+  logger.info(f"Catalog import finished: {totals}")
+  return totals
@@ -0,0 +1,18 @@
+from django.core.checks import Error, Tags, register
+
+from .cart_store import is_shared
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+  if is_shared():
+    return []
+  return [Error(
+    "The default cache is process-local.",
+    hint=(
+      "Set CACHE_URL to a shared cache such as Redis. With a process-local cache the cart store "
+      "writes every change through to the database, and listing snapshots, facet counts and "
+      "cache locks are not shared between web and Celery processes."
+    ),
+    id='core.E001',
+  )]
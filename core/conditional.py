@@ -0,0 +1,62 @@
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.db.models import Max, Count
+from django.http import Http404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+class ConditionalGetMixin:
+  """
+  ETag/Last-Modified support for ``list`` and ``retrieve``.
+
+  The validators are derived from ``MAX()`` of each ``conditional_fields``
+  timestamp plus the row count over the filtered queryset, computed in one
+  aggregate query. A matching ``If-None-Match``/``If-Modified-Since`` returns
+  304 before anything is fetched or serialized.
+  """
+  conditional_fields = ['updated_at']
+
+  def get_conditional_state(self, request, queryset):
+    aggregates = {f'max_{index}': Max(field) for index, field in enumerate(self.conditional_fields)}
+    state = queryset.order_by().aggregate(count=Count('id'), **aggregates)
+
+    timestamps = [state[key] for key in aggregates if state[key] is not None]
+    last_modified = max(timestamps) if timestamps else None
+
+    raw = '|'.join([
+      request.get_full_path(),
+      getattr(request, 'accepted_media_type', ''),
+      str(state['count']),
+      *(value.isoformat() for value in timestamps),
+    ])
+    etag = '"%s"' % hashlib.md5(raw.encode('utf-8')).hexdigest()
+    return etag, last_modified
+
+  def conditional_response(self, request, queryset, render, *args, **kwargs):
+    etag, last_modified = self.get_conditional_state(request, queryset)
+    last_modified = int(last_modified.timestamp()) if last_modified else None
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+      response = render(request, *args, **kwargs)
+
+    if response.status_code in (200, 304):
+      response['ETag'] = etag
+      if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+  def list(self, request, *args, **kwargs):
+    queryset = self.filter_queryset(self.get_queryset())
+    return self.conditional_response(request, queryset, super().list, *args, **kwargs)
+
+  def retrieve(self, request, *args, **kwargs):
+    lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+    try:
+      queryset = self.get_queryset().filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+    except (TypeError, ValueError, ValidationError):
+      # A malformed id is a missing object, as get_object_or_404 treats it.
+      raise Http404
+    return self.conditional_response(request, queryset, super().retrieve, *args, **kwargs)
@@ -0,0 +1,39 @@
+from rest_framework import serializers
+from rest_framework.exceptions import ErrorDetail
+
+
+def _error_details(data, code):
+  if isinstance(data, dict):
+    return {key: _error_details(value, code) for key, value in data.items()}
+  if isinstance(data, (list, tuple)):
+    return [_error_details(item, code) for item in data]
+  if isinstance(data, str):
+    return ErrorDetail(data, code)
+  return data
+
+
+def _error_codes(detail):
+  if isinstance(detail, dict):
+    return {key: _error_codes(value) for key, value in detail.items() if not _is_value(value)}
+  if isinstance(detail, list):
+    return [None if _is_value(item) else _error_codes(item) for item in detail]
+  return detail.code
+
+
+def _is_value(detail):
+  return not isinstance(detail, (dict, list, ErrorDetail))
+
+
+class StructuredValidationError(serializers.ValidationError):
+  """
+  A 400 whose ids and quantities stay numbers: ``ValidationError`` turns every
+  value into a message string. Messages still carry an error code; numbers
+  are left out of ``get_codes()``.
+  """
+
+  def __init__(self, detail, code=None):
+    super().__init__(code=code)
+    self.detail = _error_details(detail, code or self.default_code)
+
+  def get_codes(self):
+    return _error_codes(self.detail)
@@ -0,0 +1,159 @@
+import hashlib
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Case, When, Value, CharField, Count
+
+from .versions import bump_version, get_version
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+FACETS = ('category', 'brand', 'price')
+
+PRICE_BUCKETS = [
+  (Decimal('0'), Decimal('25')),
+  (Decimal('25'), Decimal('50')),
+  (Decimal('50'), Decimal('100')),
+  (Decimal('100'), Decimal('250')),
+  (Decimal('250'), None),
+]
+
+CACHE_TIMEOUT = 60 * 10
+VERSION_KEY = 'facets:version'
+UNSCOPED_VERSION_KEY = f'{VERSION_KEY}:unscoped'
+
+# Filters whose counts only a product in that category or brand can change.
+SCOPED_FILTERS = ('category', 'brand')
+
+# Query parameters that do not change which products match.
+IGNORED_PARAMS = ('page', 'page_size', 'cursor', 'ordering', 'facets')
+
+# Product fields that decide which facet a product counts under or which
+# search (``q``) it matches; cached counts are keyed by both.
+PRODUCT_FIELDS = frozenset({'category', 'category_id', 'brand', 'brand_id', 'price', 'name', 'description'})
+
+
+def bucket_label(low, high):
+  return f"{low}-{high}" if high is not None else f"{low}+"
+
+
+def price_bucket(price):
+  price = Decimal(str(price))
+  for low, high in PRICE_BUCKETS:
+    if price >= low and (high is None or price < high):
+      return bucket_label(low, high)
+  return None
+
+
+def _price_bucket_expression():
+  whens = []
+  for low, high in PRICE_BUCKETS:
+    condition = {'price__gte': low} if high is None else {'price__gte': low, 'price__lt': high}
+    whens.append(When(**condition, then=Value(bucket_label(low, high))))
+  return Case(*whens, default=Value(None), output_field=CharField())
+
+
+def compute_facets(queryset):
+  """
+  Count matching products per category, brand and price bucket with a single
+  GROUP BY over the three dimensions.
+  """
+  counts = {facet: {} for facet in FACETS}
+  rows = (
+    queryset.order_by()
+    .annotate(price_bucket=_price_bucket_expression())
+    .values('category_id', 'brand_id', 'price_bucket')
+    .annotate(count=Count('id'))
+  )
+  for row in rows:
+    for facet, key in (('category', row['category_id']), ('brand', row['brand_id']), ('price', row['price_bucket'])):
+      if key is None:
+        continue
+      key = str(key)
+      counts[facet][key] = counts[facet].get(key, 0) + row['count']
+  return counts
+
+
+def scope_key(facet, value):
+  """Version counter for the cached counts filtered to one category or brand."""
+  return f"{VERSION_KEY}:{facet}:{value}"
+
+
+def _scope_keys(params):
+  # Counts filtered to a category or brand only change with products in it;
+  # any other filter can match any product.
+  keys = []
+  for facet in SCOPED_FILTERS:
+    value = params.get(facet)
+    if value is not None and value.isdigit():
+      keys.append(scope_key(facet, int(value)))
+  return keys or [UNSCOPED_VERSION_KEY]
+
+
+def _cache_key(params):
+  items = sorted(
+    (key, value)
+    for key in params
+    if key not in IGNORED_PARAMS
+    for value in params.getlist(key)
+  )
+  digest = hashlib.md5(repr(items).encode('utf-8')).hexdigest() if items else 'base'
+  versions = ':'.join(str(get_version(key)) for key in [VERSION_KEY, *_scope_keys(params)])
+  return f"facets:{versions}:{digest}"
+
+
+def get_facets(queryset, params, facets=FACETS):
+  key = _cache_key(params)
+  counts = cache.get(key)
+  if counts is None:
+    counts = compute_facets(queryset)
+    cache.set(key, counts, CACHE_TIMEOUT)
+  return {facet: counts[facet] for facet in facets if facet in counts}
+
+
+def _facet_keys(values):
+  if values is None:
+    return {}
+  return {
+    'category': str(values['category_id']),
+    'brand': str(values['brand_id']),
+    'price': price_bucket(values['price']),
+    'name': values['name'],
+    'description': values['description'],
+  }
+
+
+def affects_facets(fields):
+  """Whether a queryset write to these Product fields can change cached counts."""
+  return fields is None or not PRODUCT_FIELDS.isdisjoint(fields)
+
+
+def invalidate():
+  """Retire every cached count; the next request per filter recomputes it."""
+  bump_version(VERSION_KEY)
+
+
+def product_changed(old, new):
+  """
+  Retire the cached facet counts a product change can affect: those not
+  filtered by category or brand, and those filtered to the product's
+  category or brand before or after the change. ``old``/``new`` hold the
+  ``category_id``, ``brand_id``, ``price``, ``name`` and ``description``
+  (``None`` for a create or delete). Counts filtered to other categories
+  and brands stay cached.
+
+  Counts are never adjusted in place: each bump is one atomic ``incr`` and
+  every entry has a finite TTL, so concurrent writers cannot lose updates
+  and counts cannot drift.
+  """
+  if _facet_keys(old) == _facet_keys(new):
+    return
+  keys = {UNSCOPED_VERSION_KEY}
+  for values in (old, new):
+    if values is not None:
+      keys.add(scope_key('category', values['category_id']))
+      keys.add(scope_key('brand', values['brand_id']))
+  for key in sorted(keys):
+    bump_version(key)
@@ -0,0 +1,148 @@
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+DEFAULT_TTL = timedelta(hours=24)
+# A claim whose request never finished (e.g. the worker died) can be taken over after this long.
+CLAIM_TIMEOUT = timedelta(minutes=5)
+STORED_CLIENT_ERRORS = (status.HTTP_400_BAD_REQUEST, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+
+def key_ttl():
+  return getattr(settings, 'IDEMPOTENCY_KEY_TTL', DEFAULT_TTL)
+
+
+def cache_key(scope, user_id, key):
+  return f"idempotency:{scope}:{user_id}:{hashlib.md5(key.encode('utf-8')).hexdigest()}"
+
+
+def request_fingerprint(request):
+  """Hash of who sent the request, where, and with what body."""
+  user_id = request.user.id if request.user.is_authenticated else None
+  body = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder, default=str)
+  raw = '|'.join([str(user_id), request.method, request.path, body])
+  return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _replay(fingerprint, stored):
+  stored_fingerprint, status_code, data = stored
+  if stored_fingerprint != fingerprint:
+    return Response(
+      {'error': f"{HEADER} was already used for a different request."},
+      status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+    )
+  response = Response(data, status=status_code)
+  response['Idempotent-Replayed'] = 'true'
+  return response
+
+
+def _stored(status_code):
+  # Only outcomes a retry would repeat are kept; conflicts, rate limits and server errors are retried.
+  return 200 <= status_code < 300 or status_code in STORED_CLIENT_ERRORS
+
+
+def _claim(scope, user, key, fingerprint):
+  """
+  Claim the key in a short transaction of its own. Returns ``(record, None)``
+  for a claimed key and ``(None, response)`` when the key already holds a
+  result or another request is still running with it.
+  """
+  now = timezone.now()
+  with transaction.atomic():
+    record, created = IdempotencyKey.objects.select_for_update().get_or_create(
+      scope=scope, user=user, key=key,
+      defaults={'fingerprint': fingerprint, 'expires_at': now + CLAIM_TIMEOUT},
+    )
+    if created:
+      return record, None
+    if record.expires_at > now:
+      if record.status_code is not None or record.fingerprint != fingerprint:
+        return None, _replay(fingerprint, (record.fingerprint, record.status_code, record.response))
+      return None, Response(
+        {'error': f"A request with this {HEADER} is still in progress."},
+        status=status.HTTP_409_CONFLICT,
+      )
+    # An expired key, or a claim whose request died, is claimed again.
+    record.fingerprint, record.status_code, record.response = fingerprint, None, None
+    record.expires_at = now + CLAIM_TIMEOUT
+    record.save(update_fields=['fingerprint', 'status_code', 'response', 'expires_at'])
+    return record, None
+
+
+def idempotent(scope, request, handler):
+  """
+  Run ``handler()`` at most once per ``Idempotency-Key`` header, user and
+  ``scope`` and replay its response for retries until the key expires.
+
+  Completed responses are served from the cache when possible and from the
+  ``IdempotencyKey`` table otherwise. A first request claims its key with a
+  short transaction and runs the handler outside it, so no lock is held
+  while e.g. a payment provider is called; a duplicate arriving meanwhile
+  gets a 409. Only 2xx responses and validation failures are stored; any
+  other outcome releases the key so the client can retry.
+  """
+  key = request.headers.get(HEADER)
+  if not key:
+    return handler()
+  if len(key) > MAX_KEY_LENGTH:
+    return Response(
+      {'error': f"{HEADER} must be at most {MAX_KEY_LENGTH} characters."},
+      status=status.HTTP_400_BAD_REQUEST,
+    )
+
+  user = request.user if request.user.is_authenticated else None
+  fingerprint = request_fingerprint(request)
+  stored = cache.get(cache_key(scope, user and user.id, key))
+  if stored is not None:
+    return _replay(fingerprint, stored)
+
+  record, response = _claim(scope, user, key, fingerprint)
+  if response is not None:
+    return response
+
+  release = IdempotencyKey.objects.filter(id=record.id, status_code__isnull=True)
+  try:
+    response = handler()
+  except BaseException:
+    release.delete()
+    raise
+  if not _stored(response.status_code):
+    release.delete()
+    return response
+
+  expires_at = timezone.now() + key_ttl()
+  release.update(status_code=response.status_code, response=response.data, expires_at=expires_at)
+  stored = (fingerprint, response.status_code, json.loads(json.dumps(response.data, cls=DjangoJSONEncoder)))
+  timeout = max(int((expires_at - timezone.now()).total_seconds()), 1)
+  transaction.on_commit(lambda: cache.set(cache_key(scope, user and user.id, key), stored, timeout))
+  return response
+
+
+def purge_expired(batch_size=1000):
+  """Delete expired keys in bounded batches; returns the number removed."""
+  removed = 0
+  now = timezone.now()
+  while True:
+    ids = list(IdempotencyKey.objects.filter(expires_at__lte=now).values_list('id', flat=True)[:batch_size])
+    if not ids:
+      break
+    removed += IdempotencyKey.objects.filter(id__in=ids).delete()[0]
+  if removed:
+    logger.info(f"Purged {removed} expired idempotency keys.")
+  return removed
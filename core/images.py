@@ -0,0 +1,68 @@
+import hashlib
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+VARIANT_DIR = 'product_img/variants'
+
+VARIANT_SIZES = {
+  'thumbnail': (150, 150),
+  'listing': (480, 480),
+}
+
+VARIANT_FORMATS = {
+  'webp': ('WEBP', {'quality': 80, 'method': 4}),
+  'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def _encode(image, image_format, options):
+  buffer = BytesIO()
+  image.save(buffer, format=image_format, **options)
+  return buffer.getvalue()
+
+
+def build_variants(image_field, storage=default_storage):
+  """
+  Render every size/format variant of an uploaded image and store it under a
+  name derived from the source content hash, so identical uploads share files
+  and the URLs can be cached forever. Returns ``{size: {format: path}}``.
+  """
+  with image_field.open('rb') as source_file:
+    data = source_file.read()
+  digest = hashlib.sha256(data).hexdigest()[:20]
+
+  with Image.open(BytesIO(data)) as source:
+    source = ImageOps.exif_transpose(source).convert('RGB')
+
+    variants = {}
+    for size_name, size in VARIANT_SIZES.items():
+      image = None
+      for extension, (image_format, options) in VARIANT_FORMATS.items():
+        path = f"{VARIANT_DIR}/{digest}_{size_name}.{extension}"
+        if not storage.exists(path):
+          if image is None:
+            image = ImageOps.fit(source, size, Image.Resampling.LANCZOS)
+          saved = storage.save(path, ContentFile(_encode(image, image_format, options)))
+          if saved != path:
+            # Another worker stored the same content first; drop our copy.
+            storage.delete(saved)
+        variants.setdefault(size_name, {})[extension] = path
+
+  return variants
+
+
+def variant_urls(variants, request=None, storage=default_storage):
+  urls = {}
+  for size_name, formats in (variants or {}).items():
+    urls[size_name] = {}
+    for extension, path in formats.items():
+      url = storage.url(path)
+      urls[size_name][extension] = request.build_absolute_uri(url) if request is not None else url
+  return urls
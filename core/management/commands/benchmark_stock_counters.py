@@ -0,0 +1,98 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F
+
+from core.models import Brand, Category, Product
+from core import stock_shards
+
+
+class Command(BaseCommand):
+  help = (
+    "Measure concurrent checkout throughput for one hot product, decrementing "
+    "the single stock_quantity row versus sharded stock counters."
+  )
+
+  def add_arguments(self, parser):
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--orders', type=int, default=2000, help="Decrements per run, split across threads.")
+    parser.add_argument('--shards', type=int, default=16)
+    parser.add_argument(
+      '--hold-ms', type=float, default=2.0,
+      help="Time each checkout transaction stays open after the decrement, standing in for the rest of the order writes.",
+    )
+
+  def handle(self, *args, **options):
+    if options['threads'] < 1 or options['orders'] < 1:
+      raise CommandError("--threads and --orders must be positive.")
+
+    brand = Brand.objects.create(name='benchmark')
+    category = Category.objects.create(category_name='benchmark')
+    product = Product.objects.create(
+      name='benchmark', brand=brand, category=category, description='',
+      image='', price=1, stock_quantity=options['orders'],
+    )
+    try:
+      single = self.run(product.id, options, self.single_row)
+      self.report('single row', single, options)
+
+      Product.objects.filter(id=product.id).update(stock_quantity=options['orders'])
+      stock_shards.enable(product.id, options['shards'])
+      sharded = self.run(product.id, options, stock_shards.take)
+      self.report(f"{options['shards']} shards", sharded, options)
+
+      left = stock_shards.rebalance(product.id)
+      if left != 0:
+        raise CommandError(f"Sharded run left {left} units in stock; expected 0.")
+      if single and sharded:
+        self.stdout.write(f"speedup: {single / sharded:.2f}x")
+    finally:
+      product.delete()
+      brand.delete()
+      category.delete()
+
+    if connection.vendor == 'sqlite':
+      self.stdout.write(self.style.WARNING(
+        "SQLite serializes all writers on one database lock, so shards cannot help here; "
+        "run against PostgreSQL to measure row-lock contention."
+      ))
+
+  @staticmethod
+  def single_row(product_id, quantity):
+    return bool(
+      Product.objects.filter(id=product_id, stock_quantity__gte=quantity)
+      .update(stock_quantity=F('stock_quantity') - quantity)
+    )
+
+  def run(self, product_id, options, decrement):
+    threads = options['threads']
+    per_thread = [options['orders'] // threads + (1 if index < options['orders'] % threads else 0) for index in range(threads)]
+    hold = options['hold_ms'] / 1000
+    failures = []
+
+    def worker(count):
+      try:
+        for _ in range(count):
+          with transaction.atomic():
+            if not decrement(product_id, 1):
+              failures.append(product_id)
+            time.sleep(hold)
+      finally:
+        connection.close()
+
+    workers = [threading.Thread(target=worker, args=(count,)) for count in per_thread]
+    started = time.monotonic()
+    for thread in workers:
+      thread.start()
+    for thread in workers:
+      thread.join()
+    elapsed = time.monotonic() - started
+
+    if failures:
+      raise CommandError(f"{len(failures)} decrements failed although stock was sufficient.")
+    return elapsed
+
+  def report(self, label, elapsed, options):
+    self.stdout.write(f"{label:>12}: {options['orders']} orders in {elapsed:.2f}s ({options['orders'] / elapsed:.0f} orders/s)")
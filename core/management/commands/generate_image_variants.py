@@ -0,0 +1,56 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core.models import Product
+from core.tasks import generate_image_variants
+
+
+def _process_chunk(product_ids):
+  generated = 0
+  for product_id in product_ids:
+    if generate_image_variants(product_id) is not None:
+      generated += 1
+  connections.close_all()
+  return len(product_ids), generated
+
+
+class Command(BaseCommand):
+  help = "Generate thumbnail and listing image variants for existing products."
+
+  def add_arguments(self, parser):
+    parser.add_argument('--workers', type=int, default=4, help="Number of worker processes.")
+    parser.add_argument('--chunk-size', type=int, default=100, help="Products handed to a worker at a time.")
+    parser.add_argument('--all', action='store_true', help="Regenerate variants for products that already have them.")
+
+  def handle(self, *args, **options):
+    queryset = Product.objects.exclude(image='')
+    if not options['all']:
+      queryset = queryset.filter(image_variants={})
+    product_ids = list(queryset.order_by('id').values_list('id', flat=True))
+
+    chunk_size = options['chunk_size']
+    chunks = [product_ids[i:i + chunk_size] for i in range(0, len(product_ids), chunk_size)]
+
+    # Worker processes must open their own database connections, and set Django
+    # up themselves when they are spawned rather than forked (macOS, Python 3.14+).
+    connections.close_all()
+
+    started = time.monotonic()
+    processed = generated = 0
+    with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as executor:
+      futures = [executor.submit(_process_chunk, chunk) for chunk in chunks]
+      for future in as_completed(futures):
+        chunk_processed, chunk_generated = future.result()
+        processed += chunk_processed
+        generated += chunk_generated
+        self.stdout.write(f"{processed}/{len(product_ids)} products processed")
+
+    elapsed = time.monotonic() - started
+    self.stdout.write(self.style.SUCCESS(
+      f"Generated variants for {generated} of {processed} products in {elapsed:.2f}s "
+      f"({processed / elapsed if elapsed else 0:.1f} products/s)."
+    ))
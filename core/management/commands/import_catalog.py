@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.catalog_import import FORMATS, detect_format, iter_rows, import_catalog
+
+
+class Command(BaseCommand):
+  help = "Stream a CSV or JSONL supplier feed into the catalog, upserting products by SKU."
+
+  def add_arguments(self, parser):
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=FORMATS, help="Feed format; detected from the file extension by default.")
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--no-create', action='store_true', help="Reject rows with unknown brands or categories instead of creating them.")
+
+  def handle(self, *args, **options):
+    file_format = options['format'] or detect_format(options['path'])
+    if file_format is None:
+      raise CommandError("Could not detect the feed format; pass --format.")
+    if options['batch_size'] < 1:
+      raise CommandError("--batch-size must be positive.")
+
+    def report(batch):
+      self.stdout.write(
+        f"batch {batch['batch']}: {batch['imported']} imported, {batch['failed']} failed "
+        f"({batch['rows_per_second']} rows/s)"
+      )
+      for error in batch['errors']:
+        self.stderr.write(f"  {error['sku'] or '<no sku>'}: {error['errors']}")
+
+    try:
+      with open(options['path'], encoding='utf-8', newline='') as stream:
+        totals = import_catalog(
+          iter_rows(stream, file_format),
+          batch_size=options['batch_size'],
+          create_missing=not options['no_create'],
+          on_batch=report,
+        )
+    except OSError as e:
+      raise CommandError(str(e))
+
+    self.stdout.write(self.style.SUCCESS(
+      f"Imported {totals['imported']} of {totals['rows']} rows in {totals['seconds']}s "
+      f"({totals['rows_per_second']} rows/s), {totals['failed']} failed."
+    ))
@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.carts import PURGE_CHUNK_SIZE, purge_abandoned
+
+
+class Command(BaseCommand):
+  help = "Delete carts that have not been edited for a while, optionally archiving them first."
+
+  def add_arguments(self, parser):
+    parser.add_argument('--days', type=int, help="Idle age in days; defaults to ABANDONED_CART_MAX_AGE.")
+    parser.add_argument('--chunk-size', type=int, default=PURGE_CHUNK_SIZE)
+    parser.add_argument('--archive-dir', default=getattr(settings, 'ABANDONED_CART_ARCHIVE_DIR', None))
+
+  def handle(self, *args, **options):
+    if options['chunk_size'] < 1:
+      raise CommandError("--chunk-size must be positive.")
+    if options['days'] is not None and options['days'] < 1:
+      raise CommandError("--days must be positive.")
+    max_age = timedelta(days=options['days']) if options['days'] else None
+
+    report = purge_abandoned(max_age=max_age, chunk_size=options['chunk_size'], archive_dir=options['archive_dir'])
+    self.stdout.write(self.style.SUCCESS(
+      f"Removed {report['carts']} carts and {report['items']} lines in {report['seconds']}s "
+      f"({report['rows_per_second']} rows/s)."
+    ))
+    if report['archive']:
+      self.stdout.write(f"Archived to {report['archive']}")
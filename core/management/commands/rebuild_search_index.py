@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from core import search
+
+
+class Command(BaseCommand):
+  help = "Rebuild the full-text product search index from the catalog tables."
+
+  def handle(self, *args, **options):
+    if not search.is_supported():
+      self.stdout.write(self.style.WARNING(f"Full-text search is not supported on {connection.vendor}; nothing to do."))
+      return
+
+    started = time.monotonic()
+    with transaction.atomic():
+      indexed = search.rebuild_index()
+    elapsed = time.monotonic() - started
+    self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} products in {elapsed:.2f}s."))
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.ratings import recompute_ratings
+
+
+class Command(BaseCommand):
+  help = "Recompute product rating aggregates from the review table."
+
+  def add_arguments(self, parser):
+    parser.add_argument('--product', type=int, action='append', dest='products', help="Only repair this product id (repeatable).")
+    parser.add_argument('--batch-size', type=int, default=1000)
+
+  def handle(self, *args, **options):
+    started = time.monotonic()
+    updated = recompute_ratings(options['products'], batch_size=options['batch_size'])
+    elapsed = time.monotonic() - started
+    self.stdout.write(self.style.SUCCESS(f"Recomputed ratings for {updated} products in {elapsed:.2f}s."))
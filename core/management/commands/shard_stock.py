@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Product
+from core import stock_shards
+
+
+class Command(BaseCommand):
+  help = "Split a hot product's stock across several counter rows, or fold it back into one."
+
+  def add_arguments(self, parser):
+    parser.add_argument('product', type=int, help="Product id.")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--shards', type=int, help=f"Number of counter rows (1-{stock_shards.MAX_SHARDS}).")
+    group.add_argument('--off', action='store_true', help="Go back to the single stock_quantity counter.")
+
+  def handle(self, *args, **options):
+    try:
+      if options['off']:
+        total = stock_shards.disable(options['product'])
+        self.stdout.write(self.style.SUCCESS(f"Product {options['product']} uses a single counter again ({total} in stock)."))
+      else:
+        total = stock_shards.enable(options['product'], options['shards'])
+        self.stdout.write(self.style.SUCCESS(f"Product {options['product']} stock ({total}) split across {options['shards']} shards."))
+    except Product.DoesNotExist:
+      raise CommandError(f"Product {options['product']} does not exist.")
+    except ValueError as e:
+      raise CommandError(str(e))
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.analytics import BATCH_SIZE, update_rollups, rebuild_rollups
+
+
+class Command(BaseCommand):
+  help = "Fold new orders into the daily product, category and brand sales rollups."
+
+  def add_arguments(self, parser):
+    parser.add_argument('--rebuild', action='store_true', help="Drop the rollups and recount every order.")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+  def handle(self, *args, **options):
+    if options['batch_size'] < 1:
+      raise CommandError("--batch-size must be positive.")
+    started = time.monotonic()
+    run = rebuild_rollups if options['rebuild'] else update_rollups
+    processed = run(batch_size=options['batch_size'])
+    elapsed = time.monotonic() - started
+    self.stdout.write(self.style.SUCCESS(f"Rolled up {processed} orders in {elapsed:.2f}s."))
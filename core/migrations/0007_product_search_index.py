@@ -0,0 +1,38 @@
+from django.db import migrations
+
+# The SQL is inlined so this migration does not change when core.search does.
+FTS_TABLE = 'core_product_fts'
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+        "USING fts5(name, description, brand, category, tokenize='unicode61 remove_diacritics 2')"
+    )
+    schema_editor.execute(f"DELETE FROM {FTS_TABLE}")
+    schema_editor.execute(
+        f"INSERT INTO {FTS_TABLE}(rowid, name, description, brand, category) "
+        "SELECT p.id, p.name, p.description, b.name, c.category_name "
+        "FROM core_product p "
+        "JOIN core_brand b ON b.id = p.brand_id "
+        "JOIN core_category c ON c.id = p.category_id"
+    )
+    schema_editor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
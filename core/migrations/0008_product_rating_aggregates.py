@@ -0,0 +1,73 @@
+# Generated by Django 5.0.7 on 2026-10-16 20:28
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    Product = apps.get_model('core', 'Product')
+    Review = apps.get_model('core', 'Review')
+
+    histograms = {}
+    rows = Review.objects.values('product_id', 'rating').annotate(count=Count('id')).order_by()
+    for row in rows:
+        if 1 <= row['rating'] <= 5:
+            histograms.setdefault(row['product_id'], {})[row['rating']] = row['count']
+
+    products = []
+    for product in Product.objects.filter(id__in=list(histograms)):
+        histogram = histograms[product.id]
+        for star in range(1, 6):
+            setattr(product, f'rating_{star}', histogram.get(star, 0))
+        product.rating_count = sum(histogram.values())
+        product.rating_total = sum(star * count for star, count in histogram.items())
+        products.append(product)
+
+    fields = ['rating_count', 'rating_total'] + [f'rating_{star}' for star in range(1, 6)]
+    Product.objects.bulk_update(products, fields, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.7 on 2026-10-16 20:48
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_cart_updated_at(apps, schema_editor):
+    # Existing carts have no recorded activity; start their grace period now
+    # rather than purging every old cart on the first nightly run.
+    Cart = apps.get_model('core', 'Cart')
+    Cart.objects.update(updated_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_unique_cart_product'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(backfill_cart_updated_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['updated_at'], name='core_cart_updated_ef9167_idx'),
+        ),
+    ]
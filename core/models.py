@@ -1,22 +1,41 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from django.db.models import F
+from django.db.models import F, Count, Sum, Value, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 import logging
 
 from .shipping import CarrierAPI
+from . import search
+from . import facets
+from . import snapshots
 
 logger = logging.getLogger(__name__)
 
 CustomUser = get_user_model()
 
 
+class LoadedValuesMixin:
+  """Remember the field values an instance was loaded with, for change tracking in signals."""
+
+  @classmethod
+  def from_db(cls, db, field_names, values):
+    instance = super().from_db(db, field_names, values)
+    instance._loaded_values = dict(zip(field_names, values))
+    return instance
+
+
+
 class Category(models.Model):
   category_name = models.CharField(max_length=200)
   created_at = models.DateTimeField(auto_now_add=True)
+  updated_at = models.DateTimeField(auto_now=True)
 
   def __str__(self):
     return self.category_name
@@ -30,26 +49,122 @@ class Category(models.Model):
 
 class Brand(models.Model):
   name = models.CharField(max_length=255)
+  updated_at = models.DateTimeField(auto_now=True)
 
   def __str__(self):
       return self.name 
 
 
 
-class Product(models.Model):
+class ProductQuerySet(models.QuerySet):
+  """
+  Queryset writes bypass model signals, so retire catalog snapshots and facet
+  counts here. Stock-only writes (orders, adjustments, shard rebalances)
+  leave snapshots alone, and only facet or search fields retire facet counts.
+  """
+
+  def update(self, **kwargs):
+    rows = super().update(**kwargs)
+    if rows and not snapshots.is_stock_only(kwargs):
+      snapshots.catalog_changed()
+    if rows and facets.affects_facets(kwargs):
+      facets.invalidate()
+    return rows
+
+  def bulk_create(self, *args, **kwargs):
+    objs = super().bulk_create(*args, **kwargs)
+    if objs:
+      snapshots.catalog_changed()
+      facets.invalidate()
+    return objs
+
+  def bulk_update(self, objs, fields, *args, **kwargs):
+    rows = super().bulk_update(objs, fields, *args, **kwargs)
+    if rows and not snapshots.is_stock_only(fields):
+      snapshots.catalog_changed()
+    if rows and facets.affects_facets(fields):
+      facets.invalidate()
+    return rows
+
+
+
+class Product(LoadedValuesMixin, models.Model):
+  RATING_STARS = (1, 2, 3, 4, 5)
+  RATING_FIELDS = ['rating_count', 'rating_total'] + [f'rating_{star}' for star in RATING_STARS]
+  DERIVED_FIELDS = RATING_FIELDS + ['image_variants', 'stock_shards']
+
+  sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
   name = models.CharField(max_length=255)
   brand = models.ForeignKey(Brand, on_delete=models.CASCADE)
   description = models.TextField()
   image = models.ImageField(upload_to='product_img')
+  image_variants = models.JSONField(default=dict, blank=True)
   price = models.DecimalField(max_digits=10, decimal_places=2)
   stock_quantity = models.PositiveIntegerField()
+  # Number of StockShard rows holding this product's stock; 0 keeps it in stock_quantity.
+  stock_shards = models.PositiveSmallIntegerField(default=0)
   category = models.ForeignKey(Category, on_delete=models.CASCADE)
   created_at = models.DateTimeField(auto_now_add=True)
   updated_at = models.DateTimeField(auto_now=True)
+  rating_count = models.PositiveIntegerField(default=0)
+  rating_total = models.PositiveIntegerField(default=0)
+  rating_1 = models.PositiveIntegerField(default=0)
+  rating_2 = models.PositiveIntegerField(default=0)
+  rating_3 = models.PositiveIntegerField(default=0)
+  rating_4 = models.PositiveIntegerField(default=0)
+  rating_5 = models.PositiveIntegerField(default=0)
+
+  objects = ProductQuerySet.as_manager()
 
   def __str__(self):
     return self.name
+
+
+  def save(self, *args, **kwargs):
+    # Ratings, image variants and the shard count are only written through targeted updates; never overwrite them with stale values.
+    if not self._state.adding and kwargs.get('update_fields') is None:
+      loaded = getattr(self, '_loaded_values', {})
+      kwargs['update_fields'] = [
+        field.name for field in self._meta.concrete_fields
+        if not field.primary_key and field.name not in self.DERIVED_FIELDS
+        # Unchanged stock is left out so a stale instance cannot undo orders placed since it was loaded.
+        and not (field.name == 'stock_quantity' and loaded.get('stock_quantity') == self.stock_quantity)
+      ]
+
+    update_fields = kwargs.get('update_fields')
+    if self._state.adding or update_fields is None or 'stock_quantity' not in update_fields:
+      super().save(*args, **kwargs)
+      return
+
+    with transaction.atomic():
+      sharded = Product.objects.filter(id=self.id).values_list('stock_shards', flat=True).first()
+      super().save(*args, **kwargs)
+      if sharded:
+        # Sharded stock lives in the shard rows; rebalancing would revert a direct write.
+        from . import stock_shards
+        stock_shards.set_total(self.id, self.stock_quantity)
+    if hasattr(self, '_loaded_values'):
+      self._loaded_values['stock_quantity'] = self.stock_quantity
+
   
+  @property
+  def rating_avg(self):
+    if not self.rating_count:
+      return None
+    return round(self.rating_total / self.rating_count, 2)
+
+  
+  @property
+  def rating_histogram(self):
+    return {str(star): getattr(self, f'rating_{star}') for star in self.RATING_STARS}
+
+  
+  def facet_values(self):
+    return {
+      'category_id': self.category_id, 'brand_id': self.brand_id, 'price': self.price,
+      'name': self.name, 'description': self.description,
+    }
+
   
   def clean(self):
     if self.price < 0:
@@ -59,6 +174,13 @@ class Product(models.Model):
   
   
   def update_stock(self, quantity):
+    if self.stock_shards:
+      from . import stock_shards
+      if quantity >= 0:
+        stock_shards.give_back(self.id, quantity)
+      elif not stock_shards.take(self.id, -quantity):
+        raise ValidationError("Insufficient stock to fulfill this order")
+      return
     if quantity < 0:
       current_stock = Product.objects.filter(id=self.id).values('stock_quantity').first()
       
@@ -67,7 +189,32 @@ class Product(models.Model):
       if abs(quantity) > current_stock['stock_quantity']:
           raise ValidationError("Insufficient stock to fulfill this order")
     
-    Product.objects.filter(id=self.id).update(stock_quantity=F('stock_quantity') + quantity)
+    Product.objects.filter(id=self.id).update(stock_quantity=F('stock_quantity') + quantity, updated_at=timezone.now())
+
+  
+  def update_rating(self, rating, sign=1):
+    rating = int(rating)
+    if rating not in self.RATING_STARS:
+      return
+    Product.objects.filter(id=self.id).update(**{
+      'updated_at': timezone.now(),
+      'rating_count': F('rating_count') + sign,
+      'rating_total': F('rating_total') + sign * rating,
+      f'rating_{rating}': F(f'rating_{rating}') + sign,
+    })
+
+  
+  def recompute_rating(self):
+    counts = dict(
+      self.review_set.filter(rating__in=self.RATING_STARS)
+      .values_list('rating').annotate(count=Count('id')).order_by()
+    )
+    Product.objects.filter(id=self.id).update(
+      updated_at=timezone.now(),
+      rating_count=sum(counts.values()),
+      rating_total=sum(star * count for star, count in counts.items()),
+      **{f'rating_{star}': counts.get(star, 0) for star in self.RATING_STARS}
+    )
 
   
   def total_value(self):
@@ -77,17 +224,66 @@ class Product(models.Model):
   class Meta:
     indexes = [
       models.Index(fields=['name', 'category']),
+      models.Index(fields=['price', 'id']),
+      models.Index(fields=['name', 'id']),
+      models.Index(fields=['updated_at']),
     ]
 
 
 
+AMOUNT_FIELD = models.DecimalField(max_digits=12, decimal_places=2)
+
+
+def order_line_total():
+  lines = (
+    OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+    .annotate(total=Sum(F('price') * F('quantity'), output_field=AMOUNT_FIELD)).values('total')
+  )
+  return Subquery(lines, output_field=AMOUNT_FIELD)
+
+
+def order_shipping_rate():
+  rate = ShippingDetail.objects.filter(order=OuterRef('pk')).values('shipping_method__rate')[:1]
+  return Subquery(rate, output_field=AMOUNT_FIELD)
+
+
+
+class OrderQuerySet(models.QuerySet):
+
+  def with_totals(self):
+    """
+    Annotate ``subtotal_amount``, ``shipping_amount`` and ``grand_total_amount``,
+    using the materialized columns and falling back to DB-side aggregates for
+    rows written before they existed.
+    """
+    amount = AMOUNT_FIELD
+    return self.annotate(
+      subtotal_amount=Coalesce('subtotal', order_line_total(), Value(0), output_field=amount),
+      shipping_amount=Coalesce('shipping_total', order_shipping_rate(), Value(0), output_field=amount),
+    ).annotate(
+      grand_total_amount=Coalesce('grand_total', F('subtotal_amount') + F('shipping_amount'), output_field=amount),
+    )
+
+
+
 class Order(models.Model):
   STATUS_CHOICES = [
     ('pending', 'Pending'),
+    ('paid', 'Paid'),
+    ('failed', 'Payment failed'),
     ('shipped', 'Shipped'),
     ('delivered', 'Delivered'),
     ('canceled', 'Canceled'),
   ]
+  # Allowed moves; order_status.transition() is the only writer of ``status``.
+  TRANSITIONS = {
+    'pending': ['paid', 'failed', 'canceled'],
+    'failed': ['paid', 'canceled'],
+    'paid': ['shipped', 'canceled'],
+    'shipped': ['delivered'],
+    'delivered': [],
+    'canceled': [],
+  }
   
   user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
   order_date = models.DateTimeField(auto_now_add=True)
@@ -95,6 +291,11 @@ class Order(models.Model):
   shipping_address = models.TextField()
   created_at = models.DateTimeField(auto_now_add=True)
   payment_intent_id = models.CharField(max_length=255, null=True, blank=True)
+  subtotal = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+  shipping_total = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+  grand_total = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+
+  objects = OrderQuerySet.as_manager()
 
   def __str__(self):
     return f"Order {self.id} by {self.user.username}"
@@ -106,12 +307,50 @@ class Order(models.Model):
   
   
   def total_amount(self):
-    return sum(item.price * item.quantity for item in self.orderitem_set.all())
+    if self.subtotal is not None:
+      return self.subtotal
+    total = self.orderitem_set.aggregate(total=Sum(F('price') * F('quantity')))['total']
+    return total or 0
+  
+  
+  def recalculate_totals(self):
+    subtotal = Coalesce(order_line_total(), Value(0), output_field=AMOUNT_FIELD)
+    shipping_total = Coalesce(order_shipping_rate(), Value(0), output_field=AMOUNT_FIELD)
+    Order.objects.filter(pk=self.pk).update(
+      subtotal=subtotal,
+      shipping_total=shipping_total,
+      grand_total=subtotal + shipping_total,
+    )
   
   
   class Meta:
     indexes = [
-      models.Index(fields=['user', 'order_date']),
+      models.Index(fields=['user', 'order_date', 'id']),
+      models.Index(fields=['status', 'order_date']),
+    ]
+
+
+
+class OrderStatusTransition(models.Model):
+  """Append-only log of order status changes."""
+  order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='status_transitions')
+  from_status = models.CharField(max_length=50, choices=Order.STATUS_CHOICES)
+  to_status = models.CharField(max_length=50, choices=Order.STATUS_CHOICES)
+  changed_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True)
+  source = models.CharField(max_length=50)
+  created_at = models.DateTimeField(auto_now_add=True)
+
+  def __str__(self):
+    return f"Order {self.order_id}: {self.from_status} -> {self.to_status}"
+
+  def save(self, *args, **kwargs):
+    if not self._state.adding:
+      raise ValidationError("Status transitions cannot be changed once recorded.")
+    super().save(*args, **kwargs)
+
+  class Meta:
+    indexes = [
+      models.Index(fields=['order', 'created_at']),
     ]
 
 
@@ -135,11 +374,6 @@ class OrderItem(models.Model):
       super().save(*args, **kwargs)
 
   
-  def delete(self, *args, **kwargs):
-    self.product.update_stock(self.quantity)
-    super().delete(*args, **kwargs)
-
-  
   class Meta:
     indexes = [
       models.Index(fields=['order', 'product']),
@@ -147,7 +381,7 @@ class OrderItem(models.Model):
 
 
 
-class Review(models.Model):
+class Review(LoadedValuesMixin, models.Model):
   RATING_CHOICES = [
     (1, '1 Star'),
     (2, '2 Stars'),
@@ -173,40 +407,272 @@ class Review(models.Model):
 class Cart(models.Model):
   user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
   created_at = models.DateTimeField(auto_now_add=True)
+  # Last edit to the cart or its lines; abandoned carts are purged by this.
+  updated_at = models.DateTimeField(auto_now=True)
 
   class Meta:
     indexes = [
       models.Index(fields=['user']),
+      models.Index(fields=['updated_at']),
     ]
 
 
 
+def retire_cached_cart_ids(user_id):
+  # The cart store keeps each user's cart ids so cart edits can total them without a query.
+  from . import cart_store
+  transaction.on_commit(lambda: cart_store.user_carts_changed(user_id))
+
+
+@receiver(post_save, sender=Cart)
+def retire_cached_cart_ids_on_cart_create(sender, instance, created, **kwargs):
+  if created:
+    retire_cached_cart_ids(instance.user_id)
+
+
+@receiver(post_delete, sender=Cart)
+def retire_cached_cart_ids_on_cart_delete(sender, instance, **kwargs):
+  retire_cached_cart_ids(instance.user_id)
+
+
+
 class CartItem(models.Model):
   cart = models.ForeignKey(Cart, on_delete=models.CASCADE)
   product = models.ForeignKey(Product, on_delete=models.CASCADE)
   quantity = models.PositiveIntegerField()
 
   class Meta:
+    constraints = [
+      models.UniqueConstraint(fields=['cart', 'product'], name='unique_cart_product'),
+    ]
+
+
+
+class StockReservation(models.Model):
+  user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+  product = models.ForeignKey(Product, on_delete=models.CASCADE)
+  quantity = models.PositiveIntegerField()
+  expires_at = models.DateTimeField()
+
+  def __str__(self):
+    return f"{self.quantity} x {self.product_id} held for user {self.user_id}"
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(fields=['user', 'product'], name='unique_stock_reservation'),
+    ]
     indexes = [
-      models.Index(fields=['cart', 'product']),
+      models.Index(fields=['product', 'expires_at']),
+      models.Index(fields=['expires_at']),
     ]
 
 
 
-@receiver(post_save, sender=OrderItem)
-def update_product_stock_on__orderitem_save(sender, instance, **kwargs):
-  try:
-    with transaction.atomic():
-      if kwargs.get('created', False):
-        instance.product.update_stock(-instance.quantity)
-      else:
-        old_quantity = OrderItem.objects.get(pk=instance.pk).quantity
-        difference = instance.quantity - old_quantity
-        instance.product.update_stock(-difference)
-  except Exception as e:
-    logger.error(f"Error updating stock for product {instance.product_id}: {e}")
-    raise
+class StockShard(models.Model):
+  product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_shard_set')
+  shard = models.PositiveSmallIntegerField()
+  quantity = models.PositiveIntegerField(default=0)
+
+  def __str__(self):
+    return f"{self.product_id}#{self.shard}: {self.quantity}"
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(fields=['product', 'shard'], name='unique_stock_shard'),
+    ]
+
+
+
+class IdempotencyKey(models.Model):
+  scope = models.CharField(max_length=50)
+  key = models.CharField(max_length=255)
+  user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, null=True, blank=True)
+  fingerprint = models.CharField(max_length=64)
+  status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+  response = models.JSONField(encoder=DjangoJSONEncoder, null=True, blank=True)
+  created_at = models.DateTimeField(auto_now_add=True)
+  expires_at = models.DateTimeField()
+
+  def __str__(self):
+    return f"{self.scope}:{self.key}"
+
+  class Meta:
+    constraints = [
+      # Keys are per user, so one user's key can never block or replay another's request.
+      models.UniqueConstraint(fields=['scope', 'user', 'key'], name='unique_idempotency_key'),
+      models.UniqueConstraint(fields=['scope', 'key'], condition=models.Q(user__isnull=True), name='unique_anonymous_idempotency_key'),
+    ]
+    indexes = [
+      models.Index(fields=['expires_at']),
+    ]
+
+
+
+class SalesRollup(models.Model):
+  day = models.DateField()
+  units = models.PositiveIntegerField(default=0)
+  revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+  orders = models.PositiveIntegerField(default=0)
+
+  class Meta:
+    abstract = True
+
+
+
+class DailyProductSales(SalesRollup):
+  product = models.ForeignKey(Product, on_delete=models.CASCADE)
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(fields=['product', 'day'], name='unique_daily_product_sales'),
+    ]
+    indexes = [
+      models.Index(fields=['day']),
+    ]
+
+
 
+class DailyCategorySales(SalesRollup):
+  category = models.ForeignKey(Category, on_delete=models.CASCADE)
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(fields=['category', 'day'], name='unique_daily_category_sales'),
+    ]
+    indexes = [
+      models.Index(fields=['day']),
+    ]
+
+
+
+class DailyBrandSales(SalesRollup):
+  brand = models.ForeignKey(Brand, on_delete=models.CASCADE)
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(fields=['brand', 'day'], name='unique_daily_brand_sales'),
+    ]
+    indexes = [
+      models.Index(fields=['day']),
+    ]
+
+
+
+class RollupWatermark(models.Model):
+  """Last order id folded into an incremental rollup."""
+  name = models.CharField(max_length=50, unique=True)
+  last_order_id = models.BigIntegerField(default=0)
+  updated_at = models.DateTimeField(auto_now=True)
+
+  def __str__(self):
+    return f"{self.name} @ {self.last_order_id}"
+
+
+
+@receiver(post_save, sender=Product)
+def update_search_index_on_product_save(sender, instance, **kwargs):
+  search.index_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def update_search_index_on_product_delete(sender, instance, **kwargs):
+  search.remove_product(instance.id)
+
+
+@receiver(post_save, sender=Product)
+def update_facets_on_product_save(sender, instance, created, **kwargs):
+  loaded = getattr(instance, '_loaded_values', {})
+  if created:
+    facets.product_changed(None, instance.facet_values())
+  elif all(field in loaded for field in instance.facet_values()):
+    facets.product_changed(loaded, instance.facet_values())
+  else:
+    facets.invalidate()
+  instance._loaded_values = {**loaded, **instance.facet_values()}
+
+
+@receiver(post_delete, sender=Product)
+def update_facets_on_product_delete(sender, instance, **kwargs):
+  facets.product_changed(instance.facet_values(), None)
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+def update_facets_on_name_change(sender, created, **kwargs):
+  # Brand and category names are searchable, so a rename can change the counts for any ``q``.
+  if not created:
+    facets.invalidate()
+
+
+@receiver(post_save, sender=Product)
+def generate_image_variants_on_product_save(sender, instance, created, **kwargs):
+  loaded = getattr(instance, '_loaded_values', {})
+  changed = created or loaded.get('image') != instance.image.name
+  instance._loaded_values = {**loaded, 'image': instance.image.name}
+  if not instance.image or not changed:
+    return
+
+  def enqueue():
+    from .tasks import generate_image_variants
+    try:
+      generate_image_variants.delay(instance.id)
+    except Exception as e:
+      logger.error(f"Error queueing image variants for product {instance.id}: {e}")
+
+  transaction.on_commit(enqueue)
+
+
+@receiver(post_save, sender=Brand)
+def update_search_index_on_brand_save(sender, instance, created, **kwargs):
+  if not created:
+    search.rename_brand(instance)
+
+
+@receiver(post_save, sender=Category)
+def update_search_index_on_category_save(sender, instance, created, **kwargs):
+  if not created:
+    search.rename_category(instance)
+
+
+
+@receiver(post_save, sender=Review)
+def update_product_rating_on_review_save(sender, instance, created, **kwargs):
+  loaded = getattr(instance, '_loaded_values', {})
+  if created:
+    instance.product.update_rating(instance.rating)
+  elif 'product_id' in loaded and 'rating' in loaded:
+    if (loaded['product_id'], int(loaded['rating'])) == (instance.product_id, int(instance.rating)):
+      return
+    Product(id=loaded['product_id']).update_rating(loaded['rating'], -1)
+    instance.product.update_rating(instance.rating)
+  else:
+    instance.product.recompute_rating()
+  instance._loaded_values = {**loaded, 'product_id': instance.product_id, 'rating': instance.rating}
+
+
+@receiver(post_delete, sender=Review)
+def update_product_rating_on_review_delete(sender, instance, **kwargs):
+  Product(id=instance.product_id).update_rating(instance.rating, -1)
+
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def retire_catalog_snapshots(sender, update_fields=None, **kwargs):
+  if sender is Product and snapshots.is_stock_only(update_fields):
+    return
+  snapshots.catalog_changed()
+
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def update_order_totals_on_orderitem_change(sender, instance, **kwargs):
+  Order(pk=instance.order_id).recalculate_totals()
 
 
 
@@ -222,14 +688,18 @@ def update_product_stock_on_orderitem_delete(sender, instance, **kwargs):
 
 
 @receiver(post_save, sender=OrderItem)
-def remove_cartitem_after_purchase(sender, instance, **kwargs):
-  try:
-    with transaction.atomic():
-      CartItem.objects.filter(cart__user=instance.order.user, product=instance.product).delete()
-      logger.info(f"Successfully removed cart item for product {instance.product_id} for user {instance.order.user_id}.")
-  except Exception as e:
-    logger.error(f"Error removing cart item for product {instance.product_id} for user {instance.order.user_id}: {e}")
-    raise
+def remove_cartitem_after_purchase(sender, instance, created, raw=False, **kwargs):
+  # Orders from place_order() bulk insert their lines and schedule one cleanup
+  # for the whole order; this covers lines added one at a time elsewhere.
+  if not created or raw:
+    return
+  from .orders import schedule_cart_cleanup
+  if OrderItem.order.is_cached(instance):
+    user_id = instance.order.user_id
+  else:
+    # Read just the buyer id instead of loading the whole order.
+    user_id = Order.objects.values_list('user_id', flat=True).get(pk=instance.order_id)
+  schedule_cart_cleanup(user_id, [instance.product_id])
 
 
 
@@ -246,7 +716,17 @@ class ShippingMethod(models.Model):
     ]
 
 
-class ShippingDetail(models.Model):
+
+@receiver(post_save, sender=ShippingMethod)
+@receiver(post_delete, sender=ShippingMethod)
+def retire_cart_summaries(sender, **kwargs):
+  # Cart summaries quote every shipping method.
+  from . import cart_summary
+  transaction.on_commit(cart_summary.shipping_changed)
+
+
+
+class ShippingDetail(LoadedValuesMixin, models.Model):
   order = models.OneToOneField(Order, on_delete=models.CASCADE)
   shipping_method = models.ForeignKey(ShippingMethod, on_delete=models.CASCADE)
   tracking_number = models.CharField(max_length=255, blank=True, null=True)
@@ -261,8 +741,32 @@ class ShippingDetail(models.Model):
       return
     
     tracking_info = CarrierAPI.get_tracking_info(self.tracking_number)
-    self.shipped_at = tracking_info.get("shipped_at", self.shipped_at)
-    self.delivered_at = tracking_info.get("delivered_at", self.delivered_at)
+    self.apply_tracking_info(tracking_info)
     self.save()
 
-  
\ No newline at end of file
+  def apply_tracking_info(self, tracking_info):
+    """Copy carrier timestamps onto the instance; returns whether anything changed."""
+    changed = False
+    for field in ('shipped_at', 'delivered_at'):
+      if field not in tracking_info:
+        continue
+      value = tracking_info[field]
+      if isinstance(value, str):
+        value = parse_datetime(value)
+        if value is None:
+          continue
+        if timezone.is_naive(value):
+          value = timezone.make_aware(value)
+      if value != getattr(self, field):
+        setattr(self, field, value)
+        changed = True
+    return changed
+
+
+
+@receiver(post_save, sender=ShippingDetail)
+def update_order_totals_on_shippingdetail_save(sender, instance, created, **kwargs):
+  loaded = getattr(instance, '_loaded_values', {})
+  if created or loaded.get('shipping_method_id') != instance.shipping_method_id:
+    Order(pk=instance.order_id).recalculate_totals()
+  instance._loaded_values = {**loaded, 'shipping_method_id': instance.shipping_method_id}
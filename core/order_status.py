@@ -0,0 +1,72 @@
+from django.db import transaction
+from rest_framework import serializers
+
+from .models import Order, OrderStatusTransition
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+
+def allowed_sources(to_status):
+  """Statuses an order may move to ``to_status`` from."""
+  if to_status not in Order.TRANSITIONS:
+    raise serializers.ValidationError({'status': f"Unknown status '{to_status}'."})
+  return [status for status, targets in Order.TRANSITIONS.items() if to_status in targets]
+
+
+def transition(order, to_status, user=None, source='api'):
+  """
+  Move one order to ``to_status`` with a guarded UPDATE and log the change.
+  Raises ``ValidationError`` if the order's current status does not allow it.
+  """
+  sources = allowed_sources(to_status)
+  with transaction.atomic():
+    current = Order.objects.select_for_update().filter(pk=order.pk).values_list('status', flat=True).first()
+    if current not in sources or not Order.objects.filter(pk=order.pk, status=current).update(status=to_status):
+      raise serializers.ValidationError({
+        'status': f"Cannot move order {order.pk} from '{current}' to '{to_status}'.",
+      })
+    OrderStatusTransition.objects.create(
+      order_id=order.pk, from_status=current, to_status=to_status,
+      changed_by=user, source=source,
+    )
+  order.status = to_status
+  return order
+
+
+def bulk_transition(orders, to_status, user=None, source='bulk', batch_size=BATCH_SIZE):
+  """
+  Move every order in the ``orders`` queryset that is allowed to reach
+  ``to_status``; returns the number moved. Each batch picks ids from
+  ``orders``, locks those rows by id alone (the caller's filters may join
+  nullable relations, which ``FOR UPDATE`` cannot lock), moves them with one
+  ``UPDATE ... WHERE id IN (...) AND status IN (...)`` and logs the orders
+  that actually moved with one bulk insert. Orders in other statuses are
+  left alone.
+  """
+  sources = allowed_sources(to_status)
+  candidates = orders.filter(status__in=sources).order_by('id').values_list('id', flat=True)
+  moved = 0
+  while True:
+    with transaction.atomic():
+      ids = list(candidates[:batch_size])
+      if not ids:
+        break
+      rows = dict(
+        Order.objects.select_for_update().filter(id__in=ids, status__in=sources)
+        .order_by('id').values_list('id', 'status')
+      )
+      if not rows:
+        continue
+      Order.objects.filter(id__in=list(rows), status__in=sources).update(status=to_status)
+      updated = list(Order.objects.filter(id__in=list(rows), status=to_status).values_list('id', flat=True))
+      OrderStatusTransition.objects.bulk_create([
+        OrderStatusTransition(order_id=order_id, from_status=rows[order_id], to_status=to_status, changed_by=user, source=source)
+        for order_id in updated
+      ])
+    moved += len(updated)
+  logger.info(f"Moved {moved} orders to '{to_status}' ({source}).")
+  return moved
@@ -0,0 +1,162 @@
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import serializers
+
+from .exceptions import StructuredValidationError
+from .models import Product, Order, OrderItem, ShippingDetail, CartItem, StockReservation
+from .reservations import held_quantity, available_to_promise
+from . import stock_shards
+from . import cart_store
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_lines(items):
+  lines = []
+  errors = []
+
+  if not isinstance(items, list) or not items:
+    raise serializers.ValidationError({'order_items': ["At least one order item is required."]})
+
+  for item in items:
+    error = {}
+    try:
+      product_id = int(item.get('product_id'))
+    except (AttributeError, TypeError, ValueError):
+      product_id = None
+      error['product_id'] = ["A valid product id is required."]
+
+    try:
+      quantity = int(item.get('quantity'))
+    except (AttributeError, TypeError, ValueError):
+      quantity = None
+      error['quantity'] = ["A valid quantity is required."]
+    else:
+      if quantity <= 0:
+        error['quantity'] = ["Quantity must be positive."]
+
+    lines.append((product_id, quantity))
+    errors.append(error)
+
+  if any(errors):
+    raise serializers.ValidationError({'order_items': errors})
+
+  return lines
+
+
+def _shortage_error(product_id, requested, available):
+  return {
+    'product_id': product_id,
+    'requested': requested,
+    'available': available,
+    'detail': "Not enough stock available.",
+  }
+
+
+def remove_purchased_cart_items(user_id, product_ids):
+  # Runs after the order committed: a failure here must never reach the client.
+  try:
+    removed = CartItem.objects.filter(cart__user_id=user_id, product_id__in=product_ids).delete()[0]
+    cart_store.discard_products(user_id, product_ids)
+  except Exception as e:
+    logger.error(f"Error removing purchased cart items for user {user_id}: {e}")
+    return 0
+  logger.info(f"Removed {removed} purchased cart items for user {user_id}.")
+  return removed
+
+
+def schedule_cart_cleanup(user_id, product_ids):
+  """
+  Drop the purchased products from the user's carts in one DELETE once the
+  order commits, keeping the cart rows out of the order transaction. Nothing
+  is removed if the order rolls back.
+  """
+  product_ids = list(product_ids)
+  transaction.on_commit(lambda: remove_purchased_cart_items(user_id, product_ids), robust=True)
+
+
+def place_order(user, items, shipping_method=None, **order_fields):
+  """
+  Create an order with all of its lines in a single transaction.
+
+  Products are fetched once with ``in_bulk``, lines are inserted with
+  ``bulk_create`` and stock is decremented exactly once per product with a
+  conditional UPDATE, issued in product id order so concurrent checkouts
+  always lock rows in the same sequence. Stock held for other users does not
+  count as available, and the buyer's own holds are consumed by the order.
+  Purchased products leave the buyer's carts after commit. Any invalid line
+  or shortage raises a ``ValidationError`` whose ``order_items`` list is aligned with
+  the submitted lines, numbers kept as numbers.
+  """
+  lines = _parse_lines(items)
+
+  requested = {}
+  for product_id, quantity in sorted(lines):
+    requested[product_id] = requested.get(product_id, 0) + quantity
+
+  with transaction.atomic():
+    now = timezone.now()
+    held = held_quantity(exclude_user=user, now=now)
+    products = Product.objects.annotate(held=held, current_stock=stock_shards.current_stock()).in_bulk(list(requested))
+
+    errors = []
+    for product_id, quantity in lines:
+      product = products.get(product_id)
+      if product is None:
+        errors.append({'product_id': product_id, 'detail': "Product does not exist."})
+      elif requested[product_id] > product.current_stock - product.held:
+        errors.append(_shortage_error(product_id, requested[product_id], max(product.current_stock - product.held, 0)))
+      else:
+        errors.append({})
+
+    if any(errors):
+      raise StructuredValidationError({'order_items': errors})
+
+    short = []
+    for product_id, quantity in requested.items():
+      if products[product_id].stock_shards:
+        # Hot products decrement one of several counter rows and leave the
+        # product row unlocked; other users' holds were checked on the read above.
+        updated = stock_shards.take(product_id, quantity)
+      else:
+        updated = Product.objects.annotate(held=held).filter(id=product_id, stock_quantity__gte=F('held') + quantity).update(
+          stock_quantity=F('stock_quantity') - quantity, updated_at=now
+        )
+      if not updated:
+        short.append(product_id)
+
+    if short:
+      # Stock moved between the read and the update; report what is left now.
+      available = available_to_promise(short, exclude_user=user)
+      errors = [
+        _shortage_error(product_id, requested[product_id], available.get(product_id, 0)) if product_id in short else {}
+        for product_id, quantity in lines
+      ]
+      raise StructuredValidationError({'order_items': errors})
+
+    subtotal = sum(products[product_id].price * quantity for product_id, quantity in lines)
+    shipping_total = shipping_method.rate if shipping_method else 0
+    order = Order.objects.create(
+      user=user,
+      subtotal=subtotal,
+      shipping_total=shipping_total,
+      grand_total=subtotal + shipping_total,
+      **order_fields
+    )
+    OrderItem.objects.bulk_create([
+      OrderItem(order=order, product_id=product_id, quantity=quantity, price=products[product_id].price)
+      for product_id, quantity in lines
+    ])
+
+    if shipping_method:
+      # bulk_create skips the signal that would recalculate the totals set above.
+      ShippingDetail.objects.bulk_create([ShippingDetail(order=order, shipping_method=shipping_method)])
+
+    StockReservation.objects.filter(user=user, product_id__in=list(requested)).delete()
+    schedule_cart_cleanup(user.id, list(requested))
+
+  logger.info(f"Placed order {order.id} with {len(lines)} items for user {user.id}.")
+  return order
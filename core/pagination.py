@@ -1,11 +1,114 @@
+import base64
+import json
+from functools import reduce
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPaginationMixin:
+    """
+    Opt-in keyset pagination for page number paginators.
+
+    A request carrying a ``cursor`` query parameter (empty for the first page)
+    is paginated by seeking past the last row of the previous page instead of
+    counting and offsetting, so every page costs the same regardless of depth.
+    The keyset is the queryset ordering (as set by ``OrderingFilter``) with
+    ``id`` appended as a tiebreaker.
+    """
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.cursor_query_param in request.query_params
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.ordering = self.get_keyset_ordering(queryset)
+        page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            try:
+                queryset = queryset.filter(self.get_keyset_filter(position))
+            except (ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+
+        rows = list(queryset[:page_size + 1])
+        self.has_next = len(rows) > page_size
+        self.page = rows[:page_size]
+        return self.page
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        position = [getattr(last, field.lstrip('-')) for field in self.ordering]
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.encode_cursor(position))
+
+    def get_previous_link(self):
+        if not self.keyset:
+            return super().get_previous_link()
+        return None
+
+    def get_keyset_ordering(self, queryset):
+        ordering = [field for field in queryset.query.order_by if isinstance(field, str)]
+        if not ordering:
+            ordering = ['-id']
+        if ordering[-1].lstrip('-') not in ('id', 'pk'):
+            ordering = [field for field in ordering if field.lstrip('-') not in ('id', 'pk')]
+            descending = ordering[-1].startswith('-')
+            ordering.append('-id' if descending else 'id')
+        return ordering
+
+    def get_keyset_filter(self, position):
+        clauses = []
+        for index, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal = {prev.lstrip('-'): value for prev, value in zip(self.ordering[:index], position)}
+            clauses.append(Q(**equal, **{f'{name}__{lookup}': position[index]}))
+        return reduce(lambda left, right: left | right, clauses)
+
+    def encode_cursor(self, position):
+        raw = json.dumps([value if isinstance(value, (int, float)) else str(value) for value in position])
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
 
-class CustomPageNumberPagination(PageNumberPagination):
-    page_size = 20 
-    page_size_query_param = 'page_size'  
-    max_page_size = 100  
+class CustomPageNumberPagination(KeysetPaginationMixin, PageNumberPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
 
-class AnotherCustomPageNumberPagination(PageNumberPagination):
+class AnotherCustomPageNumberPagination(KeysetPaginationMixin, PageNumberPagination):
     page_size = 10
-    page_size_query_param = 'page_size'  
-    max_page_size = 20 
\ No newline at end of file
+    page_size_query_param = 'page_size'
+    max_page_size = 20
@@ -0,0 +1,49 @@
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import Product, Review
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+STARS = Product.RATING_STARS
+
+RATING_FIELDS = Product.RATING_FIELDS
+
+
+def recompute_ratings(product_ids=None, batch_size=1000):
+  """
+  Rebuild rating aggregates from the review table with one GROUP BY and
+  batched ``bulk_update`` calls. Returns the number of products written.
+  """
+  reviews = Review.objects.filter(rating__in=STARS)
+  products = Product.objects.only('id', 'updated_at', *RATING_FIELDS).order_by('id')
+  if product_ids is not None:
+    reviews = reviews.filter(product_id__in=product_ids)
+    products = products.filter(id__in=product_ids)
+
+  histograms = {}
+  for row in reviews.values('product_id', 'rating').annotate(count=Count('id')).order_by():
+    histograms.setdefault(row['product_id'], {})[row['rating']] = row['count']
+
+  now = timezone.now()
+  fields = RATING_FIELDS + ['updated_at']
+  updated = 0
+  batch = []
+  for product in products.iterator(chunk_size=batch_size):
+    histogram = histograms.get(product.id, {})
+    for star in STARS:
+      setattr(product, f'rating_{star}', histogram.get(star, 0))
+    product.rating_count = sum(histogram.values())
+    product.rating_total = sum(star * count for star, count in histogram.items())
+    product.updated_at = now
+    batch.append(product)
+    if len(batch) >= batch_size:
+      updated += Product.objects.bulk_update(batch, fields)
+      batch = []
+  if batch:
+    updated += Product.objects.bulk_update(batch, fields)
+
+  logger.info(f"Recomputed rating aggregates for {updated} products.")
+  return updated
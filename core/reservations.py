@@ -0,0 +1,173 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, When, F, DateTimeField, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from rest_framework import serializers
+
+from .exceptions import StructuredValidationError
+from .models import Product, StockReservation, CartItem
+from .stock_shards import current_stock
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = timedelta(minutes=15)
+
+
+def reservation_ttl():
+  return getattr(settings, 'STOCK_RESERVATION_TTL', DEFAULT_TTL)
+
+
+def held_quantity(exclude_user=None, now=None):
+  """
+  Subquery expression for the quantity of a product held by unexpired
+  reservations, optionally ignoring one user's own holds.
+  """
+  holds = StockReservation.objects.filter(product=OuterRef('pk'), expires_at__gt=now or timezone.now())
+  if exclude_user is not None:
+    holds = holds.exclude(user=exclude_user)
+  total = holds.order_by().values('product').annotate(total=Sum('quantity')).values('total')
+  return Coalesce(Subquery(total), Value(0))
+
+
+def available_to_promise(product_ids, exclude_user=None):
+  """
+  Stock minus active holds per product, read in one query without locking
+  the product rows. Expired holds are ignored whether or not they were swept.
+  """
+  rows = (
+    Product.objects.filter(id__in=product_ids)
+    .annotate(held=held_quantity(exclude_user), current_stock=current_stock())
+    .values_list('id', 'current_stock', 'held')
+  )
+  return {product_id: max(stock_quantity - held, 0) for product_id, stock_quantity, held in rows}
+
+
+def _hold(user, quantities):
+  """
+  Write the user's holds for ``{product_id: quantity}`` with one
+  ``INSERT ... SELECT ... ON CONFLICT DO UPDATE`` whose SELECT only yields
+  products whose stock, less other users' holds, still covers the quantity,
+  so concurrent holds cannot add up to more than the stock. Returns the
+  number of holds written; callers roll back if it falls short.
+  """
+  now = timezone.now()
+  wanted = Case(*[When(id=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()], output_field=IntegerField())
+  rows = (
+    Product.objects.filter(id__in=list(quantities))
+    .annotate(
+      hold_user=Value(getattr(user, 'pk', user), output_field=IntegerField()),
+      hold_product=F('id'),
+      hold_quantity=wanted,
+      hold_expires=Value(now + reservation_ttl(), output_field=DateTimeField()),
+      held=held_quantity(exclude_user=user, now=now),
+      current_stock=current_stock(),
+    )
+    .filter(current_stock__gte=F('held') + F('hold_quantity'))
+    .values_list('hold_user', 'hold_product', 'hold_quantity', 'hold_expires')
+  )
+  select_sql, params = rows.query.sql_with_params()
+  with connection.cursor() as cursor:
+    cursor.execute(
+      f"INSERT INTO {StockReservation._meta.db_table} (user_id, product_id, quantity, expires_at) {select_sql} "
+      "ON CONFLICT (user_id, product_id) DO UPDATE SET quantity = excluded.quantity, expires_at = excluded.expires_at",
+      params,
+    )
+    return cursor.rowcount
+
+
+def reserve(user, product_id, quantity):
+  """
+  Place, resize or release (``quantity`` 0) the user's hold on a product and
+  restart its TTL; ``user`` may be a user or its id. Raises
+  ``StructuredValidationError`` if the quantity is not available; an existing hold is
+  then left as it was.
+  """
+  if quantity <= 0:
+    release(user, [product_id])
+    return
+
+  if _hold(user, {product_id: quantity}):
+    return
+  available = available_to_promise([product_id], exclude_user=user).get(product_id)
+  if available is None:
+    raise serializers.ValidationError({'product': "Product does not exist."})
+  raise StructuredValidationError({
+    'quantity': f"Only {available} available.",
+    'available': available,
+  })
+
+
+def reserve_many(user, quantities):
+  """
+  Set the user's holds to ``{product_id: quantity}`` (0 releases) with one
+  conditional bulk write. Raises ``StructuredValidationError`` listing every product
+  that cannot be fully held, and then changes none of them.
+  """
+  wanted = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+  with transaction.atomic():
+    release(user, [product_id for product_id in quantities if product_id not in wanted])
+    if not wanted or _hold(user, wanted) == len(wanted):
+      return
+    available = available_to_promise(list(wanted), exclude_user=user)
+    short = [
+      {'product_id': product_id, 'quantity': f"Only {available.get(product_id, 0)} available.", 'available': available.get(product_id, 0)}
+      for product_id, quantity in wanted.items() if quantity > available.get(product_id, 0)
+    ]
+    raise StructuredValidationError({'items': short})
+
+
+def reserve_cart(user):
+  """
+  Refresh holds for every line in the user's carts at checkout start. Lines
+  that can no longer be fully held are reported instead of raising.
+  """
+  quantities = {}
+  for product_id, quantity in CartItem.objects.filter(cart__user=user).values_list('product_id', 'quantity'):
+    quantities[product_id] = quantities.get(product_id, 0) + quantity
+
+  available = available_to_promise(list(quantities), exclude_user=user)
+  expires_at = timezone.now() + reservation_ttl()
+
+  results = []
+  holds = []
+  for product_id, quantity in quantities.items():
+    held = min(quantity, available.get(product_id, 0))
+    results.append({'product_id': product_id, 'requested': quantity, 'reserved': held, 'expires_at': expires_at})
+    if held:
+      holds.append(StockReservation(user=user, product_id=product_id, quantity=held, expires_at=expires_at))
+
+  with transaction.atomic():
+    StockReservation.objects.filter(user=user).exclude(product_id__in=[hold.product_id for hold in holds]).delete()
+    StockReservation.objects.bulk_create(
+      holds,
+      update_conflicts=True,
+      unique_fields=['user', 'product'],
+      update_fields=['quantity', 'expires_at'],
+    )
+  return results
+
+
+def release(user, product_ids=None):
+  holds = StockReservation.objects.filter(user=user)
+  if product_ids is not None:
+    holds = holds.filter(product_id__in=product_ids)
+  return holds.delete()[0]
+
+
+def purge_expired(batch_size=1000):
+  """Delete expired holds in bounded batches; returns the number removed."""
+  removed = 0
+  now = timezone.now()
+  while True:
+    ids = list(StockReservation.objects.filter(expires_at__lte=now).values_list('id', flat=True)[:batch_size])
+    if not ids:
+      break
+    removed += StockReservation.objects.filter(id__in=ids).delete()[0]
+  if removed:
+    logger.info(f"Purged {removed} expired stock reservations.")
+  return removed
@@ -0,0 +1,157 @@
+import html
+import re
+
+from django.db import connection
+from django.db.models import FloatField, TextField
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import BaseFilterBackend
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'core_product_fts'
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Control characters FTS5 wraps matches in; they are swapped for <mark> after escaping.
+MARK_START = '\x02'
+MARK_END = '\x03'
+
+CREATE_TABLE_SQL = (
+  f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+  "USING fts5(name, description, brand, category, tokenize='unicode61 remove_diacritics 2')"
+)
+
+POPULATE_SQL = (
+  f"INSERT INTO {FTS_TABLE}(rowid, name, description, brand, category) "
+  "SELECT p.id, p.name, p.description, b.name, c.category_name "
+  "FROM core_product p "
+  "JOIN core_brand b ON b.id = p.brand_id "
+  "JOIN core_category c ON c.id = p.category_id"
+)
+
+
+def is_supported(conn=None):
+  return (conn or connection).vendor == 'sqlite'
+
+
+def build_match_query(query):
+  """
+  Turn free text into a safe FTS5 MATCH expression: every word must match,
+  the last one as a prefix so results update while the user is typing.
+  """
+  tokens = TOKEN_RE.findall(query or '')
+  if not tokens:
+    return None
+  terms = [f'"{token}"' for token in tokens]
+  terms[-1] += '*'
+  return ' '.join(terms)
+
+
+def index_product(product):
+  if not is_supported():
+    return
+  with connection.cursor() as cursor:
+    cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [product.id])
+    cursor.execute(
+      f"INSERT INTO {FTS_TABLE}(rowid, name, description, brand, category) VALUES (%s, %s, %s, %s, %s)",
+      [product.id, product.name, product.description, product.brand.name, product.category.category_name],
+    )
+
+
+def index_products(product_ids):
+  if not is_supported() or not product_ids:
+    return
+  placeholders = ', '.join(['%s'] * len(product_ids))
+  with connection.cursor() as cursor:
+    cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", list(product_ids))
+    cursor.execute(f"{POPULATE_SQL} WHERE p.id IN ({placeholders})", list(product_ids))
+
+
+def remove_product(product_id):
+  if not is_supported():
+    return
+  with connection.cursor() as cursor:
+    cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [product_id])
+
+
+def rename_brand(brand):
+  if not is_supported():
+    return
+  with connection.cursor() as cursor:
+    cursor.execute(
+      f"UPDATE {FTS_TABLE} SET brand = %s WHERE rowid IN (SELECT id FROM core_product WHERE brand_id = %s)",
+      [brand.name, brand.id],
+    )
+
+
+def rename_category(category):
+  if not is_supported():
+    return
+  with connection.cursor() as cursor:
+    cursor.execute(
+      f"UPDATE {FTS_TABLE} SET category = %s WHERE rowid IN (SELECT id FROM core_product WHERE category_id = %s)",
+      [category.category_name, category.id],
+    )
+
+
+def rebuild_index(conn=None):
+  conn = conn or connection
+  if not is_supported(conn):
+    return 0
+  with conn.cursor() as cursor:
+    cursor.execute(CREATE_TABLE_SQL)
+    cursor.execute(f"DELETE FROM {FTS_TABLE}")
+    cursor.execute(POPULATE_SQL)
+    cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+    cursor.execute(f"SELECT count(*) FROM {FTS_TABLE}")
+    return cursor.fetchone()[0]
+
+
+def marked_html(text):
+  """HTML-escape highlight or snippet text and wrap the matched terms in ``<mark>``."""
+  if text is None:
+    return None
+  return html.escape(text).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+
+class ProductSearchFilter(BaseFilterBackend):
+  """
+  Full-text product search through the ``q`` query parameter.
+
+  On SQLite the FTS5 index is matched and results are ranked by bm25 unless
+  the client asked for an explicit ordering; ``search_highlight`` and
+  ``search_snippet`` are selected for the serializer, which HTML-escapes
+  them. Other databases fall back to a plain ``icontains`` match on the name.
+  """
+  search_param = 'q'
+
+  def filter_queryset(self, request, queryset, view):
+    query = request.query_params.get(self.search_param, '').strip()
+    if not query:
+      return queryset
+
+    if not is_supported():
+      return queryset.filter(name__icontains=query)
+
+    match = build_match_query(query)
+    if match is None:
+      return queryset.none()
+
+    # One join against the FTS table; bm25, highlight and snippet read the row it matched.
+    # They are annotations rather than extra() selects so keyset cursors can filter on the rank.
+    table = queryset.model._meta.db_table
+    queryset = queryset.extra(
+      tables=[FTS_TABLE],
+      where=[f"{FTS_TABLE} MATCH %s", f"{FTS_TABLE}.rowid = {table}.id"],
+      params=[match],
+    ).annotate(
+      search_rank=RawSQL(f"bm25({FTS_TABLE}, 10.0, 1.0, 3.0, 3.0)", [], output_field=FloatField()),
+      search_highlight=RawSQL(f"highlight({FTS_TABLE}, 0, char(2), char(3))", [], output_field=TextField()),
+      search_snippet=RawSQL(f"snippet({FTS_TABLE}, 1, char(2), char(3), '...', 16)", [], output_field=TextField()),
+    )
+
+    if 'ordering' not in request.query_params:
+      queryset = queryset.order_by('search_rank', 'id')
+    return queryset
@@ -1,5 +1,7 @@
 from rest_framework import serializers
 from .models import *
+from .images import variant_urls
+from .search import marked_html
 
 class CategorySerializer(serializers.ModelSerializer):
   class Meta:
@@ -13,17 +15,34 @@ class BrandSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
     
+class MarkedTextField(serializers.CharField):
+  """Search highlight/snippet text, HTML-escaped with matches in ``<mark>``."""
+
+  def to_representation(self, value):
+    return marked_html(value)
+
+
 class ProductSerializer(serializers.ModelSerializer):
   category = CategorySerializer(read_only=True)
   brand = BrandSerializer(read_only=True)
 
   category_id = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all(), write_only=True, source='category')  
   brand_id = serializers.PrimaryKeyRelatedField(queryset=Brand.objects.all(), write_only=True, source='brand') 
+
+  image_variants = serializers.SerializerMethodField()
+
+  rating_avg = serializers.FloatField(read_only=True)
+  rating_histogram = serializers.DictField(child=serializers.IntegerField(), read_only=True)
+
+  search_highlight = MarkedTextField(read_only=True)
+  search_snippet = MarkedTextField(read_only=True)
     
 
   class Meta:
     model = Product
-    fields = ['id', 'name', 'brand', 'brand_id', 'description', 'price', 'stock_quantity', 'category', 'category_id', 'image', 'created_at', 'updated_at']
+    fields = ['id', 'sku', 'name', 'brand', 'brand_id', 'description', 'price', 'stock_quantity', 'category', 'category_id', 'image', 'image_variants', 'created_at', 'updated_at',
+              'rating_avg', 'rating_count', 'rating_histogram', 'search_highlight', 'search_snippet']
+    read_only_fields = ['rating_count']
 
   def create(self, validated_data):
     category = validated_data.pop('category', None)
@@ -37,6 +56,9 @@ class ProductSerializer(serializers.ModelSerializer):
     
     return product
     
+  def get_image_variants(self, obj):
+    return variant_urls(obj.image_variants, self.context.get('request'))
+    
   def validate_price(self, value):
     if value < 0:
         raise serializers.ValidationError("Price cannot be negative.")
@@ -48,6 +70,45 @@ class ProductSerializer(serializers.ModelSerializer):
     return value
 
 
+class StockAdjustmentSerializer(serializers.Serializer):
+  sku = serializers.CharField(max_length=64, required=False)
+  product_id = serializers.IntegerField(min_value=1, required=False)
+  set = serializers.IntegerField(min_value=0, required=False)
+  delta = serializers.IntegerField(required=False)
+
+  def validate(self, data):
+    # Products created before SKUs existed have none, so they are addressed by id.
+    if ('sku' in data) == ('product_id' in data):
+      raise serializers.ValidationError("Provide exactly one of 'sku' or 'product_id'.")
+    if ('set' in data) == ('delta' in data):
+      raise serializers.ValidationError("Provide exactly one of 'set' or 'delta'.")
+    return data
+
+
+class BulkStockAdjustmentSerializer(serializers.Serializer):
+  adjustments = StockAdjustmentSerializer(many=True, allow_empty=False)
+  all_or_nothing = serializers.BooleanField(default=False)
+
+
+class OrderTransitionSerializer(serializers.Serializer):
+  status = serializers.ChoiceField(choices=Order.STATUS_CHOICES)
+
+
+class BulkOrderTransitionSerializer(serializers.Serializer):
+  status = serializers.ChoiceField(choices=Order.STATUS_CHOICES)
+  ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, required=False)
+  current_status = serializers.ChoiceField(choices=Order.STATUS_CHOICES, required=False)
+  tracking_delivered = serializers.BooleanField(required=False)
+  placed_before = serializers.DateTimeField(required=False)
+
+  FILTERS = ('ids', 'current_status', 'tracking_delivered', 'placed_before')
+
+  def validate(self, data):
+    if not any(field in data for field in self.FILTERS):
+      raise serializers.ValidationError(f"Provide at least one of: {', '.join(self.FILTERS)}.")
+    return data
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
   product_id = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all(), source='product', write_only=True)
   product = ProductSerializer(read_only=True)
@@ -89,7 +150,7 @@ class OrderItemSerializer(serializers.ModelSerializer):
 
 
 class OrderSerializer(serializers.ModelSerializer):
-  order_item = OrderItemSerializer(many=True, read_only=True)
+  order_item = OrderItemSerializer(source='orderitem_set', many=True, read_only=True)
 
 
   shipping_method = serializers.PrimaryKeyRelatedField(queryset=ShippingMethod.objects.all(), write_only=True)
@@ -98,13 +159,19 @@ class OrderSerializer(serializers.ModelSerializer):
   shipped_at = serializers.DateTimeField(source="shippingdetail.shipped_at", read_only=True)
   delivered_at = serializers.DateTimeField(source="shippingdetail.delivered_at", read_only=True)
 
+  subtotal = serializers.DecimalField(source='subtotal_amount', max_digits=12, decimal_places=2, read_only=True)
+  shipping_total = serializers.DecimalField(source='shipping_amount', max_digits=12, decimal_places=2, read_only=True)
+  grand_total = serializers.DecimalField(source='grand_total_amount', max_digits=12, decimal_places=2, read_only=True)
+
 
   class Meta:
     model = Order
     fields = [
       'id', 'user', 'order_date', 'status', 'shipping_address', 'created_at', 'payment_intent_id', 'order_item',
-      'shipping_method', 'shipping_method_detail', 'tracking_number', 'shipped_at', 'delivered_at'
+      'shipping_method', 'shipping_method_detail', 'tracking_number', 'shipped_at', 'delivered_at',
+      'subtotal', 'shipping_total', 'grand_total'
     ]
+    read_only_fields = ['user', 'status']
 
 
   def create(self, validated_data):
@@ -141,8 +208,31 @@ class CartItemSerializer(serializers.ModelSerializer):
     fields = '__all__'
 
 
+class CartLineSerializer(serializers.Serializer):
+  product_id = serializers.IntegerField(min_value=1)
+  quantity = serializers.IntegerField(min_value=1)
+
+
+class CartLineUpdateSerializer(CartLineSerializer):
+  quantity = serializers.IntegerField(min_value=0)
+
+
+class CartBatchSerializer(serializers.Serializer):
+  mode = serializers.ChoiceField(choices=['add', 'set'], default='add')
+  items = CartLineUpdateSerializer(many=True, allow_empty=False)
+
+  def validate(self, data):
+    if data['mode'] == 'add' and any(line['quantity'] == 0 for line in data['items']):
+      raise serializers.ValidationError({'items': "Quantities must be positive when adding."})
+    return data
+
+
+class CartMergeSerializer(serializers.Serializer):
+  source_cart = serializers.IntegerField(min_value=1)
+
+
 class CartSerializer(serializers.ModelSerializer):
-  cartitem = CartItemSerializer(many=True, read_only=True)
+  cartitem = CartItemSerializer(source='cartitem_set', many=True, read_only=True)
 
   class Meta:
     model = Cart
@@ -161,3 +251,20 @@ class ShippingDetailSerializer(serializers.ModelSerializer):
     model = ShippingDetail
     fields = '__all__'
 
+
+class DailyProductSalesSerializer(serializers.ModelSerializer):
+  class Meta:
+    model = DailyProductSales
+    fields = ['day', 'product', 'units', 'revenue', 'orders']
+
+
+class DailyCategorySalesSerializer(serializers.ModelSerializer):
+  class Meta:
+    model = DailyCategorySales
+    fields = ['day', 'category', 'units', 'revenue', 'orders']
+
+
+class DailyBrandSalesSerializer(serializers.ModelSerializer):
+  class Meta:
+    model = DailyBrandSales
+    fields = ['day', 'brand', 'units', 'revenue', 'orders']
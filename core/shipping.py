@@ -1,13 +1,208 @@
+import random
+import threading
+import time
+
 import requests
 from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CarrierError(requests.RequestException):
+  """The carrier could not answer after all retries."""
+
+
+class CarrierUnavailable(CarrierError):
+  """The circuit breaker is open; the carrier was not called."""
+
+
+class CarrierRejected(CarrierError, requests.HTTPError):
+  """The carrier answered, but with a 4xx or a body that is not JSON."""
+
+
+class CircuitBreaker:
+  """
+  Opens after ``failure_threshold`` consecutive failed calls and rejects
+  calls for ``reset_timeout`` seconds. After that one trial call is let
+  through: success closes the breaker, failure opens it again.
+  """
+
+  def __init__(self, failure_threshold=5, reset_timeout=30.0):
+    self.failure_threshold = failure_threshold
+    self.reset_timeout = reset_timeout
+    self.failures = 0
+    self.opened_at = None
+    self.trial_running = False
+    self.lock = threading.Lock()
+
+  @property
+  def state(self):
+    if self.opened_at is None:
+      return 'closed'
+    if time.monotonic() - self.opened_at >= self.reset_timeout:
+      return 'half-open'
+    return 'open'
+
+  def allow(self):
+    with self.lock:
+      state = self.state
+      if state == 'closed':
+        return True
+      if state == 'half-open' and not self.trial_running:
+        self.trial_running = True
+        return True
+      return False
+
+  def record_success(self):
+    with self.lock:
+      self.failures = 0
+      self.opened_at = None
+      self.trial_running = False
+
+  def record_failure(self):
+    with self.lock:
+      self.failures += 1
+      if self.trial_running or self.failures >= self.failure_threshold:
+        if self.opened_at is None or self.trial_running:
+          logger.warning(f"Carrier circuit opened after {self.failures} consecutive failures.")
+        self.opened_at = time.monotonic()
+      self.trial_running = False
+
+
+class CarrierClient:
+  """
+  Carrier tracking client over one pooled ``requests.Session``. Calls use
+  connect/read timeouts, retry connection errors, timeouts and 429/5xx
+  responses with full-jitter exponential backoff, and go through a circuit
+  breaker so a degraded carrier fails fast. ``stats()`` returns the
+  request, error and latency counters.
+  """
+
+  def __init__(
+    self, base_url, api_key, timeout=(3.05, 10.0), retries=2, backoff=0.2, max_backoff=2.0,
+    pool_size=10, failure_threshold=5, reset_timeout=30.0,
+  ):
+    self.base_url = base_url.rstrip('/')
+    self.timeout = timeout
+    self.retries = retries
+    self.backoff = backoff
+    self.max_backoff = max_backoff
+    self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+    self.session = requests.Session()
+    self.session.headers['Authorization'] = f"Bearer {api_key}"
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    self.session.mount('https://', adapter)
+    self.session.mount('http://', adapter)
+
+    self.lock = threading.Lock()
+    self.counters = {
+      'calls': 0, 'requests': 0, 'successes': 0, 'failures': 0,
+      'retries': 0, 'short_circuited': 0, 'latency_total': 0.0, 'latency_max': 0.0,
+    }
+
+  def _count(self, **increments):
+    with self.lock:
+      for name, value in increments.items():
+        self.counters[name] += value
+
+  def _observe(self, latency):
+    with self.lock:
+      self.counters['requests'] += 1
+      self.counters['latency_total'] += latency
+      self.counters['latency_max'] = max(self.counters['latency_max'], latency)
+
+  def stats(self):
+    with self.lock:
+      stats = dict(self.counters)
+    stats['latency_avg'] = stats['latency_total'] / stats['requests'] if stats['requests'] else None
+    stats['breaker'] = self.breaker.state
+    return stats
+
+  def _sleep(self, attempt):
+    time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+
+  def get_tracking_info(self, tracking_number):
+    self._count(calls=1)
+    if not self.breaker.allow():
+      self._count(short_circuited=1)
+      raise CarrierUnavailable("Carrier circuit is open.")
+
+    url = f"{self.base_url}/{tracking_number}"
+    error = None
+    settled = False
+    try:
+      for attempt in range(self.retries + 1):
+        if attempt:
+          self._count(retries=1)
+          self._sleep(attempt - 1)
+
+        started = time.monotonic()
+        try:
+          response = self.session.get(url, timeout=self.timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+          self._observe(time.monotonic() - started)
+          error = e
+          continue
+        except requests.RequestException as e:
+          # Redirect loops, undecodable content and the like: retrying will not help.
+          self._observe(time.monotonic() - started)
+          error = e
+          break
+        self._observe(time.monotonic() - started)
+
+        if response.status_code in RETRY_STATUSES:
+          error = requests.HTTPError(f"{response.status_code} from carrier", response=response)
+          continue
+
+        # The carrier answered; a 4xx or a bad body is about this request, not carrier health.
+        self.breaker.record_success()
+        settled = True
+        try:
+          response.raise_for_status()
+          info = response.json()
+        except (requests.HTTPError, ValueError) as e:
+          self._count(failures=1)
+          raise CarrierRejected(f"Carrier rejected lookup for {tracking_number}: {e}", response=response) from e
+        self._count(successes=1)
+        return info
+    finally:
+      # Whatever ended the attempts, settle the breaker so a half-open trial never stays running.
+      if not settled:
+        self.breaker.record_failure()
+        self._count(failures=1)
+
+    logger.error(f"Carrier lookup for {tracking_number} failed after {attempt + 1} attempts: {error}")
+    raise CarrierError(f"Carrier lookup failed: {error}") from error
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+  """The process-wide client, built from settings on first use."""
+  global _client
+  with _client_lock:
+    if _client is None:
+      _client = CarrierClient(
+        settings.CARRIER_API_URL,
+        settings.CARRIER_API_KEY,
+        timeout=getattr(settings, 'CARRIER_API_TIMEOUT', (3.05, 10.0)),
+        retries=getattr(settings, 'CARRIER_API_RETRIES', 2),
+        pool_size=getattr(settings, 'CARRIER_API_POOL_SIZE', 10),
+        failure_threshold=getattr(settings, 'CARRIER_BREAKER_THRESHOLD', 5),
+        reset_timeout=getattr(settings, 'CARRIER_BREAKER_RESET_TIMEOUT', 30.0),
+      )
+    return _client
+
 
 class CarrierAPI:
   @staticmethod
   def get_tracking_info(tracking_number):
-    url = f"settings.CARRIER_API_URL/{tracking_number}"
-    headers = {
-      'Authorization': f"Bearer {settings.CARRIER_API_KEY}"
-    }
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    return response.json()
\ No newline at end of file
+    return get_client().get_tracking_info(tracking_number)
@@ -0,0 +1,62 @@
+import hashlib
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .versions import bump_version, get_version
+
+GENERATION_KEY = 'catalog-snapshot:generation'
+
+# Stock moves on every order, so stock-only writes do not retire snapshots;
+# the stock shown in a snapshotted listing is at most this old.
+SNAPSHOT_TIMEOUT = 5 * 60
+STOCK_FIELDS = frozenset({'stock_quantity', 'stock_shards', 'updated_at'})
+
+# The only query parameters a snapshotted listing may carry.
+SNAPSHOT_PARAMS = ('page', 'page_size', 'ordering', 'format')
+
+
+def is_stock_only(fields):
+  """Whether a write to these Product fields leaves the listing snapshots valid."""
+  return fields is not None and set(fields) <= STOCK_FIELDS
+
+
+def catalog_changed():
+  """
+  Retire every stored snapshot. The bump runs after the surrounding
+  transaction commits so a concurrent rebuild cannot capture uncommitted
+  state under the new generation.
+  """
+  transaction.on_commit(lambda: bump_version(GENERATION_KEY))
+
+
+def generation():
+  return get_version(GENERATION_KEY)
+
+
+def snapshot_key(request):
+  """
+  Return the cache key for an anonymous, unfiltered JSON listing request, or
+  ``None`` if the request has to go through the regular view.
+  """
+  if request.method != 'GET' or request.user.is_authenticated:
+    return None
+  if getattr(request.accepted_renderer, 'format', None) != 'json':
+    return None
+  params = request.query_params
+  if any(param not in SNAPSHOT_PARAMS for param in params):
+    return None
+
+  # Serialized URLs are absolute, so the host is part of the variant.
+  variant = '|'.join([request.get_host()] + [f"{param}={params.get(param, '')}" for param in SNAPSHOT_PARAMS if param != 'format'])
+  return f"catalog-snapshot:{generation()}:{hashlib.md5(variant.encode('utf-8')).hexdigest()}"
+
+
+def get_snapshot(key):
+  return cache.get(key)
+
+
+def store_snapshot(key, content):
+  etag = '"%s"' % hashlib.md5(content).hexdigest()
+  cache.set(key, (etag, content), SNAPSHOT_TIMEOUT)
+  return etag
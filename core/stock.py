@@ -0,0 +1,132 @@
+from django.db import transaction
+from django.db.models import Case, When, F, Value, IntegerField
+from django.utils import timezone
+
+from .models import Product
+from .reservations import held_quantity
+from . import stock_shards
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+
+def _chunks(items, size):
+  for start in range(0, len(items), size):
+    yield items[start:start + size]
+
+
+def _plan(operations, current):
+  """
+  Fold the ordered operations for one product into either an absolute value
+  (if any operation sets the stock) or a net delta, and the resulting quantity.
+  """
+  absolute = None
+  delta = 0
+  for operation, value in operations:
+    if operation == 'set':
+      absolute, delta = value, 0
+    else:
+      delta += value
+  final = (absolute if absolute is not None else current) + delta
+  return absolute, delta, final
+
+
+def _target(adjustment):
+  if adjustment.get('product_id') is not None:
+    return 'product_id', adjustment['product_id']
+  return 'sku', adjustment['sku']
+
+
+def adjust_stock(adjustments, all_or_nothing=False, batch_size=BATCH_SIZE):
+  """
+  Apply ``[{'sku': ..., 'set': n} | {'product_id': ..., 'delta': n}, ...]`` in
+  one transaction. SKUs are resolved to products first, so one product named
+  both ways is adjusted once. Affected rows are locked and read in batches,
+  every product is checked against the non-negative invariant and, if it
+  lowers stock, against the quantity held by unexpired reservations, and the
+  accepted changes are written with one ``CASE`` UPDATE per batch (``F()``
+  for deltas). Returns ``(applied, results)`` with one result per distinct
+  product in input order.
+  """
+  targets = [_target(adjustment) for adjustment in adjustments]
+  skus = list(dict.fromkeys(value for field, value in targets if field == 'sku'))
+
+  results = {}
+  accepted = []
+  sharded_totals = {}
+
+  with transaction.atomic():
+    now = timezone.now()
+    sku_ids = {}
+    for chunk in _chunks(skus, batch_size):
+      sku_ids.update(Product.objects.filter(sku__in=chunk).values_list('sku', 'id'))
+
+    # Keyed by product id, or by the (field, value) target of an unknown SKU.
+    operations = {}
+    for (field, value), adjustment in zip(targets, adjustments):
+      key = value if field == 'product_id' else sku_ids.get(value, (field, value))
+      if key not in operations:
+        operations[key] = []
+        if isinstance(key, tuple):
+          results[key] = {field: value, 'status': 'error', 'detail': "Product does not exist."}
+      if 'set' in adjustment:
+        operations[key].append(('set', adjustment['set']))
+      else:
+        operations[key].append(('delta', adjustment['delta']))
+
+    product_ids = [key for key in operations if not isinstance(key, tuple)]
+    for chunk in _chunks(product_ids, batch_size):
+      rows = {
+        product_id: (sku, stock_quantity, sharded, held)
+        for product_id, sku, stock_quantity, sharded, held in Product.objects.select_for_update()
+        .filter(id__in=chunk).annotate(current_stock=stock_shards.current_stock(), held=held_quantity(now=now))
+        .values_list('id', 'sku', 'current_stock', 'stock_shards', 'held')
+      }
+      for product_id in chunk:
+        if product_id not in rows:
+          results[product_id] = {'product_id': product_id, 'status': 'error', 'detail': "Product does not exist."}
+          continue
+        sku, current, sharded, held = rows[product_id]
+        absolute, delta, final = _plan(operations[product_id], current)
+        if final < 0:
+          results[product_id] = {
+            'product_id': product_id, 'sku': sku, 'status': 'error', 'stock_quantity': current,
+            'detail': "Adjustment would make stock negative.",
+          }
+          continue
+        if final < current and final < held:
+          # Same guard as place_order: never take away stock already promised to carts.
+          results[product_id] = {
+            'product_id': product_id, 'sku': sku, 'status': 'error', 'stock_quantity': current, 'held': held,
+            'detail': f"Adjustment would leave less than the {held} units held in carts.",
+          }
+          continue
+        results[product_id] = {'product_id': product_id, 'sku': sku, 'status': 'ok', 'previous': current, 'stock_quantity': final}
+        accepted.append((product_id, final if sharded else absolute, 0 if sharded else delta))
+        if sharded:
+          sharded_totals[product_id] = final
+
+    failed = len(operations) - len(accepted)
+    if all_or_nothing and failed:
+      for result in results.values():
+        if result['status'] == 'ok':
+          result.update(status='skipped', stock_quantity=result.pop('previous'))
+      return 0, [results[key] for key in operations]
+
+    for chunk in _chunks(accepted, batch_size):
+      whens = [
+        When(id=product_id, then=Value(absolute + delta) if absolute is not None else F('stock_quantity') + delta)
+        for product_id, absolute, delta in chunk
+      ]
+      Product.objects.filter(id__in=[product_id for product_id, _, _ in chunk]).update(
+        stock_quantity=Case(*whens, default=F('stock_quantity'), output_field=IntegerField()),
+        updated_at=now,
+      )
+    for product_id, total in sharded_totals.items():
+      stock_shards.set_total(product_id, total)
+
+  logger.info(f"Applied {len(accepted)} stock adjustments, {failed} rejected.")
+  return len(accepted), [results[key] for key in operations]
@@ -0,0 +1,136 @@
+import random
+
+from django.db import transaction
+from django.db.models import Case, When, F, Value, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Product, StockShard
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAX_SHARDS = 64
+
+
+def sharded_total():
+  total = StockShard.objects.filter(product=OuterRef('pk')).order_by().values('product').annotate(total=Sum('quantity')).values('total')
+  return Coalesce(Subquery(total), Value(0))
+
+
+def current_stock():
+  """
+  Expression for a product's live stock: ``stock_quantity`` for regular
+  products and the sum of the shard rows for sharded ones.
+  """
+  return Case(
+    When(stock_shards=0, then=F('stock_quantity')),
+    default=sharded_total(),
+    output_field=IntegerField(),
+  )
+
+
+def _split(total, shards):
+  share, extra = divmod(total, shards)
+  return [share + (1 if index < extra else 0) for index in range(shards)]
+
+
+def take(product_id, quantity, attempts=3):
+  """
+  Decrement a sharded product's stock by ``quantity``; returns ``False`` if
+  there is not enough. The common case is one conditional UPDATE on a random
+  shard that covers the whole quantity, so concurrent checkouts of the same
+  product lock different rows instead of queueing on one. If no single shard
+  can cover it, every shard is locked in order and the quantity is taken
+  across them.
+  """
+  with transaction.atomic():
+    for _ in range(attempts):
+      candidate = (
+        StockShard.objects.filter(product_id=product_id, quantity__gte=quantity)
+        .order_by('?').values('id')[:1]
+      )
+      # Re-checking the quantity lets a race on the picked shard fail cleanly and retry.
+      if StockShard.objects.filter(id=Subquery(candidate), quantity__gte=quantity).update(quantity=F('quantity') - quantity):
+        return True
+
+    shards = list(StockShard.objects.select_for_update().filter(product_id=product_id).order_by('shard'))
+    if sum(shard.quantity for shard in shards) < quantity:
+      return False
+    remaining = quantity
+    for shard in shards:
+      taken = min(shard.quantity, remaining)
+      shard.quantity -= taken
+      remaining -= taken
+    StockShard.objects.bulk_update(shards, ['quantity'])
+    return True
+
+
+def give_back(product_id, quantity):
+  """Return stock to one random shard of a sharded product."""
+  shards = Product.objects.filter(id=product_id).values_list('stock_shards', flat=True).first()
+  if not shards:
+    return
+  StockShard.objects.filter(product_id=product_id, shard=random.randrange(shards)).update(quantity=F('quantity') + quantity)
+
+
+def _redistribute(product_id, total=None):
+  shards = list(StockShard.objects.select_for_update().filter(product_id=product_id).order_by('shard'))
+  if total is None:
+    total = sum(shard.quantity for shard in shards)
+  for shard, quantity in zip(shards, _split(total, len(shards))):
+    shard.quantity = quantity
+  StockShard.objects.bulk_update(shards, ['quantity'])
+  return total
+
+
+def set_total(product_id, total):
+  """Lock every shard and spread ``total`` evenly across them."""
+  with transaction.atomic():
+    _redistribute(product_id, total)
+
+
+def rebalance(product_id):
+  """Even out a sharded product's shards and copy the total into ``stock_quantity``."""
+  with transaction.atomic():
+    total = _redistribute(product_id)
+    Product.objects.filter(id=product_id).exclude(stock_quantity=total).update(stock_quantity=total, updated_at=timezone.now())
+  return total
+
+
+def rebalance_all():
+  product_ids = list(Product.objects.filter(stock_shards__gt=0).values_list('id', flat=True))
+  for product_id in product_ids:
+    rebalance(product_id)
+  return len(product_ids)
+
+
+def enable(product_id, shards):
+  """Move a product's stock into ``shards`` counter rows."""
+  if not 1 <= shards <= MAX_SHARDS:
+    raise ValueError(f"shards must be between 1 and {MAX_SHARDS}.")
+  with transaction.atomic():
+    product = Product.objects.select_for_update().get(id=product_id)
+    total = product.stock_quantity
+    if product.stock_shards:
+      total = sum(StockShard.objects.select_for_update().filter(product=product).values_list('quantity', flat=True))
+    StockShard.objects.filter(product=product).delete()
+    StockShard.objects.bulk_create([
+      StockShard(product=product, shard=index, quantity=quantity)
+      for index, quantity in enumerate(_split(total, shards))
+    ])
+    Product.objects.filter(id=product_id).update(stock_shards=shards, stock_quantity=total, updated_at=timezone.now())
+  logger.info(f"Split stock of product {product_id} ({total}) across {shards} shards.")
+  return total
+
+
+def disable(product_id):
+  """Fold a product's shards back into ``stock_quantity``."""
+  with transaction.atomic():
+    Product.objects.select_for_update().get(id=product_id)
+    total = sum(StockShard.objects.select_for_update().filter(product_id=product_id).values_list('quantity', flat=True))
+    StockShard.objects.filter(product_id=product_id).delete()
+    Product.objects.filter(id=product_id).update(stock_shards=0, stock_quantity=total, updated_at=timezone.now())
+  logger.info(f"Folded stock shards of product {product_id} back into one counter ({total}).")
+  return total
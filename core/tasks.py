@@ -1,7 +1,90 @@
 from celery import shared_task
-from .models import ShippingDetail
+from django.conf import settings
+from django.utils import timezone
+from PIL import Image
+
+from .models import Product
+from .images import build_variants
+from .reservations import purge_expired
+from . import idempotency
+from . import stock_shards
+from . import analytics
+from . import cart_store
+from . import carts
+from . import tracking
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def update_all_tracking_info(fan_out=None, chunk_size=tracking.CHUNK_SIZE):
+  """
+  Refresh undelivered shipments. With ``fan_out`` each chunk of ids is
+  queued as its own ``refresh_tracking_chunk`` task so workers share the
+  load; otherwise all chunks are refreshed here.
+  """
+  if fan_out is None:
+    fan_out = getattr(settings, 'TRACKING_REFRESH_FAN_OUT', False)
+  if not fan_out:
+    return tracking.refresh_all(chunk_size=chunk_size)
+
+  chunks = 0
+  for ids in tracking.pending_chunks(chunk_size):
+    refresh_tracking_chunk.delay(ids)
+    chunks += 1
+  logger.info(f"Queued {chunks} tracking refresh chunks.")
+  return chunks
+
+
+@shared_task
+def refresh_tracking_chunk(ids):
+  return tracking.refresh_chunk(ids)
+
+
+@shared_task
+def generate_image_variants(product_id):
+  product = Product.objects.filter(id=product_id).only('id', 'image').first()
+  if product is None or not product.image:
+    return None
+
+  try:
+    variants = build_variants(product.image)
+  except (OSError, ValueError, Image.DecompressionBombError) as e:
+    logger.error(f"Error generating image variants for product {product_id}: {e}")
+    return None
+
+  # Only store the variants if the image was not replaced in the meantime.
+  Product.objects.filter(id=product_id, image=product.image.name).update(image_variants=variants, updated_at=timezone.now())
+  return variants
+
+
+@shared_task
+def purge_expired_reservations():
+  return purge_expired()
+
+
+@shared_task
+def purge_expired_idempotency_keys():
+  return idempotency.purge_expired()
+
+
+@shared_task
+def rebalance_stock_shards():
+  return stock_shards.rebalance_all()
+
+
+@shared_task
+def update_sales_rollups():
+  return analytics.update_rollups()
+
+
+@shared_task
+def flush_cart_store():
+  return cart_store.flush_dirty()
+
 
 @shared_task
-def update_all_tracking_info():
-  for detail in ShippingDetail.objects.filter(tracking_number__isnull=False):
-    detail.update_tracking_info()
+def purge_abandoned_carts():
+  return carts.purge_abandoned(archive_dir=getattr(settings, 'ABANDONED_CART_ARCHIVE_DIR', None))
@@ -1,3 +1,1274 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+import requests
+import stripe
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import InMemoryStorage, default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image as PILImage
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+
+from accounts.models import CustomUser
+from payment.views import PaymentViewSet
+from .models import (
+  Brand, Cart, CartItem, Category, IdempotencyKey, Product, Order, OrderItem, OrderStatusTransition, Review,
+  ShippingMethod, ShippingDetail, StockReservation, StockShard,
+  DailyBrandSales, DailyCategorySales, DailyProductSales, RollupWatermark,
+)
+from .catalog_import import import_catalog
+from .orders import place_order
+from .stock import adjust_stock
+from .tasks import generate_image_variants
+from . import analytics
+from . import carts
+from . import cart_summary
+from . import images
+from . import cart_store
+from . import order_status
+from . import reservations
+from . import snapshots
+from . import stock_shards
+from . import tracking
+from .shipping import CarrierClient, CarrierError, CarrierRejected, CarrierUnavailable
+
+
+class OrderQueryBudgetTests(TestCase):
+  """The order read path must cost a fixed number of queries, whatever the page size."""
+
+  QUERY_BUDGET = 5
+
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = CustomUser.objects.create_user(username='buyer', email='buyer@example.com', password='secret')
+    method = ShippingMethod.objects.create(name='Standard', rate='4.99')
+
+    products = []
+    for index in range(3):
+      brand = Brand.objects.create(name=f'Brand {index}')
+      category = Category.objects.create(category_name=f'Category {index}')
+      products.append(Product.objects.create(
+        name=f'Product {index}', brand=brand, category=category, description='',
+        image='', price='10.00', stock_quantity=1000,
+      ))
+
+    for _ in range(25):
+      order = Order.objects.create(user=cls.user, shipping_address='1 Main St')
+      OrderItem.objects.bulk_create([
+        OrderItem(order=order, product=product, quantity=1, price=product.price)
+        for product in products
+      ])
+      ShippingDetail.objects.create(order=order, shipping_method=method, tracking_number='TRACK')
+    cls.order = order
+
+  def setUp(self):
+    self.client = APIClient()
+    self.client.force_authenticate(self.user)
+
+  def assertWithinBudget(self, url):
+    with CaptureQueriesContext(connection) as queries:
+      response = self.client.get(url)
+    self.assertEqual(response.status_code, 200)
+    self.assertLessEqual(
+      len(queries), self.QUERY_BUDGET,
+      f"{url} ran {len(queries)} queries:\n" + '\n'.join(query['sql'] for query in queries),
+    )
+    return response
+
+  def test_list_within_budget_for_any_page_size(self):
+    for page_size in (1, 10, 20):
+      response = self.assertWithinBudget(f'/api/v1/orders/?page_size={page_size}')
+      self.assertEqual(len(response.data['results']), page_size)
+      self.assertEqual(len(response.data['results'][0]['order_item']), 3)
+
+  def test_keyset_list_within_budget(self):
+    response = self.assertWithinBudget('/api/v1/orders/?cursor=&page_size=20')
+    self.assertEqual(len(response.data['results']), 20)
+
+  def test_detail_within_budget(self):
+    response = self.assertWithinBudget(f'/api/v1/orders/{self.order.id}/')
+    self.assertEqual(response.data['tracking_number'], 'TRACK')
+    self.assertEqual(response.data['shipping_method_detail'], 'Standard')
+    self.assertEqual(len(response.data['order_item']), 3)
+
+
+
+class OrderTotalsTests(TestCase):
+  def setUp(self):
+    self.user = CustomUser.objects.create_user(username='totals', email='totals@example.com', password='secret')
+    self.method = ShippingMethod.objects.create(name='Standard', rate='4.99')
+    self.product = Product.objects.create(
+      sku='TOT-1', name='Hammer', brand=Brand.objects.create(name='Acme'),
+      category=Category.objects.create(category_name='Tools'), description='',
+      image='', price='10.00', stock_quantity=100,
+    )
+    self.order = Order.objects.create(user=self.user, shipping_address='1 Main St')
+    self.line = OrderItem.objects.create(order=self.order, product=self.product, quantity=2, price='10.00')
+    ShippingDetail.objects.create(order=self.order, shipping_method=self.method)
+
+  def totals(self):
+    order = Order.objects.with_totals().get(id=self.order.id)
+    return order.subtotal_amount, order.shipping_amount, order.grand_total_amount
+
+  def test_totals_are_materialized_on_the_order(self):
+    order = Order.objects.get(id=self.order.id)
+    self.assertEqual((order.subtotal, order.shipping_total, order.grand_total), (Decimal('20.00'), Decimal('4.99'), Decimal('24.99')))
+    self.assertEqual(order.total_amount(), Decimal('20.00'))
+    self.assertEqual(self.totals(), (Decimal('20.00'), Decimal('4.99'), Decimal('24.99')))
+
+  def test_orders_without_stored_totals_fall_back_to_their_lines(self):
+    Order.objects.filter(id=self.order.id).update(subtotal=None, shipping_total=None, grand_total=None)
+    self.assertEqual(self.totals(), (Decimal('20.00'), Decimal('4.99'), Decimal('24.99')))
+    self.assertEqual(Order.objects.get(id=self.order.id).total_amount(), Decimal('20.00'))
+
+    Order.objects.get(id=self.order.id).recalculate_totals()
+    self.assertEqual(Order.objects.values_list('grand_total', flat=True).get(id=self.order.id), Decimal('24.99'))
+
+  def test_line_edits_and_deletes_recalculate_totals(self):
+    self.line.quantity = 3
+    self.line.save()
+    self.assertEqual(self.totals(), (Decimal('30.00'), Decimal('4.99'), Decimal('34.99')))
+
+    OrderItem.objects.create(order=self.order, product=self.product, quantity=1, price='5.00')
+    self.line.delete()
+    self.assertEqual(self.totals(), (Decimal('5.00'), Decimal('4.99'), Decimal('9.99')))
+
+class KeysetPaginationTests(TestCase):
+  @classmethod
+  def setUpTestData(cls):
+    brand = Brand.objects.create(name='Acme')
+    category = Category.objects.create(category_name='Tools')
+    # Few distinct prices and names, so most rows tie on the sort field.
+    Product.objects.bulk_create([
+      Product(
+        sku=f'KEY-{index}', name=f'Tool {index % 3}', brand=brand, category=category, description='',
+        image='', price=f'{5 + index % 4}.50', stock_quantity=1,
+      )
+      for index in range(23)
+    ])
+
+  def walk(self, ordering):
+    ids = []
+    url = f'/api/v1/products/?cursor=&page_size=4&ordering={ordering}'
+    client = APIClient()
+    while url:
+      response = client.get(url)
+      self.assertEqual(response.status_code, 200)
+      ids += [product['id'] for product in response.json()['results']]
+      url = response.json()['next']
+    return ids
+
+  def test_next_links_visit_every_row_once(self):
+    for ordering in ('price', '-price', 'name,-price', '-name'):
+      fields = ordering.split(',')
+      tiebreak = '-id' if fields[-1].startswith('-') else 'id'
+      expected = list(Product.objects.order_by(*fields, tiebreak).values_list('id', flat=True))
+      self.assertEqual(self.walk(ordering), expected, ordering)
+
+
+class StockShardTests(TestCase):
+  """Sharded products must keep the same stock totals as the single counter."""
+
+  def setUp(self):
+    self.user = CustomUser.objects.create_user(username='buyer', email='buyer@example.com', password='secret')
+    self.product = Product.objects.create(
+      sku='HOT-1', name='Hot', brand=Brand.objects.create(name='Brand'),
+      category=Category.objects.create(category_name='Category'), description='',
+      image='', price='10.00', stock_quantity=10,
+    )
+    stock_shards.enable(self.product.id, 4)
+
+  def shard_total(self):
+    return sum(StockShard.objects.filter(product=self.product).values_list('quantity', flat=True))
+
+  def test_enable_splits_stock(self):
+    self.assertEqual(sorted(StockShard.objects.filter(product=self.product).values_list('quantity', flat=True)), [2, 2, 3, 3])
+
+  def test_take_spans_shards_and_never_oversells(self):
+    self.assertTrue(stock_shards.take(self.product.id, 7))
+    self.assertEqual(self.shard_total(), 3)
+    self.assertFalse(stock_shards.take(self.product.id, 4))
+    self.assertEqual(self.shard_total(), 3)
+
+  def test_orders_and_adjustments_use_shards(self):
+    order = place_order(self.user, [{'product_id': self.product.id, 'quantity': 6}], shipping_address='1 Main St')
+    self.assertEqual(self.shard_total(), 4)
+
+    OrderItem.objects.filter(order=order).first().delete()
+    self.assertEqual(self.shard_total(), 10)
+
+    adjust_stock([{'sku': 'HOT-1', 'delta': 5}])
+    self.assertEqual(self.shard_total(), 15)
+    self.assertEqual(stock_shards.disable(self.product.id), 15)
+    self.assertEqual(Product.objects.get(id=self.product.id).stock_quantity, 15)
+
+  def test_direct_stock_writes_survive_rebalance(self):
+    stale = Product.objects.get(id=self.product.id)
+    Product.objects.filter(id=self.product.id).update(stock_shards=0)
+    stale.name = 'Renamed'
+    stale.save()
+    Product.objects.filter(id=self.product.id).update(stock_shards=4)
+
+    product = Product.objects.get(id=self.product.id)
+    product.stock_quantity = 25
+    product.save()
+    stock_shards.rebalance_all()
+    self.assertEqual(self.shard_total(), 25)
+
+    import_catalog([{'sku': 'HOT-1', 'name': 'Hot', 'price': '10.00', 'stock_quantity': '40', 'brand': 'Brand', 'category': 'Category'}])
+    stock_shards.rebalance_all()
+    self.assertEqual(self.shard_total(), 40)
+    self.assertEqual(Product.objects.values_list('stock_quantity', 'stock_shards').get(id=self.product.id), (40, 4))
+
+
+class StockAdjustmentTests(TestCase):
+  def setUp(self):
+    self.staff = CustomUser.objects.create_user(username='warehouse', email='warehouse@example.com', password='secret', is_staff=True)
+    self.shopper = CustomUser.objects.create_user(username='shopper', email='shopper@example.com', password='secret')
+    brand = Brand.objects.create(name='Acme')
+    category = Category.objects.create(category_name='Tools')
+    self.legacy = Product.objects.create(
+      name='Legacy', brand=brand, category=category, description='',
+      image='', price='10.00', stock_quantity=5,
+    )
+    self.product = Product.objects.create(
+      sku='ADJ-2', name='Hammer', brand=brand, category=category, description='',
+      image='', price='10.00', stock_quantity=5,
+    )
+    self.client = APIClient()
+    self.client.force_authenticate(self.staff)
+
+  def adjust(self, adjustments, **options):
+    return self.client.post('/api/v1/products/stock-adjustments/', {'adjustments': adjustments, **options}, format='json')
+
+  def test_products_without_sku_are_adjusted_by_id(self):
+    response = self.adjust([
+      {'product_id': self.legacy.id, 'delta': 3},
+      {'sku': 'ADJ-2', 'set': 1},
+      {'product_id': self.product.id, 'delta': 1},
+      {'sku': 'NOPE', 'delta': 1},
+      {'product_id': self.product.id + 100, 'delta': 1},
+    ])
+    self.assertEqual(response.status_code, 200)
+    body = response.json()
+    self.assertEqual((body['applied'], body['failed']), (2, 2))
+    self.assertEqual(
+      [(result.get('product_id'), result.get('sku'), result['status'], result.get('stock_quantity')) for result in body['results']],
+      [
+        (self.legacy.id, None, 'ok', 8),
+        (self.product.id, 'ADJ-2', 'ok', 2),
+        (None, 'NOPE', 'error', None),
+        (self.product.id + 100, None, 'error', None),
+      ],
+    )
+    self.assertEqual(dict(Product.objects.values_list('id', 'stock_quantity')), {self.legacy.id: 8, self.product.id: 2})
+
+    self.assertEqual(self.adjust([{'sku': 'ADJ-2', 'product_id': self.product.id, 'delta': 1}]).status_code, 400)
+    self.assertEqual(self.adjust([{'delta': 1}]).status_code, 400)
+
+  def test_reductions_below_held_stock_are_rejected(self):
+    reservations.reserve(self.shopper, self.product.id, 3)
+    results = adjust_stock([{'product_id': self.product.id, 'set': 2}, {'product_id': self.legacy.id, 'set': 0}])[1]
+    self.assertEqual(
+      [(result['status'], result.get('held')) for result in results],
+      [('error', 3), ('ok', None)],
+    )
+    self.assertEqual(adjust_stock([{'sku': 'ADJ-2', 'delta': -2}])[0], 1)
+    self.assertEqual(adjust_stock([{'sku': 'ADJ-2', 'delta': -1}])[1][0]['status'], 'error')
+
+    # Expired holds no longer count, and increases are always accepted.
+    StockReservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+    self.assertEqual(adjust_stock([{'sku': 'ADJ-2', 'set': 1}])[0], 1)
+    reservations.reserve(self.shopper, self.product.id, 1)
+    StockReservation.objects.update(quantity=4)
+    self.assertEqual(adjust_stock([{'sku': 'ADJ-2', 'delta': 1}])[0], 1)
+    self.assertEqual(Product.objects.get(id=self.product.id).stock_quantity, 2)
+
+
+class OrderPlacementTests(TestCase):
+  def setUp(self):
+    cache.clear()
+    self.user = CustomUser.objects.create_user(username='orderer', email='orderer@example.com', password='secret')
+    self.method = ShippingMethod.objects.create(name='Standard', rate='4.99')
+    self.product = Product.objects.create(
+      sku='ORD-1', name='Hammer', brand=Brand.objects.create(name='Acme'),
+      category=Category.objects.create(category_name='Tools'), description='',
+      image='', price='10.00', stock_quantity=3,
+    )
+    self.client = APIClient()
+    self.client.force_authenticate(self.user)
+
+  def order(self, quantity, **headers):
+    body = {'shipping_address': '1 Main St', 'shipping_method': self.method.id, 'order_items': [{'product_id': self.product.id, 'quantity': quantity}]}
+    return self.client.post('/api/v1/orders/', body, format='json', **headers)
+
+  def test_shortages_keep_numbers(self):
+    response = self.order(20)
+    self.assertEqual(response.status_code, 400)
+    self.assertEqual(response.json()['order_items'], [{
+      'product_id': self.product.id, 'requested': 20, 'available': 3, 'detail': "Not enough stock available.",
+    }])
+
+  def test_idempotency_key_replays_and_rejects_other_bodies(self):
+    with self.captureOnCommitCallbacks(execute=True):
+      first = self.order(1, HTTP_IDEMPOTENCY_KEY='checkout-1')
+    self.assertEqual(first.status_code, 201)
+
+    # The stored response is served from the cache without touching the key table.
+    with CaptureQueriesContext(connection) as queries:
+      replay = self.order(1, HTTP_IDEMPOTENCY_KEY='checkout-1')
+    self.assertEqual((replay.status_code, replay['Idempotent-Replayed']), (201, 'true'))
+    self.assertEqual(replay.json()['id'], first.json()['id'])
+    self.assertFalse([query for query in queries.captured_queries if 'core_idempotencykey' in query['sql']])
+
+    cache.clear()
+    replay = self.order(1, HTTP_IDEMPOTENCY_KEY='checkout-1')
+    self.assertEqual((replay.status_code, replay.json()['id']), (201, first.json()['id']))
+    self.assertEqual(self.order(2, HTTP_IDEMPOTENCY_KEY='checkout-1').status_code, 422)
+    self.assertEqual(Order.objects.count(), 1)
+
+  def test_idempotency_keys_are_per_user(self):
+    self.assertEqual(self.order(1, HTTP_IDEMPOTENCY_KEY='checkout-1').status_code, 201)
+    other = CustomUser.objects.create_user(username='other', email='other@example.com', password='secret')
+    self.client.force_authenticate(other)
+    response = self.order(1, HTTP_IDEMPOTENCY_KEY='checkout-1')
+    self.assertEqual(response.status_code, 201)
+    self.assertFalse(response.has_header('Idempotent-Replayed'))
+    self.assertEqual(Order.objects.filter(user=other).count(), 1)
+
+  def test_payment_server_errors_release_the_key(self):
+    order = place_order(self.user, [{'product_id': self.product.id, 'quantity': 1}], shipping_address='1 Main St')
+    body = {'order_id': order.id, 'amount': '10.00'}
+    intent = mock.Mock(id='pi_1', client_secret='secret_1')
+    with mock.patch('stripe.PaymentIntent.create', side_effect=[stripe.error.StripeError('down'), intent]) as create:
+      response = self.client.post('/api/v1/payment/payments/', body, format='json', HTTP_IDEMPOTENCY_KEY='pay-1')
+      self.assertEqual(response.status_code, 500)
+      self.assertFalse(IdempotencyKey.objects.exists())
+
+      response = self.client.post('/api/v1/payment/payments/', body, format='json', HTTP_IDEMPOTENCY_KEY='pay-1')
+      self.assertEqual((response.status_code, response.json()['payment_intent_id']), (201, 'pi_1'))
+      replay = self.client.post('/api/v1/payment/payments/', body, format='json', HTTP_IDEMPOTENCY_KEY='pay-1')
+      self.assertEqual((replay.status_code, replay['Idempotent-Replayed']), (201, 'true'))
+    self.assertEqual(create.call_count, 2)
+    self.assertEqual(create.call_args.kwargs['idempotency_key'], f'{self.user.id}:{order.id}:pay-1')
+
+
+  def test_payments_only_for_own_orders(self):
+    other = CustomUser.objects.create_user(username='other', email='other@example.com', password='secret')
+    order = place_order(other, [{'product_id': self.product.id, 'quantity': 1}], shipping_address='1 Main St')
+    with mock.patch('stripe.PaymentIntent.create') as create:
+      response = self.client.post('/api/v1/payment/payments/', {'order_id': order.id, 'amount': '10.00'}, format='json')
+    self.assertEqual(response.status_code, 404)
+    create.assert_not_called()
+
+  def test_only_final_outcomes_are_stored(self):
+    order = place_order(self.user, [{'product_id': self.product.id, 'quantity': 1}], shipping_address='1 Main St')
+    body = {'order_id': order.id, 'amount': '10.00'}
+    pay = lambda: self.client.post('/api/v1/payment/payments/', body, format='json', HTTP_IDEMPOTENCY_KEY='pay-1')
+
+    def duplicate(request):
+      # The key is claimed, not locked, while the handler runs: a duplicate is turned away at once.
+      self.assertEqual(pay().status_code, 409)
+      return Response({'error': 'Slow down'}, status=429)
+
+    with mock.patch.object(PaymentViewSet, 'create_payment', side_effect=duplicate) as create_payment:
+      self.assertEqual(pay().status_code, 429)
+      self.assertFalse(IdempotencyKey.objects.exists())
+      create_payment.side_effect = [Response({'error': 'Conflict'}, status=409), Response({'error': 'Declined'}, status=400)]
+      self.assertEqual(pay().status_code, 409)
+      self.assertEqual(pay().status_code, 400)
+      replay = pay()
+    self.assertEqual((replay.status_code, replay['Idempotent-Replayed']), (400, 'true'))
+    self.assertEqual(create_payment.call_count, 3)
+
+class CatalogImportTests(TestCase):
+  def test_rows_the_columns_cannot_hold_fail_alone(self):
+    row = {'sku': 'IMP-1', 'name': 'Hammer', 'price': '10.00', 'stock_quantity': '5', 'brand': 'Acme', 'category': 'Tools'}
+    rows = [row] + [
+      dict(row, sku=f'IMP-{index}', **change)
+      for index, change in enumerate([
+        {'price': '12345678901'}, {'price': 'Infinity'}, {'price': 'NaN'}, {'name': 'x' * 256},
+        # JSONL numbers: fractions and booleans are not stock counts.
+        {'stock_quantity': 3.5}, {'stock_quantity': True}, {'stock_quantity': '2.5'}, {'stock_quantity': 'Infinity'},
+      ], start=2)
+    ] + [dict(row, sku='X' * 65)]
+    totals = import_catalog(rows)
+    self.assertEqual((totals['imported'], totals['failed']), (1, 9))
+    self.assertEqual(list(Product.objects.values_list('sku', flat=True)), ['IMP-1'])
+
+  def test_partial_feed_keeps_missing_columns(self):
+    row = {'sku': 'IMP-1', 'name': 'Hammer', 'price': '10.00', 'stock_quantity': '5', 'brand': 'Acme', 'category': 'Tools'}
+    with mock.patch('core.catalog_import.generate_image_variants'):
+      import_catalog([dict(row, description='Steel head', image='product_img/hammer.jpg')])
+      totals = import_catalog([
+        dict(row, price='12.00'),
+        dict(row, sku='IMP-2', description='Cleared'),
+        {'sku': 'IMP-3', 'name': 'Saw', 'price': '8.00', 'stock_quantity': 1.0, 'brand': 123, 'category': 7},
+      ])
+    self.assertEqual((totals['imported'], totals['failed']), (3, 0))
+    product = Product.objects.get(sku='IMP-1')
+    self.assertEqual((product.price, product.description, product.image.name), (Decimal('12.00'), 'Steel head', 'product_img/hammer.jpg'))
+    self.assertEqual(Product.objects.get(sku='IMP-2').description, 'Cleared')
+    self.assertEqual(Product.objects.select_related('brand').get(sku='IMP-3').brand.name, '123')
+
+
+class StubCarrierHandler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def do_GET(self):
+    server = self.server
+    server.hits.append((self.path, self.client_address[1]))
+    status, delay = server.script.pop(0) if server.script else (200, 0)
+    status = server.statuses.get(self.path, status)
+    time.sleep(delay)
+    body = json.dumps(server.bodies.get(self.path, {'shipped_at': '2024-01-02T00:00:00Z'})).encode()
+    try:
+      self.send_response(status)
+      self.send_header('Content-Type', 'application/json')
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+    except (BrokenPipeError, ConnectionResetError):
+      # The client gave up waiting (read timeout).
+      self.close_connection = True
+
+  def log_message(self, *args):
+    pass
+
+
+class StubCarrierMixin:
+  """Runs a local carrier stub server for the duration of each test."""
+
+  def setUp(self):
+    super().setUp()
+    self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubCarrierHandler)
+    self.server.daemon_threads = True
+    self.server.hits = []
+    self.server.script = []
+    self.server.bodies = {}
+    self.server.statuses = {}
+    thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    thread.start()
+    self.addCleanup(self.server.server_close)
+    self.addCleanup(self.server.shutdown)
+
+  def carrier(self, **kwargs):
+    options = {'timeout': (1, 0.3), 'retries': 2, 'backoff': 0.01, 'failure_threshold': 2, 'reset_timeout': 60}
+    options.update(kwargs)
+    client = CarrierClient(f'http://127.0.0.1:{self.server.server_port}/track/', 'key', **options)
+    self.addCleanup(client.session.close)
+    return client
+
+
+class CarrierClientTests(StubCarrierMixin, SimpleTestCase):
+  """The carrier client against a local stub server."""
+
+  def test_success_reuses_pooled_connection(self):
+    client = self.carrier()
+    for _ in range(3):
+      self.assertEqual(client.get_tracking_info('TRK1'), {'shipped_at': '2024-01-02T00:00:00Z'})
+    self.assertEqual({path for path, _ in self.server.hits}, {'/track/TRK1'})
+    self.assertEqual(len({port for _, port in self.server.hits}), 1)
+    stats = client.stats()
+    self.assertEqual((stats['successes'], stats['failures'], stats['retries']), (3, 0, 0))
+    self.assertIsNotNone(stats['latency_avg'])
+
+  def test_retries_server_errors_and_timeouts(self):
+    self.server.script = [(503, 0), (200, 1)]
+    client = self.carrier()
+    self.assertEqual(client.get_tracking_info('TRK1')['shipped_at'], '2024-01-02T00:00:00Z')
+    self.assertEqual(len(self.server.hits), 3)
+    self.assertEqual(client.stats()['retries'], 2)
+
+  def test_client_errors_are_not_retried(self):
+    self.server.script = [(404, 0)] * 3
+    client = self.carrier()
+    for _ in range(3):
+      with self.assertRaises(CarrierRejected):
+        client.get_tracking_info('NOPE')
+    self.assertEqual(len(self.server.hits), 3)
+    self.assertEqual(client.breaker.state, 'closed')
+
+  def test_unexpected_errors_settle_the_breaker(self):
+    client = self.carrier(retries=1, failure_threshold=1, reset_timeout=0)
+    client.breaker.record_failure()
+    with mock.patch.object(client.session, 'get', side_effect=requests.TooManyRedirects('loop')):
+      with self.assertRaises(CarrierError):
+        client.get_tracking_info('TRK1')
+    with mock.patch.object(client.session, 'get', side_effect=RuntimeError('boom')):
+      with self.assertRaises(RuntimeError):
+        client.get_tracking_info('TRK1')
+    self.assertFalse(client.breaker.trial_running)
+    self.assertEqual(client.stats()['failures'], 2)
+    self.assertEqual(client.get_tracking_info('TRK1')['shipped_at'], '2024-01-02T00:00:00Z')
+    self.assertEqual(client.breaker.state, 'closed')
+
+  def test_breaker_fails_fast_then_recovers(self):
+    self.server.script = [(503, 0)] * 4
+    client = self.carrier(retries=1, reset_timeout=0.2)
+    for _ in range(2):
+      with self.assertRaises(CarrierError):
+        client.get_tracking_info('TRK1')
+    self.assertEqual(client.breaker.state, 'open')
+
+    with self.assertRaises(CarrierUnavailable):
+      client.get_tracking_info('TRK1')
+    self.assertEqual(len(self.server.hits), 4)
+    self.assertEqual(client.stats()['short_circuited'], 1)
+
+    time.sleep(0.25)
+    client.get_tracking_info('TRK1')
+    self.assertEqual(client.breaker.state, 'closed')
+
+
+class TrackingRefreshTests(StubCarrierMixin, TestCase):
+  def setUp(self):
+    super().setUp()
+    user = CustomUser.objects.create_user(username='shipper', email='shipper@example.com', password='secret')
+    method = ShippingMethod.objects.create(name='Standard', rate='4.99')
+    self.details = {}
+    for number in ('IN-TRANSIT', 'ARRIVED', 'DELIVERED', 'BROKEN'):
+      order = Order.objects.create(user=user, shipping_address='1 Main St')
+      self.details[number] = ShippingDetail.objects.create(order=order, shipping_method=method, tracking_number=number)
+    ShippingDetail.objects.filter(tracking_number='DELIVERED').update(delivered_at='2024-01-01T00:00:00Z')
+
+    self.server.bodies['/track/ARRIVED'] = {'shipped_at': '2024-01-02T00:00:00Z', 'delivered_at': '2024-01-03T00:00:00Z'}
+    client = self.carrier(retries=0, failure_threshold=10)
+    patcher = mock.patch.object(tracking, 'get_client', return_value=client)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def test_refresh_skips_delivered_and_bulk_updates_changes(self):
+    self.server.bodies['/track/BROKEN'] = {'shipped_at': 'not a date'}
+    with CaptureQueriesContext(connection) as queries:
+      report = tracking.refresh_all(chunk_size=2, max_workers=4)
+
+    self.assertEqual({path for path, _ in self.server.hits}, {'/track/IN-TRANSIT', '/track/ARRIVED', '/track/BROKEN'})
+    self.assertEqual((report['checked'], report['updated'], report['failed'], report['chunks']), (3, 2, 0, 2))
+    # One bulk UPDATE for the chunk with changes, none for the chunk without.
+    self.assertEqual(sum(query['sql'].startswith('UPDATE') for query in queries.captured_queries), 1)
+
+    arrived = ShippingDetail.objects.get(tracking_number='ARRIVED')
+    self.assertEqual(arrived.delivered_at.isoformat(), '2024-01-03T00:00:00+00:00')
+    self.assertIsNotNone(ShippingDetail.objects.get(tracking_number='IN-TRANSIT').shipped_at)
+    self.assertIsNone(ShippingDetail.objects.get(tracking_number='BROKEN').shipped_at)
+    self.assertEqual(list(tracking.pending_chunks()), [[self.details['IN-TRANSIT'].id, self.details['BROKEN'].id]])
+
+
+  def test_rejected_lookup_does_not_abort_the_chunk(self):
+    self.server.statuses['/track/ARRIVED'] = 404
+    report = tracking.refresh_all(chunk_size=3, max_workers=4)
+    self.assertEqual((report['checked'], report['updated'], report['failed'], report['chunks']), (3, 2, 1, 1))
+    self.assertIsNone(ShippingDetail.objects.get(tracking_number='ARRIVED').delivered_at)
+    self.assertIsNotNone(ShippingDetail.objects.get(tracking_number='BROKEN').shipped_at)
+
+
+class ProductSearchTests(TestCase):
+  def setUp(self):
+    brand = Brand.objects.create(name='Acme')
+    category = Category.objects.create(category_name='Tools')
+    for name in ('Red <b>hammer</b>', 'Blue hammer', 'Green saw'):
+      Product.objects.create(
+        name=name, brand=brand, category=category, description=f'A {name} with <script>x</script>',
+        image='', price='10.00', stock_quantity=5,
+      )
+
+  def test_search_joins_the_index_once_and_escapes_markup(self):
+    with CaptureQueriesContext(connection) as queries:
+      response = APIClient().get('/api/v1/products/', {'q': 'hammer'})
+    self.assertEqual(response.status_code, 200)
+    results = response.json()['results']
+    self.assertEqual({product['name'] for product in results}, {'Red <b>hammer</b>', 'Blue hammer'})
+    highlights = {product['search_highlight'] for product in results}
+    self.assertIn('Red &lt;b&gt;<mark>hammer</mark>&lt;/b&gt;', highlights)
+    self.assertTrue(all('<script>' not in product['search_snippet'] for product in results))
+    for query in queries.captured_queries:
+      self.assertLessEqual(query['sql'].count('MATCH'), 1)
+
+  def test_ranked_search_pages_by_cursor(self):
+    client = APIClient()
+    response = client.get('/api/v1/products/', {'q': 'hammer', 'cursor': '', 'page_size': 1})
+    names = [product['name'] for product in response.json()['results']]
+    response = client.get(response.json()['next'])
+    self.assertEqual(response.status_code, 200)
+    names += [product['name'] for product in response.json()['results']]
+    self.assertEqual(sorted(names), ['Blue hammer', 'Red <b>hammer</b>'])
+    self.assertIsNone(response.json()['next'])
+
+
+class RatingAggregateTests(TestCase):
+  def setUp(self):
+    self.users = [
+      CustomUser.objects.create_user(username=f'reviewer{index}', email=f'reviewer{index}@example.com', password='secret')
+      for index in range(3)
+    ]
+    brand = Brand.objects.create(name='Acme')
+    category = Category.objects.create(category_name='Tools')
+    self.hammer, self.saw = [
+      Product.objects.create(
+        name=name, brand=brand, category=category, description='',
+        image='', price='10.00', stock_quantity=5,
+      )
+      for name in ('Hammer', 'Saw')
+    ]
+
+  def assertRatings(self, product, count, total, histogram):
+    product = Product.objects.get(id=product.id)
+    self.assertEqual((product.rating_count, product.rating_total), (count, total))
+    self.assertEqual(product.rating_histogram, {str(star): histogram.get(star, 0) for star in Product.RATING_STARS})
+
+  def test_review_writes_keep_aggregates(self):
+    first = Review.objects.create(user=self.users[0], product=self.hammer, rating=5, comment='')
+    Review.objects.create(user=self.users[1], product=self.hammer, rating=3, comment='')
+    self.assertRatings(self.hammer, 2, 8, {5: 1, 3: 1})
+    self.assertEqual(Product.objects.get(id=self.hammer.id).rating_avg, 4.0)
+
+    first = Review.objects.get(id=first.id)
+    first.rating = 4
+    first.save()
+    self.assertRatings(self.hammer, 2, 7, {4: 1, 3: 1})
+
+    first.product = self.saw
+    first.save()
+    self.assertRatings(self.hammer, 1, 3, {3: 1})
+    self.assertRatings(self.saw, 1, 4, {4: 1})
+
+    first.delete()
+    self.assertRatings(self.saw, 0, 0, {})
+    self.assertIsNone(Product.objects.get(id=self.saw.id).rating_avg)
+
+  def test_repair_ratings_recounts_from_reviews(self):
+    for user, rating in zip(self.users, (1, 5, 5)):
+      Review.objects.create(user=user, product=self.hammer, rating=rating, comment='')
+    Product.objects.update(rating_count=9, rating_total=9, rating_1=9, rating_5=0)
+
+    call_command('repair_ratings', '--product', str(self.saw.id), stdout=io.StringIO())
+    self.assertRatings(self.saw, 0, 0, {})
+    self.assertEqual(Product.objects.get(id=self.hammer.id).rating_count, 9)
+
+    call_command('repair_ratings', stdout=io.StringIO())
+    self.assertRatings(self.hammer, 3, 11, {1: 1, 5: 2})
+
+
+def png_bytes(size=(64, 48), color='red'):
+  buffer = io.BytesIO()
+  PILImage.new('RGB', size, color).save(buffer, format='PNG')
+  return buffer.getvalue()
+
+
+@override_settings(STORAGES={
+  'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+  'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
+class ImageVariantTests(TestCase):
+  def setUp(self):
+    self.product = Product.objects.create(
+      name='Hammer', brand=Brand.objects.create(name='Acme'),
+      category=Category.objects.create(category_name='Tools'), description='',
+      image=default_storage.save('product_img/hammer.png', ContentFile(png_bytes())), price='10.00', stock_quantity=5,
+    )
+
+  def test_variants_are_named_by_content_and_reused(self):
+    storage = InMemoryStorage()
+    variants = images.build_variants(ContentFile(png_bytes()), storage=storage)
+    self.assertEqual(set(variants), set(images.VARIANT_SIZES))
+    thumbnail = variants['thumbnail']['webp']
+    self.assertRegex(thumbnail, r'^product_img/variants/[0-9a-f]{20}_thumbnail\.webp$')
+    with storage.open(variants['listing']['jpeg']) as stored, PILImage.open(stored) as image:
+      self.assertEqual((image.format, image.size), ('JPEG', images.VARIANT_SIZES['listing']))
+
+    with mock.patch.object(storage, 'save', wraps=storage.save) as save:
+      self.assertEqual(images.build_variants(ContentFile(png_bytes()), storage=storage), variants)
+    save.assert_not_called()
+    self.assertNotEqual(images.build_variants(ContentFile(png_bytes(color='blue')), storage=storage)['thumbnail']['webp'], thumbnail)
+
+  def test_task_stores_variants_for_the_current_image_only(self):
+    variants = generate_image_variants(self.product.id)
+    self.assertEqual(Product.objects.get(id=self.product.id).image_variants, variants)
+    self.assertTrue(default_storage.exists(variants['thumbnail']['jpeg']))
+
+    Product.objects.filter(id=self.product.id).update(image_variants={})
+    def replaced(image_field):
+      Product.objects.filter(id=self.product.id).update(image='product_img/other.png')
+      return variants
+    with mock.patch('core.tasks.build_variants', side_effect=replaced):
+      generate_image_variants(self.product.id)
+    self.assertEqual(Product.objects.get(id=self.product.id).image_variants, {})
+
+  def test_task_skips_oversized_images(self):
+    with mock.patch.object(PILImage, 'MAX_IMAGE_PIXELS', 10):
+      self.assertIsNone(generate_image_variants(self.product.id))
+    self.assertEqual(Product.objects.get(id=self.product.id).image_variants, {})
+
+
+class FacetTests(TestCase):
+  def setUp(self):
+    cache.clear()
+    self.acme = Brand.objects.create(name='Acme')
+    self.other = Brand.objects.create(name='Other')
+    category = Category.objects.create(category_name='Tools')
+    self.hammer = Product.objects.create(
+      name='Hammer', brand=self.acme, category=category, description='Steel',
+      image='', price='10.00', stock_quantity=5,
+    )
+    self.saw = Product.objects.create(
+      name='Saw', brand=self.acme, category=category, description='Wood',
+      image='', price='30.00', stock_quantity=5,
+    )
+
+  def facets(self, **params):
+    response = APIClient().get('/api/v1/products/', {'facets': 'brand,price', **params})
+    self.assertEqual(response.status_code, 200)
+    return response.json()['count'], response.json()['facets']
+
+  def test_counts_follow_search_fields(self):
+    self.assertEqual(self.facets(q='hammer'), (1, {'brand': {str(self.acme.id): 1}, 'price': {'0-25': 1}}))
+    # Cached per query until something it depends on changes.
+    with CaptureQueriesContext(connection) as queries:
+      self.facets(q='hammer')
+    self.assertFalse([query for query in queries.captured_queries if 'GROUP BY' in query['sql']])
+
+    self.hammer.name = 'Drill'
+    self.hammer.save()
+    self.assertEqual(self.facets(q='hammer'), (0, {'brand': {}, 'price': {}}))
+
+    self.assertEqual(self.facets(q='acme')[0], 2)
+    self.acme.name = 'Zenith'
+    self.acme.save()
+    self.assertEqual(self.facets(q='acme'), (0, {'brand': {}, 'price': {}}))
+
+  def test_queryset_writes_retire_counts(self):
+    self.assertEqual(self.facets()[1]['brand'], {str(self.acme.id): 2})
+    Product.objects.filter(id=self.saw.id).update(brand=self.other)
+    self.assertEqual(self.facets()[1]['brand'], {str(self.acme.id): 1, str(self.other.id): 1})
+
+    self.hammer.price = '60.00'
+    Product.objects.bulk_update([self.hammer], ['price'])
+    self.assertEqual(self.facets()[1]['price'], {'25-50': 1, '50-100': 1})
+
+    # Stock and rating writes leave the counts cached.
+    self.facets()
+    Product.objects.filter(id=self.saw.id).update(stock_quantity=1)
+    self.hammer.update_rating(5)
+    with CaptureQueriesContext(connection) as queries:
+      self.facets()
+    self.assertFalse([query for query in queries.captured_queries if 'GROUP BY' in query['sql']])
+
+
+  def test_edits_retire_only_the_counts_they_can_change(self):
+    garden = Category.objects.create(category_name='Garden')
+    rake = Product.objects.create(
+      name='Rake', brand=self.other, category=garden, description='',
+      image='', price='20.00', stock_quantity=5,
+    )
+    tools = str(self.hammer.category_id)
+    self.assertEqual(self.facets(category=tools)[0], 2)
+    self.assertEqual(self.facets(brand=str(self.acme.id))[0], 2)
+    self.assertEqual(self.facets()[0], 3)
+
+    rake.price = '60.00'
+    rake.save()
+    with CaptureQueriesContext(connection) as queries:
+      self.assertEqual(self.facets(category=tools)[1]['price'], {'0-25': 1, '25-50': 1})
+      self.facets(brand=str(self.acme.id))
+    self.assertFalse([query for query in queries.captured_queries if 'GROUP BY' in query['sql']])
+    self.assertEqual(self.facets()[1]['price'], {'0-25': 1, '25-50': 1, '50-100': 1})
+
+    # Moving a product retires the counts of both the old and the new category.
+    self.assertEqual(self.facets(category=str(garden.id))[0], 1)
+    rake.category = self.hammer.category
+    rake.save()
+    self.assertEqual(self.facets(category=tools)[0], 3)
+    self.assertEqual(self.facets(category=str(garden.id))[0], 0)
+
+class CatalogSnapshotTests(TestCase):
+  def setUp(self):
+    brand = Brand.objects.create(name='Acme')
+    category = Category.objects.create(category_name='Tools')
+    self.product = Product.objects.create(
+      sku='SNAP-1', name='Hammer', brand=brand, category=category, description='',
+      image='', price='10.00', stock_quantity=50,
+    )
+    self.user = CustomUser.objects.create_user(username='snapper', email='snapper@example.com', password='secret')
+
+  def generation_after(self, change):
+    before = snapshots.generation()
+    with self.captureOnCommitCallbacks(execute=True):
+      change()
+    return snapshots.generation() != before
+
+  def test_stock_writes_keep_snapshots(self):
+    self.assertFalse(self.generation_after(lambda: place_order(self.user, [{'product_id': self.product.id, 'quantity': 2}], shipping_address='1 Main St')))
+    self.assertFalse(self.generation_after(lambda: adjust_stock([{'sku': 'SNAP-1', 'delta': 5}])))
+    self.assertFalse(self.generation_after(lambda: self.product.update_stock(-1)))
+
+  def test_catalog_writes_retire_snapshots(self):
+    self.assertTrue(self.generation_after(lambda: Product.objects.filter(id=self.product.id).update(price='12.00')))
+    self.product.name = 'Claw hammer'
+    self.assertTrue(self.generation_after(self.product.save))
+
+
+  def test_conditional_gets(self):
+    client = APIClient()
+    self.assertEqual(client.get('/api/v1/products/abc/').status_code, 404)
+    self.assertEqual(client.get('/api/v1/categories/abc/').status_code, 404)
+
+    etag = client.get('/api/v1/products/', {'facets': 'brand'})['ETag']
+    response = client.get('/api/v1/products/', {'facets': 'brand'}, HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(response.status_code, 304)
+
+
+class CartOwnershipTests(TestCase):
+  def test_checkout_is_limited_to_own_carts(self):
+    owner = CustomUser.objects.create_user(username='owner', email='owner@example.com', password='secret')
+    other = CustomUser.objects.create_user(username='other', email='other@example.com', password='secret')
+    cart = Cart.objects.create(user=owner)
+
+    client = APIClient()
+    client.force_authenticate(other)
+    self.assertEqual(client.post(f'/api/v1/carts/{cart.id}/checkout/').status_code, 404)
+    self.assertEqual(client.get('/api/v1/carts/').json()['count'], 0)
+
+    client.force_authenticate(owner)
+    self.assertEqual(client.post(f'/api/v1/carts/{cart.id}/checkout/').status_code, 200)
+
+  def test_cart_items_are_limited_to_own_carts(self):
+    owner = CustomUser.objects.create_user(username='owner', email='owner@example.com', password='secret')
+    other = CustomUser.objects.create_user(username='other', email='other@example.com', password='secret')
+    cart = Cart.objects.create(user=owner)
+    other_cart = Cart.objects.create(user=other)
+    product = Product.objects.create(
+      sku='OWN-1', name='Hammer', brand=Brand.objects.create(name='Acme'),
+      category=Category.objects.create(category_name='Tools'), description='',
+      image='', price='10.00', stock_quantity=5,
+    )
+    line = CartItem.objects.create(cart=cart, product=product, quantity=1)
+
+    client = APIClient()
+    client.force_authenticate(other)
+    response = client.post('/api/v1/cart-items/', {'cart': cart.id, 'product': product.id, 'quantity': 5}, format='json')
+    self.assertEqual(response.status_code, 400)
+    self.assertFalse(StockReservation.objects.exists())
+    self.assertEqual(client.get('/api/v1/cart-items/').json()['count'], 0)
+    self.assertEqual(client.get(f'/api/v1/cart-items/{line.id}/').status_code, 404)
+
+    own = client.post('/api/v1/cart-items/', {'cart': other_cart.id, 'product': product.id, 'quantity': 1}, format='json')
+    self.assertEqual(own.status_code, 201)
+    response = client.patch(f"/api/v1/cart-items/{own.json()['id']}/", {'cart': cart.id}, format='json')
+    self.assertEqual(response.status_code, 400)
+    self.assertEqual(CartItem.objects.get(id=own.json()['id']).cart_id, other_cart.id)
+
+
+class OrderExportTests(TestCase):
+  @classmethod
+  def setUpTestData(cls):
+    cls.user = CustomUser.objects.create_user(username='exporter', email='exporter@example.com', password='secret')
+    cls.other = CustomUser.objects.create_user(username='bystander', email='bystander@example.com', password='secret')
+    cls.staff = CustomUser.objects.create_user(username='clerk', email='clerk@example.com', password='secret', is_staff=True)
+    brand = Brand.objects.create(name='Acme')
+    category = Category.objects.create(category_name='Tools')
+    product = Product.objects.create(
+      sku='EXP-1', name='Hammer', brand=brand, category=category, description='',
+      image='', price='10.00', stock_quantity=100,
+    )
+    cls.orders = []
+    for user, placed in ((cls.user, '2024-01-01 10:00'), (cls.user, '2024-01-02 23:30'), (cls.other, '2024-01-02 12:00'), (cls.user, '2024-01-03 00:30')):
+      order = place_order(user, [{'product_id': product.id, 'quantity': 1}], shipping_address='1 Main St')
+      Order.objects.filter(id=order.id).update(order_date=timezone.make_aware(datetime.strptime(placed, '%Y-%m-%d %H:%M')))
+      cls.orders.append(order.id)
+
+  def export(self, as_user, export_format, **params):
+    client = APIClient()
+    client.force_authenticate(as_user)
+    response = client.get(f'/api/v1/orders/export/{export_format}/', params)
+    if response.status_code != 200:
+      return response, None
+    with CaptureQueriesContext(connection) as queries:
+      body = b''.join(response.streaming_content).decode('utf-8')
+    self.assertFalse([query for query in queries.captured_queries if 'cast_date' in query['sql']])
+    return response, body
+
+  def test_csv_streams_own_orders_in_date_range(self):
+    response, body = self.export(self.user, 'csv', **{'from': '2024-01-02', 'to': '2024-01-02'})
+    self.assertEqual(response['Content-Type'], 'text/csv')
+    rows = list(csv.DictReader(io.StringIO(body)))
+    self.assertEqual([int(row['order_id']) for row in rows], [self.orders[1]])
+    self.assertEqual((rows[0]['sku'], rows[0]['quantity']), ('EXP-1', '1'))
+
+  def test_ndjson_for_staff_filtered_by_user(self):
+    _, body = self.export(self.staff, 'ndjson', user=str(self.other.id))
+    rows = [json.loads(line) for line in body.splitlines()]
+    self.assertEqual([row['order_id'] for row in rows], [self.orders[2]])
+
+  def test_invalid_filters_are_rejected(self):
+    self.assertEqual(self.export(self.staff, 'csv', user='abc')[0].status_code, 400)
+    self.assertEqual(self.export(self.user, 'csv', **{'from': '2024-13-01'})[0].status_code, 400)
+
+
+class SalesRollupTests(TestCase):
+  def setUp(self):
+    self.user = CustomUser.objects.create_user(username='buyer', email='buyer@example.com', password='secret')
+    self.staff = CustomUser.objects.create_user(username='analyst', email='analyst@example.com', password='secret', is_staff=True)
+    brand = Brand.objects.create(name='Acme')
+    self.tools = Category.objects.create(category_name='Tools')
+    self.garden = Category.objects.create(category_name='Garden')
+    self.hammer, self.saw, self.rake = [
+      Product.objects.create(
+        sku=sku, name=sku, brand=brand, category=category, description='',
+        image='', price=price, stock_quantity=100,
+      )
+      for sku, category, price in (('HAMMER', self.tools, '10.00'), ('SAW', self.tools, '20.00'), ('RAKE', self.garden, '5.00'))
+    ]
+
+  def order(self, lines, placed):
+    order = place_order(self.user, [{'product_id': product.id, 'quantity': quantity} for product, quantity in lines], shipping_address='1 Main St')
+    Order.objects.filter(id=order.id).update(order_date=placed, created_at=placed)
+    return order
+
+  def rollups(self, model, field):
+    return {
+      (getattr(rollup, f'{field}_id'), rollup.day): (rollup.units, rollup.revenue, rollup.orders)
+      for rollup in model.objects.all()
+    }
+
+  def test_watermark_waits_for_the_commit_lag_and_never_double_counts(self):
+    day = timezone.now() - timedelta(days=1)
+    first = self.order([(self.hammer, 2), (self.rake, 1)], day)
+    recent = self.order([(self.hammer, 1)], timezone.now())
+
+    self.assertEqual(analytics.update_rollups(), 1)
+    self.assertEqual(RollupWatermark.objects.get(name=analytics.WATERMARK).last_order_id, first.id)
+    self.assertEqual(analytics.update_rollups(), 0)
+    self.assertEqual(self.rollups(DailyProductSales, 'product'), {
+      (self.hammer.id, day.date()): (2, Decimal('20.00'), 1),
+      (self.rake.id, day.date()): (1, Decimal('5.00'), 1),
+    })
+
+    Order.objects.filter(id=recent.id).update(order_date=day, created_at=day)
+    self.assertEqual(analytics.update_rollups(), 1)
+    self.assertEqual(RollupWatermark.objects.get(name=analytics.WATERMARK).last_order_id, recent.id)
+    self.assertEqual(self.rollups(DailyProductSales, 'product')[(self.hammer.id, day.date())], (3, Decimal('30.00'), 2))
+
+  def test_distinct_orders_add_up_across_batches(self):
+    day = timezone.now() - timedelta(days=1)
+    for _ in range(3):
+      self.order([(self.hammer, 1), (self.saw, 1)], day)
+    self.order([(self.rake, 4)], day)
+
+    self.assertEqual(analytics.update_rollups(batch_size=2), 4)
+    expected = {
+      (self.tools.id, day.date()): (6, Decimal('90.00'), 3),
+      (self.garden.id, day.date()): (4, Decimal('20.00'), 1),
+    }
+    self.assertEqual(self.rollups(DailyCategorySales, 'category'), expected)
+
+    DailyCategorySales.objects.update(units=0)
+    self.assertEqual(analytics.rebuild_rollups(batch_size=3), 4)
+    self.assertEqual(self.rollups(DailyCategorySales, 'category'), expected)
+    self.assertEqual(DailyBrandSales.objects.get().orders, 4)
+
+  def test_endpoints_filter_by_day_and_sum_totals(self):
+    latest = timezone.now() - timedelta(days=1)
+    earlier = latest - timedelta(days=3)
+    self.order([(self.hammer, 1)], earlier)
+    self.order([(self.hammer, 2), (self.rake, 1)], latest)
+    analytics.update_rollups()
+
+    client = APIClient()
+    client.force_authenticate(self.user)
+    self.assertEqual(client.get('/api/v1/analytics/product-sales/').status_code, 403)
+
+    client.force_authenticate(self.staff)
+    response = client.get('/api/v1/analytics/product-sales/', {'from': latest.date().isoformat(), 'product': self.hammer.id})
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(
+      [(row['day'], row['units'], row['orders']) for row in response.json()['results']],
+      [(latest.date().isoformat(), 2, 1)],
+    )
+
+    response = client.get('/api/v1/analytics/product-sales/totals/')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(
+      [(row['product'], row['units'], row['orders']) for row in response.json()],
+      [(self.hammer.id, 3, 2), (self.rake.id, 1, 1)],
+    )
+    response = client.get('/api/v1/analytics/category-sales/totals/', {'to': earlier.date().isoformat()})
+    self.assertEqual([(row['category'], row['units']) for row in response.json()], [(self.tools.id, 1)])
+
+    self.assertEqual(client.get('/api/v1/analytics/brand-sales/', {'from': '2024-13-01'}).status_code, 400)
+    self.assertEqual(client.get('/api/v1/analytics/brand-sales/totals/', {'from': 'yesterday'}).status_code, 400)
+
+
+class BulkTransitionTests(TestCase):
+  def test_locks_by_id_and_logs_only_moved_orders(self):
+    user = CustomUser.objects.create_user(username='mover', email='mover@example.com', password='secret')
+    method = ShippingMethod.objects.create(name='Standard', rate='4.99')
+    orders = [Order.objects.create(user=user, shipping_address='1 Main St', status=status) for status in ('paid', 'paid', 'pending', 'paid')]
+    for order in orders:
+      ShippingDetail.objects.create(order=order, shipping_method=method)
+    ShippingDetail.objects.filter(order=orders[3]).update(delivered_at=timezone.now())
+
+    with CaptureQueriesContext(connection) as queries:
+      moved = order_status.bulk_transition(Order.objects.filter(shippingdetail__delivered_at__isnull=True), 'shipped', batch_size=1)
+
+    self.assertEqual(moved, 2)
+    self.assertEqual(
+      sorted(OrderStatusTransition.objects.values_list('order_id', 'from_status', 'to_status')),
+      [(orders[0].id, 'paid', 'shipped'), (orders[1].id, 'paid', 'shipped')],
+    )
+    locking = [query['sql'] for query in queries.captured_queries if 'FOR UPDATE' in query['sql']]
+    self.assertTrue(all('JOIN' not in sql for sql in locking))
+
+
+class StockReservationTests(TestCase):
+  def setUp(self):
+    self.first = CustomUser.objects.create_user(username='first', email='first@example.com', password='secret')
+    self.second = CustomUser.objects.create_user(username='second', email='second@example.com', password='secret')
+    self.product = Product.objects.create(
+      sku='HOLD-1', name='Hammer', brand=Brand.objects.create(name='Acme'),
+      category=Category.objects.create(category_name='Tools'), description='',
+      image='', price='10.00', stock_quantity=5,
+    )
+
+  def held(self, user):
+    return StockReservation.objects.filter(user=user, product=self.product).values_list('quantity', flat=True).first()
+
+  def test_competing_holds_never_exceed_stock(self):
+    reservations.reserve(self.first, self.product.id, 4)
+    # A stale availability read must not let the second hold through: the write itself checks.
+    with mock.patch.object(reservations, 'available_to_promise', return_value={self.product.id: 5}):
+      with self.assertRaises(ValidationError):
+        reservations.reserve(self.second, self.product.id, 3)
+    self.assertIsNone(self.held(self.second))
+
+    reservations.reserve(self.second, self.product.id, 1)
+    with self.assertRaises(ValidationError) as raised:
+      reservations.reserve(self.first, self.product.id, 5)
+    self.assertEqual(raised.exception.detail, {'quantity': "Only 4 available.", 'available': 4})
+    self.assertEqual(raised.exception.get_codes(), {'quantity': 'invalid'})
+    self.assertEqual((self.held(self.first), self.held(self.second)), (4, 1))
+
+    with self.assertRaises(ValidationError):
+      reservations.reserve_many(self.second, {self.product.id: 2})
+    self.assertEqual(self.held(self.second), 1)
+    reservations.reserve_many(self.first, {self.product.id: 0})
+    reservations.reserve_many(self.second, {self.product.id: 5})
+    self.assertEqual((self.held(self.first), self.held(self.second)), (None, 5))
+
+
+class AbandonedCartPurgeTests(TestCase):
+  def setUp(self):
+    cache.clear()
+    self.user = CustomUser.objects.create_user(username='idle', email='idle@example.com', password='secret')
+    self.product = Product.objects.create(
+      sku='IDLE-1', name='Hammer', brand=Brand.objects.create(name='Acme'),
+      category=Category.objects.create(category_name='Tools'), description='',
+      image='', price='10.00', stock_quantity=5,
+    )
+    created = [Cart.objects.create(user=self.user) for _ in range(6)]
+    # A gap in the id range between the old carts.
+    created[2].delete()
+    self.old = [created[0], created[1], created[3], created[4]]
+    self.fresh = created[5]
+    CartItem.objects.create(cart=self.old[0], product=self.product, quantity=2)
+    CartItem.objects.create(cart=self.old[3], product=self.product, quantity=1)
+    CartItem.objects.create(cart=self.fresh, product=self.product, quantity=3)
+    Cart.objects.filter(id__in=[cart.id for cart in self.old]).update(updated_at=timezone.now() - timedelta(days=45))
+
+  def test_chunks_walk_the_id_gap_and_keep_fresh_carts(self):
+    for cart in self.old + [self.fresh]:
+      cart_store.get(cart.id)
+
+    with self.captureOnCommitCallbacks(execute=True):
+      report = carts.purge_abandoned(max_age=timedelta(days=30), chunk_size=1)
+    self.assertEqual((report['carts'], report['items'], report['archive']), (4, 2, None))
+    # One chunk per id from the first to the last old cart, the gap included.
+    self.assertEqual(report['chunks'], self.old[-1].id - self.old[0].id + 1)
+    self.assertEqual(list(Cart.objects.values_list('id', flat=True)), [self.fresh.id])
+    self.assertEqual(CartItem.objects.get().quantity, 3)
+
+    self.assertFalse(cache.get_many([cart_store.cart_key(cart.id) for cart in self.old]))
+    self.assertIsNotNone(cache.get(cart_store.cart_key(self.fresh.id)))
+
+  def test_archive_holds_the_removed_carts(self):
+    with tempfile.TemporaryDirectory() as archive_dir:
+      report = carts.purge_abandoned(max_age=timedelta(days=30), chunk_size=2, archive_dir=archive_dir)
+      with gzip.open(report['archive'], 'rt', encoding='utf-8') as archive:
+        records = [json.loads(line) for line in archive]
+    self.assertEqual([record['cart'] for record in records], [cart.id for cart in self.old])
+    self.assertEqual({record['user'] for record in records}, {self.user.id})
+    self.assertEqual(records[0]['items'], [[self.product.id, 2]])
+    self.assertEqual(records[1]['items'], [])
+
+    self.assertIsNone(carts.purge_abandoned(max_age=timedelta(days=30), archive_dir='/nonexistent')['archive'])
+
+
+class CartStoreTests(TestCase):
+  def setUp(self):
+    # Cart ids are reused once each test rolls back; start from an empty store.
+    cache.clear()
+    self.user = CustomUser.objects.create_user(username='shopper', email='shopper@example.com', password='secret')
+    self.cart = Cart.objects.create(user=self.user)
+    self.product = Product.objects.create(
+      sku='CART-1', name='Hammer', brand=Brand.objects.create(name='Acme'),
+      category=Category.objects.create(category_name='Tools'), description='',
+      image='', price='10.00', stock_quantity=5,
+    )
+    self.client = APIClient()
+    self.client.force_authenticate(self.user)
+    self.url = f'/api/v1/carts/{self.cart.id}/contents/'
+
+  def test_contents_hold_stock_and_write_through_on_a_local_cache(self):
+    response = self.client.post(self.url, {'product_id': self.product.id, 'quantity': 3}, format='json')
+    self.assertEqual(response.status_code, 200)
+    # The test cache is process-local, so the change must already be in the database.
+    self.assertEqual(CartItem.objects.get(cart=self.cart).quantity, 3)
+    self.assertEqual(StockReservation.objects.get(user=self.user, product=self.product).quantity, 3)
+
+    response = self.client.post(self.url, {'product_id': self.product.id, 'quantity': 3}, format='json')
+    self.assertEqual(response.status_code, 400)
+    self.assertEqual(response.json(), {'quantity': "Only 5 available.", 'available': 5})
+    self.assertEqual(CartItem.objects.get(cart=self.cart).quantity, 3)
+
+    response = self.client.put(f'{self.url}{self.product.id}/', {'quantity': 5}, format='json')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(StockReservation.objects.get(user=self.user, product=self.product).quantity, 5)
+
+    self.assertEqual(self.client.delete(f'{self.url}{self.product.id}/').status_code, 200)
+    self.assertFalse(CartItem.objects.filter(cart=self.cart).exists())
+    self.assertFalse(StockReservation.objects.filter(user=self.user).exists())
+
+  def test_shared_cache_marks_each_dirty_cart_once(self):
+    with mock.patch.object(cart_store, 'is_shared', return_value=True), mock.patch.object(cart_store, '_mark_dirty', wraps=cart_store._mark_dirty) as mark:
+      for _ in range(3):
+        self.assertEqual(self.client.post(self.url, {'product_id': self.product.id, 'quantity': 1}, format='json').status_code, 200)
+    self.assertEqual(mark.call_count, 1)
+    self.assertFalse(CartItem.objects.filter(cart=self.cart).exists())
+    self.assertEqual(cart_store.flush_dirty(), 1)
+    self.assertEqual(CartItem.objects.get(cart=self.cart).quantity, 3)
+    self.assertEqual(cart_store.flush_dirty(), 0)
+
+    response = self.client.post(self.url, {'product_id': self.product.id + 100, 'quantity': 1}, format='json')
+    self.assertEqual(response.status_code, 400)
+
+  def test_cached_edits_cost_one_query(self):
+    line_url = f'{self.url}{self.product.id}/'
+    with mock.patch.object(cart_store, 'is_shared', return_value=True):
+      self.client.post(self.url, {'product_id': self.product.id, 'quantity': 1}, format='json')
+      with CaptureQueriesContext(connection) as queries:
+        self.assertEqual(self.client.post(self.url, {'product_id': self.product.id, 'quantity': 1}, format='json').status_code, 200)
+        self.assertEqual(self.client.put(line_url, {'quantity': 3}, format='json').status_code, 200)
+      self.assertEqual(len(queries), 2, [query['sql'] for query in queries.captured_queries])
+      self.assertEqual(StockReservation.objects.get(user=self.user).quantity, 3)
+
+      # A new cart is counted in the holds as soon as it commits.
+      with self.captureOnCommitCallbacks(execute=True):
+        other = Cart.objects.create(user=self.user)
+      CartItem.objects.create(cart=other, product=self.product, quantity=2)
+      self.assertEqual(self.client.put(line_url, {'quantity': 4}, format='json').status_code, 400)
+      self.assertEqual(self.client.put(line_url, {'quantity': 2}, format='json').status_code, 200)
+      self.assertEqual(StockReservation.objects.get(user=self.user).quantity, 4)
+
+  def test_holds_are_taken_under_the_cart_lock(self):
+    cart_store.add(self.cart.id, self.product.id, 3)
+    # Even when the request read the cart before another edit landed, the hold covers what is written.
+    stale = {'user': self.user.id, 'items': {}, 'version': 0, 'dirty': False}
+    with mock.patch.object(cart_store, 'get', return_value=stale):
+      self.assertEqual(self.client.post(self.url, {'product_id': self.product.id, 'quantity': 1}, format='json').status_code, 200)
+    self.assertEqual(StockReservation.objects.get(user=self.user).quantity, 4)
+    with mock.patch.object(cart_store, 'get', return_value=stale):
+      self.assertEqual(self.client.post(self.url, {'product_id': self.product.id, 'quantity': 2}, format='json').status_code, 400)
+    self.assertEqual(cart_store.get(self.cart.id)['items'], {self.product.id: 4})
+
+  def test_stale_flush_cannot_bring_back_purchased_lines(self):
+    self.client.post(self.url, {'product_id': self.product.id, 'quantity': 2}, format='json')
+    stale = dict(cart_store.get(self.cart.id), items={self.product.id: 2}, dirty=True)
+    with self.captureOnCommitCallbacks(execute=True):
+      place_order(self.user, [{'product_id': self.product.id, 'quantity': 2}], shipping_address='1 Main St')
+    self.assertEqual(cart_store.get(self.cart.id)['items'], {})
+
+    # A flush that read the cart before the purchase finishes afterwards.
+    cart_store.flush(self.cart.id, stale)
+    self.assertFalse(CartItem.objects.filter(cart=self.cart).exists())
+    self.assertFalse(cart_store.get(self.cart.id)['dirty'])
+
+  def test_busy_cart_store_does_not_fail_a_committed_order(self):
+    self.client.post(self.url, {'product_id': self.product.id, 'quantity': 1}, format='json')
+    with mock.patch.object(cart_store, 'discard_products', side_effect=cart_store.CartBusy()):
+      with self.captureOnCommitCallbacks(execute=True):
+        order = place_order(self.user, [{'product_id': self.product.id, 'quantity': 1}], shipping_address='1 Main St')
+    self.assertTrue(Order.objects.filter(id=order.id).exists())
+    self.assertFalse(CartItem.objects.filter(cart=self.cart).exists())
+
+  def test_batch_and_merge_hold_stock(self):
+    batch_url = f'/api/v1/carts/{self.cart.id}/items/batch/'
+    response = self.client.post(batch_url, {'items': [{'product_id': self.product.id, 'quantity': 6}]}, format='json')
+    self.assertEqual(response.status_code, 400)
+    self.assertEqual(response.json(), {'items': [{'product_id': self.product.id, 'quantity': "Only 5 available.", 'available': 5}]})
+    self.assertFalse(CartItem.objects.filter(cart=self.cart).exists())
+
+    self.client.post(batch_url, {'items': [{'product_id': self.product.id, 'quantity': 1}]}, format='json')
+    # Adding onto an existing line is one upsert: the increment happens in the write itself.
+    self.assertEqual(carts.upsert_lines(self.cart.id, [(self.product.id, 1)]), 1)
+    self.assertEqual(CartItem.objects.get(cart=self.cart).quantity, 2)
+    self.assertEqual(StockReservation.objects.get(user=self.user, product=self.product).quantity, 2)
+
+    guest = CustomUser.objects.create_user(username='guest', email='guest@example.com', password='secret')
+    guest_cart = Cart.objects.create(user=guest)
+    CartItem.objects.create(cart=guest_cart, product=self.product, quantity=3)
+    StockReservation.objects.create(user=guest, product=self.product, quantity=3, expires_at=timezone.now() + timedelta(minutes=5))
+    carts.merge_carts(self.cart.id, guest_cart.id)
+    self.assertFalse(StockReservation.objects.filter(user=guest).exists())
+    self.assertEqual(StockReservation.objects.get(user=self.user, product=self.product).quantity, 5)
+
+    self.assertEqual(self.client.post('/api/v1/carts/abc/items/batch/', {}, format='json').status_code, 404)
+
+  def test_summary_is_one_query_and_cached_until_something_changes(self):
+    self.client.post(self.url, {'product_id': self.product.id, 'quantity': 1}, format='json')
+    summary_url = f'/api/v1/carts/{self.cart.id}/summary/'
+    with self.captureOnCommitCallbacks(execute=True):
+      ShippingMethod.objects.create(name='Standard', rate='4.99')
+    cart_summary.shipping_methods()
+
+    with CaptureQueriesContext(connection) as queries:
+      self.assertEqual(self.client.get(summary_url).json()['lines'][0]['available'], 5)
+    self.assertEqual(len(queries), 1, [query['sql'] for query in queries.captured_queries])
+    self.assertIn('core_cartitem', queries[0]['sql'])
+    with CaptureQueriesContext(connection) as queries:
+      self.client.get(summary_url)
+    self.assertEqual(len(queries), 0, [query['sql'] for query in queries.captured_queries])
+
+    with self.captureOnCommitCallbacks(execute=True):
+      Product.objects.filter(id=self.product.id).update(price='12.00')
+    self.assertEqual(self.client.get(summary_url).json()['subtotal'], '12.00')
+    self.client.post(self.url, {'product_id': self.product.id, 'quantity': 1}, format='json')
+    self.assertEqual(self.client.get(summary_url).json()['subtotal'], '24.00')
+    with self.captureOnCommitCallbacks(execute=True):
+      ShippingMethod.objects.create(name='Express', rate='9.99')
+    self.assertEqual(len(self.client.get(summary_url).json()['shipping_quotes']), 2)
+
+    # Stock-only writes leave the summary cached; the next build sees them.
+    stock_shards.enable(self.product.id, 2)
+    stock_shards.take(self.product.id, 2)
+    self.assertEqual(self.client.get(summary_url).json()['lines'][0]['available'], 5)
+    cache.delete(cart_summary.summary_key(self.cart.id, cart_store.get(self.cart.id)['items']))
+    self.assertEqual(self.client.get(summary_url).json()['lines'][0]['available'], 3)
+
+    self.assertEqual(self.client.get('/api/v1/carts/abc/summary/').status_code, 404)
+    self.assertEqual(self.client.get('/api/v1/carts/abc/contents/').status_code, 404)
@@ -0,0 +1,94 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .models import ShippingDetail
+from .shipping import CarrierError, get_client
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 500
+DEFAULT_WORKERS = 10
+
+
+def workers():
+  return getattr(settings, 'TRACKING_REFRESH_WORKERS', DEFAULT_WORKERS)
+
+
+def pending():
+  """Shipments whose tracking can still change: they have a number and are not delivered."""
+  return (
+    ShippingDetail.objects.filter(tracking_number__isnull=False, delivered_at__isnull=True)
+    .exclude(tracking_number='')
+  )
+
+
+def pending_chunks(chunk_size=CHUNK_SIZE):
+  """Yield the ids of pending shipments in lists of ``chunk_size``, streamed from the database."""
+  chunk = []
+  for detail_id in pending().order_by('id').values_list('id', flat=True).iterator(chunk_size=chunk_size):
+    chunk.append(detail_id)
+    if len(chunk) == chunk_size:
+      yield chunk
+      chunk = []
+  if chunk:
+    yield chunk
+
+
+def _fetch(client, tracking_number):
+  try:
+    return client.get_tracking_info(tracking_number)
+  except CarrierError as e:
+    logger.warning(f"Tracking lookup for {tracking_number} failed: {e}")
+    return None
+  except Exception:
+    # One bad lookup must not abort the rest of the chunk.
+    logger.exception(f"Tracking lookup for {tracking_number} failed unexpectedly.")
+    return None
+
+
+def refresh_chunk(ids, max_workers=None):
+  """
+  Refresh the given pending shipments: look their tracking numbers up on the
+  carrier concurrently (the HTTP calls run in a thread pool, database access
+  stays on the calling thread) and write the changed rows with one
+  ``bulk_update``. Returns a report dict.
+  """
+  details = list(pending().filter(id__in=ids).only('id', 'tracking_number', 'shipped_at', 'delivered_at'))
+  client = get_client()
+  with ThreadPoolExecutor(max_workers=max_workers or workers()) as pool:
+    results = list(pool.map(lambda detail: _fetch(client, detail.tracking_number), details))
+
+  changed = [
+    detail for detail, info in zip(details, results)
+    if info is not None and detail.apply_tracking_info(info)
+  ]
+  # bulk_update skips post_save; shipment dates do not affect order totals.
+  ShippingDetail.objects.bulk_update(changed, ['shipped_at', 'delivered_at'])
+  return {
+    'checked': len(details),
+    'updated': len(changed),
+    'failed': sum(info is None for info in results),
+  }
+
+
+def refresh_all(chunk_size=CHUNK_SIZE, max_workers=None):
+  """
+  Refresh every pending shipment in this process, one chunk at a time.
+  Stops early while the carrier circuit breaker is open.
+  """
+  report = {'checked': 0, 'updated': 0, 'failed': 0, 'chunks': 0}
+  started = time.monotonic()
+  for ids in pending_chunks(chunk_size):
+    for key, value in refresh_chunk(ids, max_workers).items():
+      report[key] += value
+    report['chunks'] += 1
+    if get_client().breaker.state == 'open':
+      logger.warning("Carrier circuit is open; stopping the tracking refresh until the next run.")
+      break
+  report['seconds'] = round(time.monotonic() - started, 3)
+  logger.info(f"Refreshed tracking: {report}")
+  return report
@@ -17,6 +17,10 @@ router.register(r'cart-items', CartItemViewSet)
 router.register(r'shipping-methods', ShippingMethodViewSet)
 router.register(r'shipping-details', ShippingDetailViewSet)
 
+router.register(r'analytics/product-sales', ProductSalesViewSet)
+router.register(r'analytics/category-sales', CategorySalesViewSet)
+router.register(r'analytics/brand-sales', BrandSalesViewSet)
+
 
 urlpatterns = [
     path('', include(router.urls)),
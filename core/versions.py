@@ -0,0 +1,19 @@
+import time
+
+from django.core.cache import cache
+
+
+def get_version(key):
+  """
+  Current value of a cache version counter. Counters are seeded from the
+  clock, so one lost to eviction never reuses the keys of an older version.
+  """
+  return cache.get_or_set(key, time.time_ns(), None)
+
+
+def bump_version(key):
+  """Retire everything cached under the current version with one atomic ``incr``."""
+  try:
+    cache.incr(key)
+  except ValueError:
+    cache.add(key, time.time_ns(), None)
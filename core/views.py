@@ -1,84 +1,233 @@
 from rest_framework import viewsets, filters, status
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from rest_framework.parsers import MultiPartParser
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
+from rest_framework.renderers import JSONRenderer
+from django.db import transaction
+from django.db.models import Prefetch, Sum
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.cache import get_conditional_response
+from django_filters.rest_framework import DjangoFilterBackend
 from .models import *
 from .serializers import *
 from payment.serializers import PaymentSerializer
 from .pagination import CustomPageNumberPagination, AnotherCustomPageNumberPagination
-
+from .orders import place_order
+from . import order_status
+from . import analytics
+from . import cart_store
+from . import cart_summary
+from . import carts
+from .idempotency import idempotent
+from . import reservations
+from .search import ProductSearchFilter
+from .facets import FACETS, get_facets
+from .conditional import ConditionalGetMixin
+from .stock import adjust_stock
+from .shipping import CarrierError
+from . import shipping
+from .snapshots import snapshot_key, get_snapshot, store_snapshot
+from .exports import CONTENT_TYPES as EXPORT_CONTENT_TYPES, PassthroughRenderer, export_orders
+from .catalog_import import FORMATS as CATALOG_FORMATS, detect_format, iter_rows, import_catalog
+
+import csv
+import io
 import logging
+from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
   queryset = Category.objects.all()
   serializer_class = CategorySerializer
 
 
-class BrandViewSet(viewsets.ModelViewSet):
+class BrandViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
   queryset = Brand.objects.all()
   serializer_class = BrandSerializer
 
   
-class ProductViewSet(viewsets.ModelViewSet):
-  queryset = Product.objects.all()
+class ProductViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
+  queryset = Product.objects.select_related('brand', 'category')
   serializer_class = ProductSerializer
-  filter_backends = [filters.OrderingFilter, filters.SearchFilter]
-  search_fields = ['name']
+  conditional_fields = ['updated_at', 'brand__updated_at', 'category__updated_at']
+  filter_backends = [DjangoFilterBackend, filters.OrderingFilter, ProductSearchFilter]
+  filterset_fields = ['category', 'brand']
   ordering_fields = ['price', 'name']
+  ordering = ['id']
   pagination_class = CustomPageNumberPagination
 
+  def list(self, request, *args, **kwargs):
+    key = snapshot_key(request)
+    if key is not None:
+      snapshot = get_snapshot(key)
+      if snapshot is not None:
+        etag, content = snapshot
+        response = get_conditional_response(request, etag=etag) or HttpResponse(content, content_type='application/json')
+        response['ETag'] = etag
+        return response
+
+    response = super().list(request, *args, **kwargs)
+    # A 304 from the conditional check has no data to attach facets to.
+    if 'facets' in request.query_params and response.status_code == 200:
+      requested = [facet for facet in request.query_params['facets'].split(',') if facet in FACETS] or FACETS
+      queryset = self.filter_queryset(self.get_queryset())
+      response.data['facets'] = get_facets(queryset, request.query_params, requested)
+
+    if key is not None and response.status_code == 200:
+      response['ETag'] = store_snapshot(key, JSONRenderer().render(response.data))
+    return response
+
+  @action(detail=False, methods=['post'], url_path='import', permission_classes=[IsAdminUser], parser_classes=[MultiPartParser])
+  def import_feed(self, request):
+    upload = request.FILES.get('file')
+    if upload is None:
+      return Response({'error': 'A feed file is required.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    file_format = request.data.get('format') or detect_format(upload.name)
+    if file_format not in CATALOG_FORMATS:
+      return Response({'error': f"Format must be one of: {', '.join(CATALOG_FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+      batch_size = int(request.data.get('batch_size', 500))
+    except (TypeError, ValueError):
+      batch_size = 0
+    if batch_size < 1:
+      return Response({'error': 'batch_size must be a positive integer.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    batches = []
+    stream = io.TextIOWrapper(upload.file, encoding='utf-8', newline='')
+    try:
+      totals = import_catalog(iter_rows(stream, file_format), batch_size=batch_size, on_batch=batches.append)
+    except (ValueError, csv.Error) as e:
+      logger.error(f"Error reading catalog feed {upload.name}: {e}")
+      return Response({'error': 'Could not read the feed.', 'batch_reports': batches}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({**totals, 'batch_reports': batches}, status=status.HTTP_200_OK)
+
+  @action(detail=False, methods=['post'], url_path='stock-adjustments', permission_classes=[IsAdminUser])
+  def stock_adjustments(self, request):
+    serializer = BulkStockAdjustmentSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    applied, results = adjust_stock(
+      serializer.validated_data['adjustments'],
+      all_or_nothing=serializer.validated_data['all_or_nothing'],
+    )
+    return Response({
+      'applied': applied,
+      'failed': sum(1 for result in results if result['status'] == 'error'),
+      'results': results,
+    }, status=status.HTTP_200_OK)
+
 
 class OrderViewSet(viewsets.ModelViewSet):
   queryset = Order.objects.all()
   serializer_class = OrderSerializer
   permission_classes = [IsAuthenticated]
   pagination_class = AnotherCustomPageNumberPagination
+  filter_backends = [filters.OrderingFilter]
+  ordering_fields = ['order_date']
+  ordering = ['-order_date']
 
 
   def get_queryset(self):
     user = self.request.user
-    return Order.objects.filter(user=user)
+    return (
+      Order.objects.filter(user=user)
+      .with_totals()
+      .select_related('shippingdetail__shipping_method')
+      .prefetch_related(
+        Prefetch('orderitem_set', queryset=OrderItem.objects.select_related('product__brand', 'product__category').order_by('id'))
+      )
+    )
 
   def create(self, request, *args, **kwargs):
+    # Retried checkouts carrying the same Idempotency-Key replay the first response.
+    return idempotent('orders', request, lambda: self.create_order(request))
+
+  def create_order(self, request):
+    serializer = self.get_serializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
     try:
-        serializer = self.get_serializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
         order = self.perform_create(serializer)
-        self._create_order_items(order)
-        headers = self.get_success_headers(serializer.data)
-        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+    except serializers.ValidationError:
+        raise
     except Exception as e:
         logger.error(f"Error creating order: {e}", exc_info=True)
         return Response({'error': 'An error occurred while creating the order.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    data = self.get_serializer(self.get_queryset().get(pk=order.pk)).data
+    headers = self.get_success_headers(data)
+    return Response(data, status=status.HTTP_201_CREATED, headers=headers)
 
   def perform_create(self, serializer):
-    order = serializer.save(user=self.request.user)
-    self._create_order_items(order)
-
-    self._create_shipping_detail(order)
-
-    return order
-
-  def _create_order_items(self, order):
-    order_items_data = self.request.data.get('order_items', [])
-    serializer = OrderItemSerializer(data=order_items_data, many=True, context={'order_id': order.id})
-    if serializer.is_valid():
-        serializer.save()
-    else:
-        raise serializers.ValidationError(serializer.errors)
-    
-
-
-  def _create_shipping_detail(self, order):
-    shipping_method_id = self.request.data.get('shipping_method')
-    if shipping_method_id:
-      shipping_method = ShippingMethod.objects.get(id=shipping_method_id)
-      ShippingDetail.objects.create(order=order, shipping_method=shipping_method)
+    order_items = self.request.data.get('order_items', [])
+    return place_order(self.request.user, order_items, **serializer.validated_data)
     
   
+  @action(
+    detail=False, methods=['get'], url_path=r'export/(?P<export_format>csv|ndjson)',
+    renderer_classes=[JSONRenderer, PassthroughRenderer],
+  )
+  def export(self, request, export_format=None):
+    orders = Order.objects.all()
+    user_id = request.query_params.get('user')
+    if not request.user.is_staff:
+      orders = orders.filter(user=request.user)
+    elif user_id:
+      if not user_id.isdigit():
+        return JsonResponse({'error': "'user' must be a user id."}, status=status.HTTP_400_BAD_REQUEST)
+      orders = orders.filter(user_id=int(user_id))
+
+    # Compare the raw column against datetime bounds so the order_date index is usable.
+    for param, lookup, offset in (('from', 'order_date__gte', 0), ('to', 'order_date__lt', 1)):
+      value = request.query_params.get(param)
+      if not value:
+        continue
+      try:
+        day = parse_date(value)
+      except ValueError:
+        day = None
+      if day is None:
+        return JsonResponse({'error': f"'{param}' must be a date (YYYY-MM-DD)."}, status=status.HTTP_400_BAD_REQUEST)
+      bound = timezone.make_aware(datetime.combine(day + timedelta(days=offset), datetime.min.time()))
+      orders = orders.filter(**{lookup: bound})
+
+    response = StreamingHttpResponse(export_orders(orders, export_format), content_type=EXPORT_CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = f'attachment; filename="orders.{export_format}"'
+    return response
+
+  @action(detail=True, methods=['post'], permission_classes=[IsAdminUser])
+  def transition(self, request, pk=None):
+    serializer = OrderTransitionSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    order = get_object_or_404(Order, pk=pk)
+    order_status.transition(order, serializer.validated_data['status'], user=request.user, source='staff')
+    return Response({'id': order.id, 'status': order.status}, status=status.HTTP_200_OK)
+
+  @action(detail=False, methods=['post'], url_path='bulk-transition', permission_classes=[IsAdminUser])
+  def bulk_transition(self, request):
+    serializer = BulkOrderTransitionSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    data = serializer.validated_data
+
+    orders = Order.objects.all()
+    if 'ids' in data:
+      orders = orders.filter(id__in=data['ids'])
+    if 'current_status' in data:
+      orders = orders.filter(status=data['current_status'])
+    if 'tracking_delivered' in data:
+      orders = orders.filter(shippingdetail__delivered_at__isnull=not data['tracking_delivered'])
+    if 'placed_before' in data:
+      orders = orders.filter(order_date__lt=data['placed_before'])
+
+    moved = order_status.bulk_transition(orders, data['status'], user=request.user)
+    return Response({'status': data['status'], 'transitioned': moved}, status=status.HTTP_200_OK)
+
   @action(detail=True, methods=['get'])
   def track(self, request, pk=None):
     order = self.get_object()
@@ -123,11 +272,107 @@ class ReviewViewSet(viewsets.ModelViewSet):
 
 
 class CartViewSet(viewsets.ModelViewSet):
-  queryset = Cart.objects.all()
+  queryset = Cart.objects.prefetch_related('cartitem_set')
   serializer_class = CartSerializer
   permission_classes = [IsAuthenticated]
   pagination_class = AnotherCustomPageNumberPagination
 
+  def get_queryset(self):
+    queryset = super().get_queryset()
+    if not self.request.user.is_staff:
+      queryset = queryset.filter(user=self.request.user)
+    return queryset
+
+  @action(detail=True, methods=['post'])
+  def checkout(self, request, pk=None):
+    cart = self.get_object()
+    cart_store.flush_user(cart.user_id)
+    return Response({'reservations': reservations.reserve_cart(cart.user)})
+
+  def _stored_cart(self, request, pk):
+    # Ownership is checked against the cached entry so cart edits stay off the database.
+    if not str(pk).isdigit():
+      raise NotFound()
+    entry = cart_store.get(int(pk))
+    if entry is None or (entry['user'] != request.user.id and not request.user.is_staff):
+      raise NotFound()
+    return entry
+
+  def _hold_line(self, pk, product_id):
+    # Same holds as CartItemViewSet: the owner's whole quantity of the product across their carts.
+    # Called by the cart store under the cart's lock, with the quantity it is about to write.
+    # With the owner's carts cached this is the only query of a cart edit.
+    def hold(entry, quantity):
+      others = cart_store.user_quantities(entry['user'], [product_id], exclude_cart=int(pk))[product_id]
+      reservations.reserve(entry['user'], product_id, quantity + others)
+    return hold
+
+  def _contents(self, pk, entry):
+    items = [{'product_id': product_id, 'quantity': quantity} for product_id, quantity in sorted(entry['items'].items())]
+    return Response({'cart': int(pk), 'items': items})
+
+  def _own_cart(self, request, cart_id):
+    if not str(cart_id).isdigit():
+      raise NotFound()
+    cart = Cart.objects.filter(id=cart_id).first()
+    if cart is None or (cart.user_id != request.user.id and not request.user.is_staff):
+      raise NotFound()
+    return cart
+
+  @action(detail=True, methods=['post'], url_path='items/batch')
+  def batch_items(self, request, pk=None):
+    """Add to (``mode: add``) or set (``mode: set``) many lines in one upsert."""
+    cart = self._own_cart(request, pk)
+    serializer = CartBatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    lines = [(line['product_id'], line['quantity']) for line in serializer.validated_data['items']]
+    written = carts.upsert_lines(cart.id, lines, serializer.validated_data['mode'])
+    items = CartItem.objects.filter(cart=cart).order_by('product_id').values('product_id', 'quantity')
+    return Response({'cart': cart.id, 'written': written, 'items': list(items)}, status=status.HTTP_200_OK)
+
+  @action(detail=True, methods=['post'])
+  def merge(self, request, pk=None):
+    """Merge ``source_cart`` (e.g. a guest cart picked up at login) into this cart."""
+    cart = self._own_cart(request, pk)
+    serializer = CartMergeSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    source = self._own_cart(request, serializer.validated_data['source_cart'])
+    merged = carts.merge_carts(cart.id, source.id)
+    items = CartItem.objects.filter(cart=cart).order_by('product_id').values('product_id', 'quantity')
+    return Response({'cart': cart.id, 'merged': merged, 'items': list(items)}, status=status.HTTP_200_OK)
+
+  @action(detail=True, methods=['get'])
+  def summary(self, request, pk=None):
+    """Lines with live prices and availability, the subtotal and a quote per shipping method."""
+    entry = self._stored_cart(request, pk)
+    return Response(cart_summary.get_summary(int(pk), entry))
+
+  @action(detail=True, methods=['get', 'post'])
+  def contents(self, request, pk=None):
+    """Live cart contents from the cart store; POST adds ``quantity`` of ``product_id``."""
+    entry = self._stored_cart(request, pk)
+    if request.method == 'GET':
+      return self._contents(pk, entry)
+
+    serializer = CartLineSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    product_id = serializer.validated_data['product_id']
+    quantity = serializer.validated_data['quantity']
+    # The hold reads the product's stock, so it also rejects unknown products.
+    return self._contents(pk, cart_store.add(int(pk), product_id, quantity, hold=self._hold_line(pk, product_id)))
+
+  @action(detail=True, methods=['put', 'delete'], url_path=r'contents/(?P<product_id>[0-9]+)')
+  def content_line(self, request, pk=None, product_id=None):
+    """PUT sets a product's quantity (0 removes it); DELETE removes it."""
+    self._stored_cart(request, pk)
+    if request.method == 'DELETE':
+      return self._contents(pk, cart_store.remove(int(pk), int(product_id), hold=self._hold_line(pk, int(product_id))))
+
+    serializer = CartLineUpdateSerializer(data={'product_id': product_id, 'quantity': request.data.get('quantity')})
+    serializer.is_valid(raise_exception=True)
+    quantity = serializer.validated_data['quantity']
+    return self._contents(pk, cart_store.update(int(pk), int(product_id), quantity, hold=self._hold_line(pk, int(product_id))))
+
 
 class CartItemViewSet(viewsets.ModelViewSet):
   queryset = CartItem.objects.all()
@@ -135,6 +380,107 @@ class CartItemViewSet(viewsets.ModelViewSet):
   permission_classes = [IsAuthenticated]
   pagination_class = AnotherCustomPageNumberPagination
 
+  def get_queryset(self):
+    queryset = super().get_queryset()
+    if not self.request.user.is_staff:
+      queryset = queryset.filter(cart__user=self.request.user)
+    return queryset
+
+  def _check_cart(self, cart):
+    # Same answer as an unknown id, so other users' carts are not revealed.
+    if cart.user_id != self.request.user.id and not self.request.user.is_staff:
+      raise serializers.ValidationError({'cart': [f'Invalid pk "{cart.pk}" - object does not exist.']})
+
+  def _reserve(self, user, product_id, quantity=0, exclude=None):
+    # Hold the whole quantity the user has of this product across their carts.
+    lines = CartItem.objects.filter(cart__user=user, product_id=product_id)
+    if exclude is not None:
+      lines = lines.exclude(pk=exclude.pk)
+    reservations.reserve(user, product_id, quantity + sum(lines.values_list('quantity', flat=True)))
+
+  def perform_create(self, serializer):
+    data = serializer.validated_data
+    self._check_cart(data['cart'])
+    with transaction.atomic():
+      carts.sync_store(data['cart'].id)
+      self._reserve(data['cart'].user, data['product'].id, data['quantity'])
+      serializer.save()
+      carts.touch(data['cart'].id)
+
+  def perform_update(self, serializer):
+    instance = serializer.instance
+    cart = serializer.validated_data.get('cart', instance.cart)
+    product = serializer.validated_data.get('product', instance.product)
+    quantity = serializer.validated_data.get('quantity', instance.quantity)
+    previous_cart_id = instance.cart_id
+    self._check_cart(cart)
+    with transaction.atomic():
+      carts.sync_store(*{previous_cart_id, cart.id})
+      if product.id != instance.product_id or cart.user_id != instance.cart.user_id:
+        self._reserve(instance.cart.user, instance.product_id, exclude=instance)
+      self._reserve(cart.user, product.id, quantity, exclude=instance)
+      serializer.save()
+      carts.touch(previous_cart_id, cart.id)
+
+  def perform_destroy(self, instance):
+    with transaction.atomic():
+      carts.sync_store(instance.cart_id)
+      self._reserve(instance.cart.user, instance.product_id, exclude=instance)
+      instance.delete()
+      carts.touch(instance.cart_id)
+
+
+
+class SalesRollupViewSet(viewsets.ReadOnlyModelViewSet):
+  """
+  Daily sales rollups, optionally limited with ``?from=`` and ``?to=``. The
+  ``totals`` action sums the range per entity, highest revenue first.
+  """
+  permission_classes = [IsAdminUser]
+  pagination_class = AnotherCustomPageNumberPagination
+  filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
+  ordering_fields = ['day', 'units', 'revenue', 'orders']
+  ordering = ['-day']
+  entity = None
+
+  def get_queryset(self):
+    return analytics.filter_days(super().get_queryset(), self.request.query_params)
+
+  @action(detail=False, methods=['get'])
+  def totals(self, request):
+    try:
+      limit = max(1, min(int(request.query_params.get('limit', 20)), 1000))
+    except ValueError:
+      return Response({'error': 'limit must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+    rows = (
+      self.filter_queryset(self.get_queryset())
+      .values(self.entity)
+      .annotate(units=Sum('units'), revenue=Sum('revenue'), orders=Sum('orders'))
+      .order_by('-revenue', self.entity)[:limit]
+    )
+    return Response(list(rows))
+
+
+class ProductSalesViewSet(SalesRollupViewSet):
+  queryset = DailyProductSales.objects.all()
+  serializer_class = DailyProductSalesSerializer
+  filterset_fields = ['product']
+  entity = 'product'
+
+
+class CategorySalesViewSet(SalesRollupViewSet):
+  queryset = DailyCategorySales.objects.all()
+  serializer_class = DailyCategorySalesSerializer
+  filterset_fields = ['category']
+  entity = 'category'
+
+
+class BrandSalesViewSet(SalesRollupViewSet):
+  queryset = DailyBrandSales.objects.all()
+  serializer_class = DailyBrandSalesSerializer
+  filterset_fields = ['brand']
+  entity = 'brand'
+
 
 
 class ShippingMethodViewSet(viewsets.ModelViewSet):
@@ -159,13 +505,21 @@ class ShippingDetailViewSet(viewsets.ReadOnlyModelViewSet):
     def retrieve(self, request, pk=None):
         try:
             shipping_detail = self.get_object()
-            shipping_detail.update_tracking_info()
+            try:
+                shipping_detail.update_tracking_info()
+            except CarrierError as e:
+                # Serve the last known tracking state rather than failing on a degraded carrier.
+                logger.warning(f"Tracking refresh for shipping detail {shipping_detail.pk} skipped: {e}")
             serializer = self.get_serializer(shipping_detail)
             return Response(serializer.data)
         except ShippingDetail.DoesNotExist:
             return Response({'error': 'Tracking information not found.'}, status=status.HTTP_404_NOT_FOUND)
 
     
+    @action(detail=False, methods=['get'], url_path='carrier-stats', permission_classes=[IsAdminUser])
+    def carrier_stats(self, request):
+        return Response(shipping.get_client().stats())
+
     @action(detail=False, methods=['post'], url_path='update-tracking')
     def update_tracking(self, request, *args, **kwargs):
       order_id =  request.data.get('order_id')
@@ -1,13 +1,16 @@
 from rest_framework import viewsets, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.conf import settings
-from django.db import transaction
 from core.models import Order
+from core.idempotency import idempotent
+from core.order_status import transition
+from rest_framework.exceptions import ValidationError
 from .serializers import PaymentSerializer
 import stripe
 import logging
@@ -17,26 +20,33 @@ logger = logging.getLogger(__name__)
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
 class PaymentViewSet(viewsets.ViewSet):
+    permission_classes = [IsAuthenticated]
 
     def create(self, request):
+        return idempotent('payments', request, lambda: self.create_payment(request))
+
+    def create_payment(self, request):
         serializer = PaymentSerializer(data=request.data)
 
         if serializer.is_valid():
             order_id = serializer.validated_data.get('order_id')
             try:
-                with transaction.atomic():
-                    order = Order.objects.get(id=order_id)
+                # Only the order's owner can pay for it; anyone else's order is reported as not found.
+                order = Order.objects.with_totals().get(id=order_id, user=request.user)
 
-                    total_amount = order.total_amount()
+                total_amount = order.grand_total_amount
+                # Stripe keys are shared across the whole account; make the client's key unique to this user and order.
+                key = request.headers.get('Idempotency-Key')
 
-                    payment_intent = stripe.PaymentIntent.create(
-                        amount=int(total_amount * 100),
-                        currency=serializer.validated_data['currency'],
-                        payment_method_types=serializer.validated_data['payment_method_types']
-                    )
+                payment_intent = stripe.PaymentIntent.create(
+                    amount=int(total_amount * 100),
+                    currency=serializer.validated_data['currency'],
+                    payment_method_types=serializer.validated_data['payment_method_types'],
+                    idempotency_key=f"{request.user.id}:{order.id}:{key}" if key else None,
+                )
 
-                    order.payment_intent_id = payment_intent.id
-                    order.save()
+                order.payment_intent_id = payment_intent.id
+                order.save(update_fields=['payment_intent_id'])
 
                 return Response({
                     'payment_intent_id': payment_intent.id,
@@ -58,6 +68,14 @@ class PaymentViewSet(viewsets.ViewSet):
 
 @method_decorator(csrf_exempt, name='dispatch')
 class StripeWebhookView(APIView):
+    @staticmethod
+    def move_order(order, to_status, event_id):
+        # Stripe redelivers events; a move the order already made (or can no longer make) is only logged.
+        try:
+            transition(order, to_status, source='stripe-webhook')
+        except ValidationError as e:
+            logger.warning(f'Ignoring event {event_id} for order {order.id}: {e.detail}')
+
     def post(self, request):
         event = None
         payload = request.body
@@ -84,8 +102,7 @@ class StripeWebhookView(APIView):
             payment_intent_id = event['data']['object']['id']
             try:
                 order = Order.objects.get(payment_intent_id=payment_intent_id)
-                order.status = 'paid'
-                order.save(update_fields=['status'])
+                self.move_order(order, 'paid', event_id)
                 return JsonResponse({'message': 'Payment succeeded'}, status=status.HTTP_200_OK)
             except Order.DoesNotExist:
                 logger.error(f'Order with payment_intent_id {payment_intent_id} does not exist.')
@@ -95,8 +112,7 @@ class StripeWebhookView(APIView):
             payment_intent_id = event['data']['object']['id']
             try:
                 order = Order.objects.get(payment_intent_id=payment_intent_id)
-                order.status = 'failed'
-                order.save(update_fields=['status'])
+                self.move_order(order, 'failed', event_id)
                 return JsonResponse({'message': 'Payment failed'}, status=status.HTTP_400_BAD_REQUEST)
             except Order.DoesNotExist:
                 logger.error(f'Order with payment_intent_id {payment_intent_id} does not exist.')
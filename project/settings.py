@@ -169,6 +169,30 @@ CORS_ALLOW_ALL_ORIGINS = True
 #Carrier API Configuration
 CARRIER_API_URL = 'https://api.examplecarrier.com/track'
 CARRIER_API_KEY = 'your-api-key'
+CARRIER_API_TIMEOUT = (3.05, 10)  # (connect, read) seconds
+CARRIER_API_RETRIES = 2
+CARRIER_API_POOL_SIZE = 10
+CARRIER_BREAKER_THRESHOLD = 5
+CARRIER_BREAKER_RESET_TIMEOUT = 30
+
+#Shared cache. The cart store, catalog snapshots, facet counts and cache locks are read and written by
+#every web and Celery process, so it must not be process-local (LocMemCache) in deployment.
+#Without CACHE_URL (local development, tests) a process-local cache is used; the core.E001
+#deploy check (manage.py check --deploy) flags it, e.g. CACHE_URL=redis://localhost:6379/1.
+CACHE_URL = os.environ.get('CACHE_URL', 'locmem://')
+if CACHE_URL.startswith('locmem://'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
 
 #Celery Configuration
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
@@ -178,6 +202,50 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 
+CELERY_BEAT_SCHEDULE = {
+    'purge-expired-stock-reservations': {
+        'task': 'core.tasks.purge_expired_reservations',
+        'schedule': timedelta(minutes=5),
+    },
+    'purge-expired-idempotency-keys': {
+        'task': 'core.tasks.purge_expired_idempotency_keys',
+        'schedule': timedelta(hours=1),
+    },
+    'rebalance-stock-shards': {
+        'task': 'core.tasks.rebalance_stock_shards',
+        'schedule': timedelta(minutes=1),
+    },
+    'update-sales-rollups': {
+        'task': 'core.tasks.update_sales_rollups',
+        'schedule': timedelta(minutes=5),
+    },
+    'flush-cart-store': {
+        'task': 'core.tasks.flush_cart_store',
+        'schedule': timedelta(seconds=30),
+    },
+    'purge-abandoned-carts': {
+        'task': 'core.tasks.purge_abandoned_carts',
+        'schedule': timedelta(days=1),
+    },
+}
+
+#Stock reservations made from carts and checkout expire after this long
+STOCK_RESERVATION_TTL = timedelta(minutes=15)
+
+#Responses stored for Idempotency-Key retries of order and payment creation are kept this long
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+
+#Carts edited through the cart store stay cached this long; changes are flushed to the database every 30 seconds
+CART_STORE_TIMEOUT = timedelta(days=7)
+
+#Carts not edited for this long are deleted by the nightly purge; set an archive directory to keep a gzipped NDJSON copy
+ABANDONED_CART_MAX_AGE = timedelta(days=30)
+ABANDONED_CART_ARCHIVE_DIR = None
+
+#Undelivered shipments are looked up on the carrier this many at a time; fan out queues each chunk as its own task
+TRACKING_REFRESH_WORKERS = CARRIER_API_POOL_SIZE
+TRACKING_REFRESH_FAN_OUT = False
+
 
 # run this on another terminal for handling the tasks 
 # celery -A your_project_name worker --loglevel=info